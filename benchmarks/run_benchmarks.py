@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Benchmarks for the model hot paths.
+
+Times `runoff_nrcs`, `runoff_pitt`, `simulate_cell_day`,
+`create_modified_census`, `dict_plus`, `simulate_water_quality` and
+`simulate_day` on synthetic censuses of increasing size, and writes the
+results as JSON so that runs can be compared between commits:
+
+    python benchmarks/run_benchmarks.py -o before.json
+    git checkout my-branch
+    python benchmarks/run_benchmarks.py -o after.json --compare before.json
+"""
+
+import argparse
+import copy
+import json
+import platform
+import random
+import subprocess
+import sys
+import timeit
+from itertools import product
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+from tr55.model import runoff_nrcs, runoff_pitt, simulate_cell_day, \
+    create_modified_census, simulate_water_quality, simulate_day
+from tr55.operations import dict_plus
+from tr55.tablelookup import lookup_cn, lookup_ki, lookup_nlcd, \
+    is_built_type, get_bmps
+from tr55.tables import LAND_USE_VALUES
+
+# Defined here rather than imported, so that older revisions of the
+# model, whose tables do not list the soil types, can be measured too.
+SOIL_TYPES = ['a', 'b', 'c', 'd']
+
+PRECIPS = [0.1, 0.5, 1.0, 2.0, 4.0]
+ET = 0.207
+
+# (distinct cell types, tree depth, modifications) of the synthetic
+# censuses.  The depth is that of the distribution of the census that
+# `create_modified_census`, `simulate_water_quality` and `simulate_day`
+# are given; `dict_plus` only tallies the first level.
+FULL_SIZES = [(4, 1, 0), (16, 1, 4), (64, 1, 16), (64, 3, 16),
+              (128, 1, 64), (128, 4, 64)]
+QUICK_SIZES = [(4, 1, 0), (16, 2, 4)]
+
+
+def _ok(lookup, *args):
+    try:
+        lookup(*args)
+        return True
+    except KeyError:
+        return False
+
+
+def land_uses():
+    """
+    The land uses for which every table has an entry.
+    """
+    return sorted(land_use for land_use in LAND_USE_VALUES
+                  if _ok(lookup_ki, land_use) and
+                  _ok(lookup_nlcd, land_use) and
+                  all(_ok(lookup_cn, soil, land_use) for soil in SOIL_TYPES))
+
+
+def make_census(types, modifications, seed=0):
+    """
+    Make a census (as taken by `simulate_day`) with the given number of
+    distinct cell types and modifications.
+    """
+    rng = random.Random(seed)
+    cells = ['%s:%s' % cell for cell in product(SOIL_TYPES, land_uses())]
+    cells = rng.sample(cells, min(types, len(cells)))
+    distribution = dict((cell, {'cell_count': rng.randint(1, 1000)})
+                        for cell in cells)
+
+    bmps = [bmp for bmp in sorted(get_bmps()) if _ok(lookup_ki, bmp)]
+    changes = ([':%s:' % land_use for land_use in land_uses()] +
+               ['::%s' % bmp for bmp in bmps] +
+               ['::no_till', '::cluster_housing'])
+    mods = []
+    for _ in range(modifications):
+        cell = rng.choice(cells)
+        n = rng.randint(0, distribution[cell]['cell_count'] // 4)
+        mods.append({
+            'change': rng.choice(changes),
+            'cell_count': n,
+            'distribution': {cell: {'cell_count': n}}
+        })
+
+    return {
+        'cell_count': sum(sub['cell_count'] for sub in distribution.values()),
+        'distribution': distribution,
+        'modifications': mods,
+        'BMPs': dict((bmp, rng.randint(1, 50)) for bmp in bmps)
+    }
+
+
+def make_tree(census, depth):
+    """
+    Make a copy of a census whose distribution has the given depth.
+    Below the first level, each cell type is split in two: half stays
+    as it is and half is changed to the next cell type.  The
+    modifications and BMPs of the census are kept.
+    """
+    cells = sorted(census['distribution'])
+
+    def grow(cell, n, level):
+        if level == depth or n < 2:
+            return {'cell_count': n}
+        other = cells[(cells.index(cell) + 1) % len(cells)]
+        half = n // 2
+        children = {cell: grow(cell, n - half, level + 1)}
+        if other != cell:
+            children[other] = grow(other, half, level + 1)
+        else:
+            children[cell]['cell_count'] += half
+        return {'cell_count': n, 'distribution': children}
+
+    tree = dict(census)
+    tree['distribution'] = dict(
+        (cell, grow(cell, sub['cell_count'], 1))
+        for (cell, sub) in census['distribution'].items())
+    return tree
+
+
+def time_call(fn, min_time):
+    """
+    Return the best time per call of `fn` in seconds, running it
+    enough times to take at least `min_time` seconds per repeat.
+    """
+    number = 1
+    while True:
+        elapsed = timeit.Timer(fn).timeit(number)
+        if elapsed >= min_time or number >= 1000000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    times = timeit.Timer(fn).repeat(3, number)
+    return min(times) / number
+
+
+def peak_memory(fn):
+    """
+    Return the peak memory allocated while running `fn` once, in bytes
+    (or None if that cannot be measured).
+    """
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmarks(sizes):
+    """
+    Generate (name, parameters, function, cells per call, AoIs per
+    call) for every benchmark.
+    """
+    leaves = [(precip, soil, land_use)
+              for (precip, soil, land_use)
+              in product(PRECIPS, SOIL_TYPES, land_uses())]
+    built = [leaf for leaf in leaves if is_built_type(leaf[2])]
+
+    def nrcs():
+        for (precip, soil, land_use) in leaves:
+            runoff_nrcs(precip, ET, soil, land_use)
+
+    def pitt():
+        for (precip, soil, land_use) in built:
+            runoff_pitt(precip, ET, soil, land_use)
+
+    def cell_day():
+        for (precip, soil, land_use) in leaves:
+            simulate_cell_day(precip, ET, '%s:%s:' % (soil, land_use), 10)
+
+    yield ('runoff_nrcs', {}, nrcs, len(leaves), None)
+    yield ('runoff_pitt', {}, pitt, len(built), None)
+    yield ('simulate_cell_day', {}, cell_day, len(leaves), None)
+
+    def fn(cell, cell_count):
+        return simulate_cell_day(2.0, ET, cell, cell_count)
+
+    for (types, depth, modifications) in sizes:
+        params = {'types': types, 'depth': depth,
+                  'modifications': modifications}
+        flat = make_census(types, modifications)
+        census = make_tree(flat, depth)
+        cells = census['cell_count']
+        tree = dict((key, census[key]) for key in
+                    ['cell_count', 'distribution'])
+        tallies = [{'cell_count': sub['cell_count'], 'runoff-vol': 1.0,
+                    'et-vol': 0.5, 'inf-vol': 0.5, 'tn': 0.1, 'tp': 0.1,
+                    'bod': 0.1, 'tss': 0.1}
+                   for sub in flat['distribution'].values()]
+
+        def modified(census=census):
+            create_modified_census(census)
+
+        def plus(tallies=tallies):
+            tally = {}
+            for subtree in tallies:
+                tally = dict_plus(tally, subtree)
+
+        # `simulate_water_quality` fills in the tree that it is given,
+        # so each call gets a fresh copy (which is included in the time).
+        def water_quality(tree=tree):
+            simulate_water_quality(copy.deepcopy(tree), 10, fn)
+
+        def day(census=census):
+            simulate_day(census, 2.0)
+
+        yield ('create_modified_census', params, modified, cells, 1)
+        yield ('dict_plus', params, plus, None, None)
+        yield ('simulate_water_quality', params, water_quality, cells, 1)
+        yield ('simulate_day', params, day, cells, 1)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD']).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, min_time):
+    results = []
+    for (name, params, fn, cells, aois) in benchmarks(sizes):
+        seconds = time_call(fn, min_time)
+        result = {
+            'name': name,
+            'params': params,
+            'seconds': seconds,
+            'cells_per_s': cells / seconds if cells else None,
+            'aois_per_s': aois / seconds if aois else None,
+            'peak_bytes': peak_memory(fn),
+        }
+        results.append(result)
+        print('%-24s %-44s %12.1f us' % (
+            name, json.dumps(params, sort_keys=True), seconds * 1e6))
+        sys.stdout.flush()
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'results': results
+    }
+
+
+def _key(result):
+    return (result['name'], json.dumps(result['params'], sort_keys=True))
+
+
+def compare(old, new):
+    """
+    Print the ratio of the old to the new time of every benchmark in
+    both runs.
+    """
+    old_times = dict((_key(result), result['seconds'])
+                     for result in old['results'])
+    print('\nSpeedup over %s:' % (old.get('revision') or 'baseline'))
+    for result in new['results']:
+        key = _key(result)
+        if key in old_times:
+            print('%-24s %-44s %8.2fx' % (key[0], key[1],
+                                         old_times[key] / result['seconds']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the model hot paths.')
+    parser.add_argument('-o', '--output', help='write the results to this '
+                        'JSON file')
+    parser.add_argument('--compare', help='compare with the results in this '
+                        'JSON file')
+    parser.add_argument('--quick', action='store_true',
+                        help='only run the small censuses')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum time of each repeat in seconds')
+    args = parser.parse_args(argv)
+
+    results = run(QUICK_SIZES if args.quick else FULL_SIZES, args.min_time)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(json.load(previous), results)
+
+
+if __name__ == '__main__':
+    main()
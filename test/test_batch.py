@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Batch runner tests.
+"""
+
+import io
+import json
+import unittest
+
+from tr55.model import simulate_day
+from tr55.batch import simulate_lines, run_batch
+from test_model import CENSUS_1, CENSUS_2
+
+RECORDS = [
+    {'id': 'one', 'census': CENSUS_1, 'precip': 2.0},
+    {'census': CENSUS_2, 'precip': 0.984, 'cell_res': 30},
+    {'id': 2, 'census': CENSUS_1, 'precip': 1.2, 'precolumbian': True},
+]
+LINES = [json.dumps(record) for record in RECORDS]
+
+
+class TestBatch(unittest.TestCase):
+    """
+    Batch runner test set.
+    """
+    def test_in_process(self):
+        """
+        Test simulating records in this process.
+        """
+        outputs = [json.loads(line)
+                   for line in simulate_lines(LINES, processes=0)]
+        self.assertEqual([output['index'] for output in outputs], [0, 1, 2])
+        self.assertEqual(outputs[0]['id'], 'one')
+        self.assertNotIn('id', outputs[1])
+        self.assertEqual(outputs[2]['id'], 2)
+        for (record, output) in zip(RECORDS, outputs):
+            expected = simulate_day(record['census'], record['precip'],
+                                    record.get('cell_res', 10),
+                                    record.get('precolumbian', False))
+            self.assertEqual(output['result'],
+                             json.loads(json.dumps(expected)))
+
+    def test_errors(self):
+        """
+        Test that bad records are reported without stopping the batch.
+        """
+        lines = ['{"precip": 1}', '', 'nonsense', LINES[0]]
+        outputs = [json.loads(line)
+                   for line in simulate_lines(lines, processes=0)]
+        self.assertEqual(len(outputs), 3)
+        self.assertTrue(outputs[0]['error'].startswith('ValueError'))
+        self.assertIn('error', outputs[1])
+        self.assertIn('result', outputs[2])
+        self.assertEqual(outputs[2]['index'], 2)
+
+    def test_pool(self):
+        """
+        Test that a process pool gives the same output, in order or
+        not.
+        """
+        lines = LINES * 4
+        expected = list(simulate_lines(lines, processes=0))
+        ordered = list(simulate_lines(lines, processes=2, max_in_flight=3))
+        self.assertEqual(ordered, expected)
+        unordered = simulate_lines(lines, processes=2, max_in_flight=3,
+                                   ordered=False)
+        self.assertEqual(sorted(unordered), sorted(expected))
+
+    def test_run_batch(self):
+        """
+        Test reading and writing files of JSON lines.
+        """
+        input_file = io.StringIO('\n'.join(LINES) + '\n')
+        output_file = io.StringIO()
+        run_batch(input_file, output_file, processes=0)
+        self.assertEqual(output_file.getvalue().splitlines(),
+                         list(simulate_lines(LINES, processes=0)))
+
+if __name__ == "__main__":
+    unittest.main()
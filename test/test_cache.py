@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Result cache tests.
+"""
+
+import copy
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from tr55.cache import census_hash, result_key, DirectoryStore, \
+    SQLiteStore, ResultCache, Coalescer
+from tr55.model import normalize_census, simulate_day
+from tr55.tables import LAND_USE_VALUES
+from tr55.tablelookup import invalidate_tables
+
+from test_model import CENSUS_1, CENSUS_1_VARIANT, CENSUS_2
+
+
+class TestCache(unittest.TestCase):
+    """
+    Result cache test set.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_census_hash(self):
+        """
+        Test that censuses describing the same area have the same
+        hash.
+        """
+        self.assertEqual(census_hash(CENSUS_1_VARIANT), census_hash(CENSUS_1))
+        self.assertNotEqual(census_hash(CENSUS_1), census_hash(CENSUS_2))
+
+    def test_key(self):
+        """
+        Test that keys depend on all of the arguments and on the
+        tables.
+        """
+        cache = ResultCache(DirectoryStore(self.directory))
+        key = cache.key(CENSUS_1, 2.0)
+        reordered = dict(reversed(list(CENSUS_1.items())))
+        reordered['distribution'] = dict(
+            reversed(list(CENSUS_1['distribution'].items())))
+        self.assertEqual(cache.key(reordered, 2), key)
+        self.assertNotEqual(cache.key(CENSUS_1_VARIANT, 2.0), key)
+        self.assertEqual(cache.key(normalize_census(CENSUS_1_VARIANT), 2.0),
+                         cache.key(normalize_census(CENSUS_1), 2.0))
+        self.assertEqual(cache.key(CENSUS_1, 2.0, 10, False), key)
+        self.assertNotEqual(cache.key(CENSUS_1, 2.5), key)
+        self.assertNotEqual(cache.key(CENSUS_1, 2.0, 30), key)
+        self.assertNotEqual(cache.key(CENSUS_1, 2.0, 10, True), key)
+
+        pasture = LAND_USE_VALUES['pasture']
+        ki = pasture['ki']
+        try:
+            pasture['ki'] = 0.5
+            invalidate_tables()
+            self.assertNotEqual(cache.key(CENSUS_1, 2.0), key)
+        finally:
+            pasture['ki'] = ki
+            invalidate_tables()
+        self.assertEqual(cache.key(CENSUS_1, 2.0), key)
+
+    def check_store(self, store):
+        cache = ResultCache(store)
+        expected = simulate_day(CENSUS_2, 1.5)
+        self.assertEqual(cache.simulate_day(CENSUS_2, 1.5), expected)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+        # A new cache object (as in another process) finds the result.
+        cache = ResultCache(store)
+        self.assertEqual(cache.simulate_day(CENSUS_2, 1.5), expected)
+        self.assertEqual(cache.simulate_day(CENSUS_2, 1.5), expected)
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+
+        self.assertEqual(cache.simulate_day(CENSUS_2, 1.5, precolumbian=True),
+                         simulate_day(CENSUS_2, 1.5, precolumbian=True))
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+        # Results are those of the given census, so censuses that only
+        # share a normal form have entries of their own.
+        padded = copy.deepcopy(CENSUS_1)
+        padded['distribution']['b:pasture'] = {'cell_count': 0}
+        self.assertEqual(cache.simulate_day(padded, 1.5),
+                         simulate_day(padded, 1.5))
+        self.assertEqual(cache.simulate_day(CENSUS_1, 1.5),
+                         simulate_day(CENSUS_1, 1.5))
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+
+    def test_directory_store(self):
+        """
+        Test that results are cached in a directory.
+        """
+        self.check_store(DirectoryStore(os.path.join(self.directory, 'cache')))
+
+    def test_sqlite_store(self):
+        """
+        Test that results are cached in an SQLite database.
+        """
+        self.check_store(SQLiteStore(os.path.join(self.directory,
+                                                  'cache.sqlite')))
+
+    def run_concurrently(self, coalescer, functions, release):
+        """
+        Call the given functions in threads of their own, setting the
+        `release` event once all but one of them are waiting for
+        another call, and return their results (or exceptions).
+        """
+        results = [None] * len(functions)
+
+        def run(i):
+            try:
+                results[i] = functions[i]()
+            except Exception as error:
+                results[i] = error
+
+        threads = [threading.Thread(target=run, args=(i,))
+                   for i in range(len(functions))]
+        for thread in threads:
+            thread.start()
+        deadline = time.time() + 10
+        while coalescer.stats()['coalesced'] < len(functions) - 1 and \
+                time.time() < deadline:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalescer(self):
+        """
+        Test that concurrent identical simulations are computed once,
+        and that each call gets a result of its own.
+        """
+        release = threading.Event()
+        calls = []
+
+        def simulate(census, precip, cell_res, precolumbian):
+            calls.append(census)
+            release.wait(10)
+            return simulate_day(census, precip, cell_res, precolumbian)
+
+        def simulate_and_change():
+            result = coalescer.simulate_day(CENSUS_1, 2.0)
+            result['unmodified']['runoff'] = -1.0
+            del result['modified']['distribution']
+            return result
+
+        coalescer = Coalescer(simulate)
+        functions = [simulate_and_change] + \
+            [lambda: coalescer.simulate_day(CENSUS_1, 2.0)] * 7
+        results = self.run_concurrently(coalescer, functions, release)
+        self.assertEqual(calls, [CENSUS_1])
+        self.assertEqual(coalescer.stats(), {'calls': 8, 'computed': 1,
+                                             'coalesced': 7, 'in_flight': 0})
+
+        # Whichever call computed the result, the changes to the first
+        # one do not show in the others.
+        expected = simulate_day(CENSUS_1, 2.0)
+        self.assertEqual(results[0]['unmodified']['runoff'], -1.0)
+        for result in results[1:]:
+            self.assertEqual(result, expected)
+            self.assertIsNot(result, results[0])
+        self.assertEqual(len(set(id(result) for result in results)), 8)
+
+        # Calls after the computation has finished compute it again.
+        coalescer.simulate_day(CENSUS_1, 2.0)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(coalescer.computed, 2)
+
+    def test_coalescer_error(self):
+        """
+        Test that the calls waiting for a computation that fails get
+        its exception.
+        """
+        release = threading.Event()
+
+        def fail():
+            release.wait(10)
+            raise ValueError('No result')
+
+        coalescer = Coalescer()
+        key = result_key(CENSUS_2, 1.0)
+        results = self.run_concurrently(
+            coalescer, [lambda: coalescer.call(key, fail)] * 3, release)
+        self.assertEqual(coalescer.stats()['computed'], 1)
+        for result in results:
+            self.assertIsInstance(result, ValueError)
+        self.assertEqual(coalescer.stats()['in_flight'], 0)
+
+if __name__ == "__main__":
+    unittest.main()
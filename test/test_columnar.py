@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Columnar result tests.
+"""
+
+import json
+import unittest
+
+import numpy as np
+
+from tr55.model import simulate_day
+from tr55.registry import get_registry
+from tr55.compiled import compile_census, simulate_days, \
+    simulate_scenarios
+from tr55.columnar import ColumnarTree, to_dict
+from test_model import CENSUS_1, CENSUS_2
+from test_compiled import CENSUS_3, day_of
+
+
+class TestColumnar(unittest.TestCase):
+    """
+    Columnar result test set.
+    """
+    def assertRoundTrip(self, census, precips):
+        compiled = compile_census(census)
+        for precip in precips:
+            for precolumbian in [False, True]:
+                expected = simulate_day(census, precip,
+                                        precolumbian=precolumbian)
+                actual = compiled.simulate(precip, precolumbian=precolumbian,
+                                           columnar=True)
+                self.assertIsInstance(actual['unmodified'], ColumnarTree)
+                self.assertIsInstance(actual['modified'], ColumnarTree)
+                # JSON tells 0 and 0.0 apart, and so must the converter.
+                self.assertEqual(json.dumps(to_dict(actual), sort_keys=True),
+                                 json.dumps(expected, sort_keys=True))
+
+    def test_round_trip_1(self):
+        """
+        Test that the columnar result converts back to the result of
+        `simulate_day`.
+        """
+        self.assertRoundTrip(CENSUS_1, [0.0, 0.3, 2, 4.429])
+
+    def test_round_trip_2(self):
+        """
+        Test the round trip with lots of BMPs.
+        """
+        self.assertRoundTrip(CENSUS_2, [0.0, 0.984, 4.429])
+
+    def test_round_trip_3(self):
+        """
+        Test the round trip with empty cell types.
+        """
+        self.assertRoundTrip(CENSUS_3, [0.05, 1.2, 3.5])
+
+    def test_levels(self):
+        """
+        Test the levels of a columnar result.
+        """
+        registry = get_registry()
+        result = compile_census(CENSUS_3).simulate(1.2, columnar=True)
+        tree = result['modified']
+        self.assertEqual(len(tree.levels), 3)
+        self.assertEqual(len(tree), sum(len(level) for level in tree.levels))
+
+        (root, cells, changes) = tree.levels
+        self.assertEqual(root['code'].tolist(), [-1])
+        self.assertEqual(root['parent'].tolist(), [-1])
+        self.assertEqual(root['cell_count'].tolist(), [12])
+        self.assertEqual(tree.extras[(0, 0)]['BMPs'],
+                         {'infiltration_basin': 3})
+        self.assertEqual(sorted(registry.cells[code]
+                                for code in cells['code'].tolist()),
+                         ['a:developed_low:', 'b:grassland:',
+                          'c:cultivated_crops:', 'd:open_water:'])
+        self.assertEqual(cells['parent'].tolist(), [0, 0, 0, 0])
+        np.testing.assert_array_equal(
+            np.bincount(changes['parent'], changes['cell_count'],
+                        minlength=len(cells))[cells['simulated']],
+            cells['cell_count'][cells['simulated']])
+
+        # An empty leaf is not simulated and has no pollutant loads.
+        cells = result['unmodified'].levels[1]
+        grassland = cells[cells['code'] == registry.code('b:grassland')][0]
+        self.assertFalse(grassland['simulated'])
+        self.assertEqual(grassland['runoff'], 0)
+        self.assertTrue(np.isnan(grassland['tn']))
+
+    def test_simulate_days(self):
+        """
+        Test columnar results with one value per day.
+        """
+        precips = [0.0, 0.5, 2.0]
+        tree = simulate_days(CENSUS_2, precips, columnar=True)['modified']
+        self.assertEqual(tree.levels[1]['runoff'].shape,
+                         (len(tree.levels[1]), len(precips)))
+        result = tree.to_dict()
+        for (day, precip) in enumerate(precips):
+            self.assertEqual(day_of(result, day),
+                             simulate_day(CENSUS_2, precip)['modified'])
+
+    def test_simulate_days_copies(self):
+        """
+        Test that the nodes of a series converted to dictionaries have
+        arrays of their own.
+        """
+        tree = simulate_days(CENSUS_3, [0.5, 1.0],
+                             columnar=True)['unmodified']
+        result = tree.to_dict()
+        runoff = result['runoff'].tolist()
+        grassland = result['distribution']['b:grassland']
+        grassland['runoff'] += 1
+        self.assertEqual(grassland['et'].tolist(), [0.0, 0.0])
+        result['runoff'] += 1
+        again = tree.to_dict()
+        grassland = again['distribution']['b:grassland']
+        self.assertEqual(grassland['runoff'].tolist(), [0.0, 0.0])
+        self.assertEqual(again['runoff'].tolist(), runoff)
+
+    def test_simulate_scenarios(self):
+        """
+        Test columnar scenario results.
+        """
+        results = simulate_scenarios(CENSUS_1, 1.5, columnar=True)
+        self.assertEqual(to_dict(results),
+                         simulate_scenarios(CENSUS_1, 1.5))
+
+if __name__ == "__main__":
+    unittest.main()
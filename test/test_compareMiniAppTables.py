@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Mini-app table comparison tests.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from tr55.compareMiniAppTables import normalize_land, normalize_soil, \
+    read_table, join_tables, compare_tables
+
+OLD_TABLE = '''P,land,soil,ET,I,R
+2.0,71,2,0.1,1.6,0.2
+2.0,71,3,0.1,1.5,0.3
+2.0,22,0,0.2,1.2,0.5
+5.0,22,0,0.2,3.0,1.8
+5.0,22,0,0.3,2.9,1.8
+'''
+
+NEW_TABLE = '''P,land,soil,ET,I,R
+5,developed_low,a,0.22,2.97,1.81
+2,grassland,c,0.12419999999999999,1.6100773216841155,0.2657226783158845
+2,developed_low:green_roof,a,0.2,1.5,0.3
+2,developed_low,a,0.2,1.34,0.46
+3,grassland,c,0.1,2.0,0.9
+'''
+
+
+class TestCompareMiniAppTables(unittest.TestCase):
+    """
+    Mini-app table comparison test set.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.old = self.write('old.csv', OLD_TABLE)
+        self.new = self.write('new.csv', NEW_TABLE)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as table:
+            table.write(text)
+        return read_table(path)
+
+    def test_normalize(self):
+        """
+        Test that land uses and soil types are normalized to NLCD
+        classes and indices.
+        """
+        self.assertEqual(normalize_land('grassland'), '71')
+        self.assertEqual(normalize_land('71'), '71')
+        self.assertEqual(normalize_land('developed_low:green_roof'),
+                         'developed_low:green_roof')
+        self.assertEqual(normalize_soil('c'), 2)
+        self.assertEqual(normalize_soil('2'), 2)
+        self.assertEqual(self.new['land'].tolist(),
+                         ['22', '71', 'developed_low:green_roof', '22', '71'])
+        self.assertEqual(self.new['soil'].tolist(), [0, 2, 0, 0, 2])
+
+    def test_join(self):
+        """
+        Test that rows are joined on (P, land, soil), whatever their
+        order.
+        """
+        (old_index, new_index, duplicates) = join_tables(self.old, self.new)
+        self.assertEqual(sorted(zip(old_index.tolist(), new_index.tolist())),
+                         [(0, 1), (2, 3), (3, 0)])
+        self.assertEqual(duplicates, (1, 0))
+
+    def test_compare(self):
+        """
+        Test the error statistics of a comparison.
+        """
+        report = compare_tables(self.old, self.new)
+        self.assertEqual(report['old_rows'], 5)
+        self.assertEqual(report['new_rows'], 5)
+        self.assertEqual(report['matched'], 3)
+
+        errors = {
+            'ET': [0.02, 0.0242, 0.0],
+            'I': [0.03, 0.0100773216841155, 0.14],
+            'R': [0.01, 0.0657226783158845, 0.04]
+        }
+        expected = {
+            'ET': [0.2, 0.1, 0.2],
+            'I': [3.0, 1.6, 1.2],
+            'R': [1.8, 0.2, 0.5]
+        }
+        for (name, error) in errors.items():
+            stats = report['columns'][name]
+            self.assertAlmostEqual(stats['max_abs'], max(error))
+            self.assertAlmostEqual(stats['mean_abs'], np.mean(error))
+            relative = [e / x for (e, x) in zip(error, expected[name])]
+            self.assertAlmostEqual(stats['max_rel'], max(relative))
+            self.assertAlmostEqual(stats['mean_rel'], np.mean(relative))
+        self.assertEqual(report['columns']['ET']['mismatches'], 0)
+        self.assertEqual(report['columns']['I']['mismatches'], 1)
+        self.assertEqual(report['columns']['R']['mismatches'], 1)
+        self.assertEqual(report['mismatches'], 2)
+        self.assertEqual(report['mismatches_by_land'], {'22': 1, '71': 1})
+
+        report = compare_tables(self.old, self.new, decimals=0)
+        self.assertEqual(report['mismatches'], 0)
+
+    def test_compare_nothing_matched(self):
+        """
+        Test that a comparison without any matching rows has no error
+        statistics.
+        """
+        old = self.write('other.csv', 'P,land,soil,ET,I,R\n'
+                         '1.0,11,0,0.0,0.0,1.0\n')
+        report = compare_tables(old, self.new)
+        self.assertEqual(report['matched'], 0)
+        self.assertIsNone(report['columns']['R']['max_abs'])
+        self.assertEqual(report['mismatches_by_land'], {})
+
+    def test_missing_column(self):
+        """
+        Test that tables without the expected columns are reported.
+        """
+        with self.assertRaises(ValueError) as context:
+            self.write('bad.csv', 'P,land,ET,I,R\n2.0,71,0.1,1.6,0.2\n')
+        self.assertIn('has no soil column', str(context.exception))
+
+if __name__ == "__main__":
+    unittest.main()
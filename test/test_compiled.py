@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Compiled census tests.
+"""
+
+import copy
+import unittest
+
+import numpy as np
+
+from tr55.model import simulate_day
+from tr55.compiled import compile_census, simulate_days, \
+    simulate_scenarios
+from test_model import CENSUS_1, CENSUS_2
+
+# A census with empty cell types, a modification that takes every cell
+# of a type, and a Pre-Columbian BMP.
+CENSUS_3 = {
+    'cell_count': 12,
+    'BMPs': {
+        'infiltration_basin': 3
+    },
+    'distribution': {
+        'a:developed_low': {'cell_count': 4},
+        'b:grassland': {'cell_count': 0},
+        'c:cultivated_crops': {'cell_count': 6},
+        'd:open_water': {'cell_count': 2}
+    },
+    'modifications': [
+        {
+            'change': ':developed_high:green_roof',
+            'cell_count': 4,
+            'distribution': {
+                'a:developed_low': {'cell_count': 4}
+            }
+        },
+        {
+            'change': '::no_till',
+            'cell_count': 2,
+            'distribution': {
+                'c:cultivated_crops': {'cell_count': 2}
+            }
+        }
+    ]
+}
+
+
+def day_of(tree, day):
+    """
+    Pick the values of one day out of the result of `simulate_days`.
+    """
+    result = {}
+    for (key, value) in tree.items():
+        if isinstance(value, dict):
+            result[key] = day_of(value, day)
+        elif isinstance(value, np.ndarray):
+            result[key] = value[day]
+        else:
+            result[key] = value
+    return result
+
+
+class TestCompiled(unittest.TestCase):
+    """
+    Compiled census test set.
+    """
+    def assertSameAsDay(self, census, precips):
+        compiled = compile_census(census)
+        for precip in precips:
+            for precolumbian in [False, True]:
+                expected = simulate_day(census, precip,
+                                        precolumbian=precolumbian)
+                actual = compiled.simulate(precip, precolumbian=precolumbian)
+                self.assertEqual(actual, expected)
+
+    def test_simulate_1(self):
+        """
+        Test that compiled simulation matches `simulate_day`.
+        """
+        self.maxDiff = None
+        self.assertSameAsDay(CENSUS_1, [0.0, 0.3, 0.984, 2, 4.429])
+
+    def test_simulate_2(self):
+        """
+        Test compiled simulation with lots of BMPs.
+        """
+        self.maxDiff = None
+        self.assertSameAsDay(CENSUS_2, [0.0, 0.3, 0.984, 2, 4.429])
+
+    def test_simulate_3(self):
+        """
+        Test compiled simulation with empty cell types.
+        """
+        self.maxDiff = None
+        self.assertSameAsDay(CENSUS_3, [0.05, 1.2, 3.5])
+
+    def test_cell_res(self):
+        """
+        Test compiled simulation with a different cell resolution.
+        """
+        compiled = compile_census(CENSUS_2)
+        self.assertEqual(compiled.simulate(1.5, cell_res=30),
+                         simulate_day(CENSUS_2, 1.5, cell_res=30))
+
+    def test_independent_of_census(self):
+        """
+        Test that changing a census does not change its compiled form.
+        """
+        census = copy.deepcopy(CENSUS_1)
+        compiled = compile_census(census)
+        expected = compiled.simulate(2)
+        census['distribution']['c:developed_high']['cell_count'] = 1
+        census['modifications'].pop()
+        self.assertEqual(compiled.simulate(2), expected)
+
+    def test_simulate_scenarios(self):
+        """
+        Test that the scenarios match the corresponding results of
+        `simulate_day`.
+        """
+        self.maxDiff = None
+        for census in [CENSUS_1, CENSUS_2, CENSUS_3]:
+            for precip in [0.0, 0.3, 2, 4.429]:
+                day = simulate_day(census, precip)
+                precolumbian = simulate_day(census, precip, precolumbian=True)
+                expected = {
+                    'current': day['unmodified'],
+                    'modified': day['modified'],
+                    'precolumbian': precolumbian['unmodified']
+                }
+                self.assertEqual(simulate_scenarios(census, precip), expected)
+
+    def test_simulate_some_scenarios(self):
+        """
+        Test simulating a subset of the scenarios.
+        """
+        compiled = compile_census(CENSUS_1)
+        actual = compiled.simulate_scenarios(1.2, ['precolumbian'], 30)
+        expected = simulate_day(CENSUS_1, 1.2, 30, True)['unmodified']
+        self.assertEqual(actual, {'precolumbian': expected})
+        self.assertRaises(ValueError, compiled.simulate_scenarios, 1.2,
+                          ['future'])
+
+    def test_simulate_days(self):
+        """
+        Test that each day of a series matches `simulate_day`.
+        """
+        self.maxDiff = None
+        precips = [0.0, 0.3, 0.984, 2, 4.429]
+        for census in [CENSUS_1, CENSUS_2, CENSUS_3]:
+            for precolumbian in [False, True]:
+                result = simulate_days(census, precips,
+                                       precolumbian=precolumbian)
+                self.assertEqual(result['modified']['runoff'].shape, (5,))
+                for (day, precip) in enumerate(precips):
+                    expected = simulate_day(census, precip,
+                                            precolumbian=precolumbian)
+                    for key in ['unmodified', 'modified']:
+                        self.assertEqual(day_of(result[key], day),
+                                         expected[key])
+
+    def test_simulate_days_empty_nodes(self):
+        """
+        Test that the values of empty nodes in a series are arrays of
+        their own.
+        """
+        result = simulate_days(CENSUS_3, [0.5, 1.0])['unmodified']
+        grassland = result['distribution']['b:grassland']
+        arrays = [grassland[key] for key in ['runoff', 'et', 'inf']]
+        self.assertEqual(len(set(id(array) for array in arrays)), 3)
+        grassland['runoff'] += 1
+        self.assertEqual(grassland['et'].tolist(), [0.0, 0.0])
+        self.assertEqual(result['runoff'].shape, (2,))
+
+    def test_simulate_days_et(self):
+        """
+        Test a series of days with varying maximum evapotranspiration.
+        """
+        compiled = compile_census(CENSUS_1)
+        precips = [0.5, 1.0, 2.0]
+        result = compiled.simulate_days(precips, [0.207] * 3)
+        expected = compiled.simulate_days(precips)
+        for day in range(3):
+            self.assertEqual(day_of(result['modified'], day),
+                             day_of(expected['modified'], day))
+        result = compiled.simulate_days(precips, [0.0, 0.1, 0.3])
+        unmodified = result['unmodified']
+        self.assertEqual(unmodified['et'][0], 0.0)
+        self.assertTrue(unmodified['et'][2] > unmodified['et'][1])
+        for day in range(3):
+            total = unmodified['runoff'][day] + unmodified['et'][day] + \
+                unmodified['inf'][day]
+            self.assertAlmostEqual(total, precips[day])
+
+    def test_invalid_census(self):
+        """
+        Test that invalid censuses are rejected.
+        """
+        census = {
+            'cell_count': 1,
+            'distribution': {'b:developed_med': {'cell_count': 1}},
+            'modifications': [
+                {
+                    'change': ':deciduous_forest:',
+                    'cell_count': 1,
+                    'distribution': {'b:developed_low': {'cell_count': 1}}
+                }
+            ]
+        }
+        self.assertRaises(ValueError, compile_census, census)
+
+        census = {
+            'cell_count': 1,
+            'distribution': {'b:developed_mid': {'cell_count': 1}}
+        }
+        self.assertRaises(KeyError, compile_census, census)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Instrumentation tests.
+"""
+
+import threading
+import unittest
+
+from tr55 import registry
+from tr55.model import simulate_day
+from tr55.instrumentation import collect, count_leaves, phase
+from test_model import CENSUS_1
+
+PHASES = set([
+    'verify_census',
+    'create_modified_census',
+    'simulate_water_quality.modified',
+    'compute_bmp_effect',
+    'apply_bmp_effect',
+    'postpass.modified',
+    'create_unmodified_census',
+    'simulate_water_quality.unmodified',
+    'postpass.unmodified'
+])
+
+
+class TestInstrumentation(unittest.TestCase):
+    """
+    Instrumentation test set.
+    """
+    def test_phases(self):
+        """
+        Test that the phases of `simulate_day` are measured.
+        """
+        with collect() as collector:
+            simulate_day(CENSUS_1, 2.0)
+        self.assertEqual(set(collector.phases.keys()), PHASES)
+        for measurements in collector.phases.values():
+            self.assertEqual(measurements['calls'], 1)
+            self.assertTrue(measurements['seconds'] >= 0)
+        unmodified = collector.phases['simulate_water_quality.unmodified']
+        self.assertEqual(unmodified['leaves'],
+                         len(CENSUS_1['distribution']))
+        # The BMP effect is applied to leaves that are already simulated.
+        self.assertEqual(collector.phases['apply_bmp_effect']['leaves'], 0)
+
+    def test_compilations(self):
+        """
+        Test that the cell types compiled by the registry are counted
+        by phase.
+        """
+        shared = registry._registry
+        try:
+            fresh = registry._registry = registry.CellRegistry()
+            with collect() as collector:
+                simulate_day(CENSUS_1, 2.0)
+            compiled = sum(measurements['compilations']
+                           for measurements in collector.phases.values())
+            self.assertEqual(compiled, len(fresh))
+            self.assertEqual(collector.phases['verify_census']['compilations'],
+                             len(fresh))
+
+            with collect() as collector:
+                with phase('outer'):
+                    fresh.code('a:open_water')
+                    with phase('inner'):
+                        fresh.columns()
+                simulate_day(CENSUS_1, 2.0)
+        finally:
+            registry._registry = shared
+        self.assertEqual(collector.phases['outer']['compilations'], 0)
+        self.assertEqual(collector.phases['inner']['compilations'], 1)
+        self.assertEqual(collector.phases['verify_census']['compilations'],
+                         0)
+
+    def test_callback(self):
+        """
+        Test that the callback gets every run of every phase.
+        """
+        runs = []
+        with collect(lambda name, run: runs.append((name, run))):
+            simulate_day(CENSUS_1, 2.0)
+            simulate_day(CENSUS_1, 1.0)
+        self.assertEqual(len(runs), 2 * len(PHASES))
+        self.assertEqual(set(name for (name, _) in runs), PHASES)
+        self.assertTrue(all(run['calls'] == 1 for (_, run) in runs))
+
+    def test_disabled(self):
+        """
+        Test that nothing is measured without a collector.
+        """
+        def fn(cell, cell_count):
+            return {}
+        self.assertIs(count_leaves(fn), fn)
+        self.assertIsNone(registry._compile_hook)
+        with collect():
+            self.assertIsNotNone(registry._compile_hook)
+        self.assertIsNone(registry._compile_hook)
+
+    def test_per_thread(self):
+        """
+        Test that a collector only measures its own thread.
+        """
+        def other():
+            with phase('other'):
+                simulate_day(CENSUS_1, 2.0)
+
+        with collect() as collector:
+            thread = threading.Thread(target=other)
+            thread.start()
+            thread.join()
+        self.assertEqual(collector.phases, {})
+
+if __name__ == "__main__":
+    unittest.main()
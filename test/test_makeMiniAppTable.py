@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Mini-app table tests.
+"""
+
+import csv
+import io
+import unittest
+
+from tr55.model import simulate_day
+from tr55.makeMiniAppTable import HEADER, table_chunks, write_table, \
+    cm_to_inches, inches_to_cm
+
+PRECIP_CM = [0, 0.5, 3, 21]
+LAND_USES = ['open_water', 'developed_med', 'developed_low:green_roof',
+             'cultivated_crops:no_till']
+SOIL_TYPES = ['a', 'c', 'd']
+
+
+class TestMiniAppTable(unittest.TestCase):
+    """
+    Mini-app table test set.
+    """
+    def test_rows(self):
+        """
+        Test that each row of the table has what `simulate_day` gives
+        for a single cell.
+        """
+        rows = [row for chunk in table_chunks(PRECIP_CM, LAND_USES,
+                                              SOIL_TYPES)
+                for row in chunk]
+        self.assertEqual(len(rows),
+                         len(PRECIP_CM) * len(LAND_USES) * len(SOIL_TYPES))
+        for (precip, land_use, soil, et, inf, runoff) in rows:
+            cell = '%s:%s' % ('abcd'[soil], land_use)
+            census = {
+                'cell_count': 1,
+                'distribution': {cell: {'cell_count': 1}}
+            }
+            result = simulate_day(census, cm_to_inches(precip))['unmodified']
+            self.assertEqual((et, inf, runoff),
+                             (inches_to_cm(result['et']),
+                              inches_to_cm(result['inf']),
+                              inches_to_cm(result['runoff'])))
+
+    def test_chunks(self):
+        """
+        Test that the chunk size does not change the table.
+        """
+        whole = list(table_chunks(PRECIP_CM, LAND_USES, SOIL_TYPES))
+        chunks = list(table_chunks(PRECIP_CM, LAND_USES, SOIL_TYPES,
+                                   chunk_size=5))
+        self.assertEqual(len(whole), 1)
+        self.assertEqual(len(chunks), 10)
+        self.assertTrue(all(len(chunk) <= 5 for chunk in chunks))
+        self.assertEqual(sum(chunks, []), whole[0])
+
+    def test_write_table(self):
+        """
+        Test that the written table is what the csv module writes.
+        """
+        expected = io.StringIO()
+        writer = csv.writer(expected)
+        writer.writerow(HEADER)
+        for chunk in table_chunks(PRECIP_CM, LAND_USES, SOIL_TYPES):
+            writer.writerows(chunk)
+
+        actual = io.StringIO()
+        count = write_table(actual, PRECIP_CM, LAND_USES, SOIL_TYPES,
+                            chunk_size=7)
+        self.assertEqual(count, 48)
+        self.assertEqual(actual.getvalue(), expected.getvalue())
+
+    def test_unknown_land_use(self):
+        """
+        Test that unknown land uses are reported.
+        """
+        with self.assertRaises(KeyError):
+            list(table_chunks(PRECIP_CM, ['not_a_land_use'], SOIL_TYPES))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Batch (census matrix) simulation tests.
+"""
+
+import unittest
+
+from tr55.model import simulate_day
+from tr55.matrix import census_matrix, simulate_censuses
+from test_model import CENSUS_1, CENSUS_2
+
+CENSUS_3 = {
+    'cell_count': 9,
+    'distribution': {
+        'a:developed_open': {'cell_count': 4},
+        'b:herbaceous_wetlands': {'cell_count': 0},
+        'd:cultivated_crops': {'cell_count': 5}
+    }
+}
+
+
+class TestMatrix(unittest.TestCase):
+    """
+    Batch simulation test set.
+    """
+    def test_census_matrix(self):
+        """
+        Test the construction of the sparse census matrix.
+        """
+        matrix = census_matrix([CENSUS_1, CENSUS_3])
+        self.assertEqual(matrix.shape, (2, 6))
+        dense = matrix.toarray()
+        self.assertEqual(dense.sum(axis=1).tolist(), [147, 9])
+        self.assertEqual(matrix.cell_counts.tolist(), [147, 9])
+
+    def test_simulate_censuses(self):
+        """
+        Test that batch results match those of `simulate_day`.
+        """
+        censuses = [CENSUS_1, CENSUS_2, CENSUS_3, CENSUS_1]
+        for precip in [0.0, 0.4, 1.7, 5.0]:
+            for precolumbian in [False, True]:
+                results = simulate_censuses(censuses, precip,
+                                            cell_res=30,
+                                            precolumbian=precolumbian)
+                self.assertEqual(len(results), len(censuses))
+                for (census, actual) in zip(censuses, results):
+                    expected = simulate_day(census, precip, cell_res=30,
+                                            precolumbian=precolumbian)
+                    expected = expected['unmodified']
+                    for key in actual:
+                        self.assertEqual(actual[key], expected[key])
+
+if __name__ == "__main__":
+    unittest.main()
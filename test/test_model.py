@@ -7,13 +7,22 @@ from __future__ import division
 Model test set
 """
 
+import copy
 import unittest
 
-from tr55.model import runoff_nrcs, runoff_pitt, \
+import numpy as np
+
+from tr55 import model, registry
+from tr55.model import runoff_nrcs, runoff_nrcs_array, nrcs_runoff, \
+    runoff_pitt, runoff_pitt_array, \
     simulate_cell_day, simulate_water_quality, \
     create_unmodified_census, create_modified_census, \
-    simulate_day, compute_bmp_effect
-from tr55.tablelookup import lookup_ki
+    simulate_day, simulate_modifications, compute_bmp_effect, \
+    validate_census, normalize_census, normalize_cell, ResponseCache, \
+    set_response_cache
+from tr55.tables import LAND_USE_VALUES
+from tr55.tablelookup import lookup_ki, lookup_cn, lookup_pitt_index, \
+    invalidate_tables
 
 # These data are taken directly from Table 2-1 of the revised (1986)
 # TR-55 report.  The data in the PS array are various precipitation
@@ -255,6 +264,65 @@ CENSUS_2 = {
     ]
 }
 
+# CENSUS_1, with its entries in another order, other spellings of its
+# cell types, a duplicate cell type and entries without cells.
+CENSUS_1_VARIANT = {
+    'modifications': [
+        {
+            'change': 'D:Barren_Land:',
+            'cell_count': 5,
+            'distribution': {
+                'A:deciduous_forest:': {
+                    'cell_count': 5
+                }
+            },
+        },
+        {
+            'change': '::no_till',
+            'cell_count': 30,
+            'distribution': {
+                'd:developed_med': {
+                    'cell_count': 10
+                },
+                'c:developed_high': {
+                    'cell_count': 20
+                },
+                'b:pasture': {
+                    'cell_count': 0
+                }
+            }
+        },
+        {
+            'change': '::cluster_housing',
+            'cell_count': 0,
+            'distribution': {
+                'd:developed_med': {
+                    'cell_count': 0
+                }
+            }
+        }
+    ],
+    'distribution': {
+        'd:developed_med': {
+            'cell_count': 33
+        },
+        'a:deciduous_forest': {
+            'cell_count': 70
+        },
+        'A:Deciduous_Forest': {
+            'cell_count': 2
+        },
+        'c:developed_high:': {
+            'cell_count': 42
+        },
+        'b:pasture': {
+            'cell_count': 0
+        }
+    },
+    'BMPs': {},
+    'cell_count': 147
+}
+
 DAY_OUTPUT_2 = {
     'unmodified': {
         'BMPs': {
@@ -478,6 +546,38 @@ class TestModel(unittest.TestCase):
                    for precip in PS]
         self.assertEqual(runoffs, CN95)
 
+    def test_nrcs_array(self):
+        """
+        Test that the vectorized runoff equation matches the scalar one.
+        """
+        precips = PS + [0.0, 0.05, 0.1, 0.2, 0.3, 0.5]
+        cells = [('a', 'open_water'), ('b', 'deciduous_forest'),
+                 ('c', 'developed_high'), ('d', 'pasture'),
+                 ('a', 'woody_wetlands'), ('b', 'no_till')]
+        for evaptrans in [0.0, 0.207, 0.5]:
+            for (soil_type, land_use) in cells:
+                expected = [runoff_nrcs(precip, evaptrans, soil_type, land_use)
+                            for precip in precips]
+                actual = runoff_nrcs_array(precips, evaptrans,
+                                           lookup_cn(soil_type, land_use))
+                self.assertEqual(actual.tolist(), expected)
+
+    def test_nrcs_array_off_grid(self):
+        """
+        Test that the vectorized runoff equation matches the scalar one
+        bit for bit away from the table values too.
+        """
+        random = np.random.RandomState(0)
+        precips = random.uniform(0.0, 15.0, 20000)
+        evaptrans = random.uniform(0.0, 0.3, 20000)
+        curve_numbers = random.uniform(30.0, 100.0, 20000)
+        expected = [nrcs_runoff(precip, et, curve_number)
+                    for (precip, et, curve_number)
+                    in zip(precips.tolist(), evaptrans.tolist(),
+                           curve_numbers.tolist())]
+        actual = runoff_nrcs_array(precips, evaptrans, curve_numbers)
+        self.assertEqual(actual.tolist(), expected)
+
     def test_pitt(self):
         """
         Test the implementation of the SSH/Pitt runoff model.
@@ -498,6 +598,34 @@ class TestModel(unittest.TestCase):
                               for runoff in PITT_RES_A]
         self.assertEqual(runoff_modeled, runnoff_test_suite)
 
+    def test_pitt_array(self):
+        """
+        Test that the vectorized SSH/Pitt model matches the scalar one
+        bit for bit, on and off the rainfall steps.
+        """
+        precips = PS_PITT + [0.0, 0.005, 0.5, 1.0, 4.0, 5.0, 7.5] + \
+            np.random.RandomState(0).uniform(0.0, 6.0, 200).tolist()
+        cells = [('c', 'developed_high'), ('b', 'developed_open'),
+                 ('a', 'developed_low'), ('d', 'developed_med'),
+                 ('b', 'cluster_housing')]
+        evaptranses = []
+        land_uses = []
+        soil_types = []
+        expected = []
+        for evaptrans in [0.0, 0.207]:
+            for (soil_type, land_use) in cells:
+                (land_index, soil_index) = lookup_pitt_index(soil_type,
+                                                             land_use)
+                for precip in precips:
+                    evaptranses.append(evaptrans)
+                    land_uses.append(land_index)
+                    soil_types.append(soil_index)
+                    expected.append(runoff_pitt(precip, evaptrans,
+                                                soil_type, land_use))
+        actual = runoff_pitt_array(precips * 2 * len(cells), evaptranses,
+                                   land_uses, soil_types)
+        self.assertEqual(actual.tolist(), expected)
+
     def test_simulate_cell_day(self):
         """
         Test the simulate_cell_day function.
@@ -685,6 +813,54 @@ class TestModel(unittest.TestCase):
         actual = set(distrib.keys())
         self.assertEqual(actual, expected)
 
+    def test_create_modified_census_5(self):
+        """
+        create_modified_census accumulates repeated changes and leaves
+        its input alone.
+        """
+        census = {
+            "cell_count": 5,
+            "distribution": {
+                "a:developed_low": {"cell_count": 3},
+                "b:pasture": {"cell_count": 2}
+            },
+            "modifications": [
+                {
+                    "change": "::rain_garden",
+                    "cell_count": 2,
+                    "distribution": {
+                        "a:developed_low": {"cell_count": 1},
+                        "b:pasture": {"cell_count": 1}
+                    }
+                },
+                {
+                    "change": "::rain_garden",
+                    "cell_count": 1,
+                    "distribution": {
+                        "a:developed_low": {"cell_count": 1}
+                    }
+                }
+            ]
+        }
+        before = repr(census)
+        modified = create_modified_census(census)
+        self.assertEqual(repr(census), before)
+        self.assertEqual(modified['distribution']['a:developed_low'], {
+            'cell_count': 3,
+            'distribution': {
+                'a:developed_low': {'cell_count': 1},
+                'a:developed_low:rain_garden': {'cell_count': 2}
+            }
+        })
+        self.assertEqual(modified['distribution']['b:pasture'], {
+            'cell_count': 2,
+            'distribution': {
+                'b:pasture': {'cell_count': 1},
+                'b:pasture:rain_garden': {'cell_count': 1}
+            }
+        })
+        self.assertNotIn('modifications', modified)
+
     def test_simulate_water_quality_1(self):
         """
         Test the water quality simulation with unmodified census.
@@ -812,6 +988,132 @@ class TestModel(unittest.TestCase):
         expected = DAY_OUTPUT_2
         self.assertEqual(actual, expected)
 
+    def test_modifications_single_pass(self):
+        """
+        Test that applying the BMP effect to a simulated tree gives the
+        same results as simulating it again.
+        """
+        self.maxDiff = None
+        calls = []
+
+        def fn(cell, cell_count):
+            calls.append(cell)
+            ki = lookup_ki(cell.split(':')[2] or cell.split(':')[1])
+            return simulate_cell_day(precip, 0.207 * ki, cell, cell_count)
+
+        for census in [CENSUS_1, CENSUS_2]:
+            for precip in [0.3, 2, 4.429]:
+                del calls[:]
+                expected = simulate_modifications(census, fn, 10, precip)
+                two_passes = len(calls)
+                del calls[:]
+                actual = simulate_modifications(census, fn, 10, precip,
+                                                single_pass=True)
+                self.assertEqual(actual, expected)
+                self.assertTrue(len(calls) < two_passes)
+
+    def test_day_responses_reused(self):
+        """
+        Test that simulate_day simulates each distinct cell type once
+        and gives the same results as simulating every leaf.
+        """
+        self.maxDiff = None
+        calls = []
+
+        def counting(precip, evaptrans, cell, cell_count):
+            calls.append(cell)
+            return simulate_cell_day(precip, evaptrans, cell, cell_count)
+
+        def fn(cell, cell_count):
+            ki = lookup_ki(cell.split(':')[2] or cell.split(':')[1])
+            return simulate_cell_day(precip, 0.207 * ki, cell, cell_count)
+
+        for census in [CENSUS_1, CENSUS_2]:
+            for precip in [0.3, 2, 4.429]:
+                expected = simulate_modifications(census, fn, 10, precip,
+                                                  single_pass=True)
+                del calls[:]
+                model.simulate_cell_day = counting
+                try:
+                    actual = simulate_day(census, precip)
+                finally:
+                    model.simulate_cell_day = simulate_cell_day
+                self.assertEqual(actual, expected)
+                self.assertEqual(len(calls), len(set(calls)))
+
+    def test_day_with_nested_census(self):
+        """
+        Test that cell types that only appear in nested distributions
+        are simulated, even on the first run of a fresh registry.
+        """
+        census = {
+            'cell_count': 10,
+            'distribution': {
+                'a:developed_low': {
+                    'cell_count': 10,
+                    'distribution': {
+                        'a:developed_low': {'cell_count': 6},
+                        'b:shrub': {'cell_count': 4}
+                    }
+                }
+            }
+        }
+        shared = registry._registry
+        try:
+            registry._registry = registry.CellRegistry()
+            result = simulate_day(census, 2.0)['unmodified']
+        finally:
+            registry._registry = shared
+        self.assertAlmostEqual(result['runoff'], 0.29194699507389166)
+        self.assertAlmostEqual(result['et'], 0.12668399999999996)
+        nested = result['distribution']['a:developed_low']['distribution']
+        self.assertAlmostEqual(nested['b:shrub']['runoff'],
+                               0.022167487684729044)
+
+        census['distribution']['a:developed_low']['distribution'] = {
+            'a:parking_lot': {'cell_count': 10}
+        }
+        with self.assertRaises(KeyError) as context:
+            validate_census(census)
+        self.assertIn('Unknown land use: parking_lot', str(context.exception))
+
+    def test_day_with_deeply_nested_census(self):
+        """
+        Test that simulating a census with three levels of nested
+        distributions leaves the census alone.
+        """
+        census = {
+            'cell_count': 10,
+            'distribution': {
+                'a:developed_low': {
+                    'cell_count': 10,
+                    'distribution': {
+                        'a:developed_low': {
+                            'cell_count': 6,
+                            'distribution': {
+                                'a:developed_low': {'cell_count': 2},
+                                'c:pasture': {'cell_count': 4}
+                            }
+                        },
+                        'b:shrub': {'cell_count': 4}
+                    }
+                }
+            },
+            'modifications': [
+                {
+                    'change': '::rain_garden',
+                    'cell_count': 5,
+                    'distribution': {
+                        'a:developed_low': {'cell_count': 5}
+                    }
+                }
+            ]
+        }
+        original = copy.deepcopy(census)
+        result = simulate_day(census, 2.0)
+        self.assertEqual(census, original)
+        self.assertEqual(simulate_day(census, 2.0), result)
+
     def test_day_with_invalid_census(self):
         """
         Test the simulate_day function with a census
@@ -840,6 +1142,173 @@ class TestModel(unittest.TestCase):
         self.assertRaises(ValueError,
                           simulate_day, *(census, precip))
 
+    def test_response_cache(self):
+        """
+        Test that a response cache evicts the least recently used
+        responses and counts what happens.
+        """
+        cache = ResponseCache(2)
+        cache.put('a', {'runoff-vol': 1.0})
+        cache.put('b', {'runoff-vol': 2.0})
+        self.assertEqual(cache.get('a'), {'runoff-vol': 1.0})
+        cache.put('c', {'runoff-vol': 3.0})
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), {'runoff-vol': 3.0})
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1,
+                                         'evictions': 1, 'size': 2,
+                                         'maxsize': 2})
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.hits, 0)
+        self.assertRaises(ValueError, ResponseCache, 0)
+
+    def test_day_with_response_cache(self):
+        """
+        Test that simulate_day reuses the responses in the installed
+        cache, and gives the same results with it.
+        """
+        self.maxDiff = None
+        expected = [simulate_day(CENSUS_1, precip) for precip in [0.5, 2.0]]
+        cache = ResponseCache(1000)
+        previous = set_response_cache(cache)
+        try:
+            for _ in range(2):
+                actual = [simulate_day(CENSUS_1, precip)
+                          for precip in [0.5, 2.0]]
+                self.assertEqual(actual, expected)
+        finally:
+            set_response_cache(previous)
+        self.assertEqual(cache.hits, cache.misses)
+        self.assertEqual(len(cache), cache.misses)
+
+    def test_day_after_table_change(self):
+        """
+        Test that invalidating the tables brings the registry and the
+        response cache up to date.
+        """
+        census = {
+            'cell_count': 1,
+            'distribution': {'c:pasture': {'cell_count': 1}}
+        }
+        cache = ResponseCache()
+        previous = set_response_cache(cache)
+        ki = LAND_USE_VALUES['pasture']['ki']
+        try:
+            before = simulate_day(census, 2.0)['unmodified']
+            LAND_USE_VALUES['pasture']['ki'] = ki / 2
+            invalidate_tables()
+            after = simulate_day(census, 2.0)['unmodified']
+            self.assertEqual(after['et'], before['et'] / 2)
+            self.assertEqual(cache.hits, 0)
+        finally:
+            LAND_USE_VALUES['pasture']['ki'] = ki
+            invalidate_tables()
+            set_response_cache(previous)
+        self.assertEqual(simulate_day(census, 2.0)['unmodified'], before)
+
+    def test_validate_census(self):
+        """
+        Test that unknown cell types are reported before anything is
+        simulated.
+        """
+        census = {
+            'cell_count': 2,
+            'distribution': {
+                'b:developed_med': {'cell_count': 1},
+                'b:parking_lot': {'cell_count': 1}
+            }
+        }
+        with self.assertRaises(KeyError) as context:
+            validate_census(census)
+        self.assertIn('Unknown land use: parking_lot', str(context.exception))
+
+        census['distribution'] = {'q:developed_med': {'cell_count': 2}}
+        with self.assertRaises(KeyError) as context:
+            simulate_day(census, 2.0)
+        self.assertIn('Unknown soil type: q', str(context.exception))
+
+        census = {
+            'cell_count': 2,
+            'distribution': {
+                'b:developed_med': {'cell_count': 2}
+            },
+            'modifications': [
+                {
+                    'change': ':open_field:',
+                    'cell_count': 1,
+                    'distribution': {
+                        'b:developed_med': {'cell_count': 1}
+                    }
+                }
+            ]
+        }
+        with self.assertRaises(KeyError) as context:
+            simulate_day(census, 2.0)
+        self.assertIn('open_field', str(context.exception))
+
+    def test_normalize_census(self):
+        """
+        Test that censuses describing the same area have the same
+        normal form, and the same results.
+        """
+        census = normalize_census(CENSUS_1_VARIANT)
+        self.assertEqual(census, normalize_census(CENSUS_1))
+        self.assertEqual(normalize_census(census), census)
+        self.assertEqual(census['distribution']['a:deciduous_forest'],
+                         {'cell_count': 72})
+        self.assertNotIn('b:pasture', census['distribution'])
+        self.assertNotIn('BMPs', census)
+        self.assertEqual([modification['change']
+                          for modification in census['modifications']],
+                         ['::no_till', 'd:barren_land:'])
+        self.assertEqual(normalize_cell('A:Developed_Low:'), 'a:developed_low')
+        self.assertEqual(normalize_cell('a:developed_low:green_roof'),
+                         'a:developed_low:green_roof')
+
+        expected = simulate_day(CENSUS_1, 2.0)
+        actual = simulate_day(census, 2.0)
+        for tree in ['unmodified', 'modified']:
+            for key in ['runoff', 'et', 'inf', 'tn', 'tp', 'bod', 'tss']:
+                self.assertAlmostEqual(actual[tree][key], expected[tree][key])
+
+    def test_normalize_census_subtrees(self):
+        """
+        Test that duplicate subtrees are merged and empty ones removed,
+        except for the cell types that are modified.
+        """
+        census = {
+            'cell_count': 3,
+            'distribution': {
+                'a:pasture': {
+                    'cell_count': 3,
+                    'distribution': {
+                        'a:pasture': {'cell_count': 1},
+                        'A:Pasture:': {'cell_count': 2},
+                        'b:pasture': {'cell_count': 0}
+                    }
+                },
+                'b:pasture': {
+                    'cell_count': 0,
+                    'distribution': {'b:pasture': {'cell_count': 0}}
+                },
+                'c:pasture': {'cell_count': 0}
+            },
+            'modifications': [{
+                'change': '::no_till',
+                'cell_count': 1,
+                'distribution': {'c:pasture': {'cell_count': 1}}
+            }]
+        }
+        original = copy.deepcopy(census)
+        self.assertEqual(normalize_census(census)['distribution'], {
+            'a:pasture': {
+                'cell_count': 3,
+                'distribution': {'a:pasture': {'cell_count': 3}}
+            },
+            'c:pasture': {'cell_count': 0}
+        })
+        self.assertEqual(census, original)
+
     def test_bmp_runoff(self):
         """
         Make sure that BMPs do not produce negative runoff.
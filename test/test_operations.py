@@ -9,7 +9,7 @@ Operation tests.
 
 import unittest
 
-from tr55.operations import dict_plus
+from tr55.operations import dict_plus, dict_iadd
 
 
 class TestOperations(unittest.TestCase):
@@ -42,5 +42,55 @@ class TestOperations(unittest.TestCase):
         b = {'x': {'y': None}}
         self.assertEqual(dict_plus(a, b), a)
 
+    def test_plus_deep(self):
+        """
+        Test arithmetic on dictionaries nested deeper than the
+        recursion limit.
+        """
+        a = b = {'n': 1}
+        for _ in range(5000):
+            a = {'x': a}
+            b = {'x': b}
+        c = dict_plus(a, b)
+        for _ in range(5000):
+            c = c['x']
+        self.assertEqual(c, {'n': 2})
+
+    def test_iadd_1(self):
+        """
+        Test in-place dictionary arithmetic.
+        """
+        a = {'x': {'y': {'z': {'a': 2, 'c': 13}, 'n': 144}}, 'k': 1}
+        b = {'x': {'y': {'z': {'b': 8, 'c': 21}, 'm': 610}}}
+        c = {'x': {'y': {'z': {'a': 2, 'b': 8, 'c': 34}, 'n': 144, 'm': 610}},
+             'k': 1}
+        inner = a['x']
+        self.assertIs(dict_iadd(a, b), a)
+        self.assertEqual(a, c)
+        self.assertIs(a['x'], inner)
+        self.assertEqual(b, {'x': {'y': {'z': {'b': 8, 'c': 21}, 'm': 610}}})
+
+    def test_iadd_2(self):
+        """
+        Test that in-place dictionary arithmetic does not share
+        structure with its right-hand side.
+        """
+        a = {}
+        b = {'x': {'y': {'z': 1}}}
+        dict_iadd(a, b)
+        dict_iadd(a, b)
+        self.assertEqual(a, {'x': {'y': {'z': 2}}})
+        self.assertEqual(b, {'x': {'y': {'z': 1}}})
+
+    def test_iadd_3(self):
+        """
+        Test in-place dictionary arithmetic with missing values.
+        """
+        a = {'x': {'y': {'z': {'a': 2, 'c': 13}, 'n': 144}}}
+        b = {'x': {'y': None}, 'w': None}
+        c = {'x': {'y': {'z': {'a': 2, 'c': 13}, 'n': 144}}, 'w': None}
+        self.assertEqual(dict_plus(a, b), c)
+        self.assertEqual(dict_iadd(a, b), c)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Raster census tests.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import numpy as np
+
+from tr55.matrix import simulate_matrix
+from tr55.model import simulate_day, simulate_cell_day, ET_MAX
+from tr55.raster import census_from_rasters, cell_type_indices, \
+    zone_censuses, zone_matrix, simulate_rasters, CELL_TYPES
+from tr55.tablelookup import lookup_nlcd, lookup_ki, make_precolumbian
+
+
+class TestRaster(unittest.TestCase):
+    """
+    Raster census test set.
+    """
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        classes = [11, 21, 22, 23, 24, 41, 81, 82, 90, 0, 255]
+        self.land_cover = rng.choice(classes, size=(60, 70)).astype(np.uint8)
+        self.soil = rng.randint(0, 9, size=(60, 70)).astype(np.int16)
+        self.mask = rng.rand(60, 70) < 0.7
+        self.zones = rng.choice([7, 1000, 123456789, -1], size=(60, 70))
+
+    def expected(self, mask):
+        soils = {1: 'a', 2: 'b', 3: 'c', 4: 'd', 5: 'd', 6: 'd', 7: 'd'}
+        land_uses = dict((lookup_nlcd(cell.split(':')[1]),
+                          cell.split(':')[1]) for cell in CELL_TYPES)
+        counter = Counter()
+        for (land, soil, inside) in zip(self.land_cover.ravel().tolist(),
+                                        self.soil.ravel().tolist(),
+                                        mask.ravel().tolist()):
+            if inside and land in land_uses and soil in soils:
+                counter['%s:%s' % (soils[soil], land_uses[land])] += 1
+        return {
+            'cell_count': sum(counter.values()),
+            'distribution': dict((cell, {'cell_count': n})
+                                 for (cell, n) in counter.items())
+        }
+
+    def test_census(self):
+        """
+        Test building a census from rasters.
+        """
+        everything = np.ones(self.land_cover.shape, dtype=bool)
+        self.assertEqual(census_from_rasters(self.land_cover, self.soil),
+                         self.expected(everything))
+
+    def test_mask_and_chunks(self):
+        """
+        Test building a census from masked rasters in chunks.
+        """
+        expected = self.expected(self.mask)
+        self.assertEqual(census_from_rasters(self.land_cover, self.soil,
+                                             self.mask), expected)
+        self.assertEqual(census_from_rasters(self.land_cover, self.soil,
+                                             self.mask, chunk_size=333),
+                         expected)
+
+    def test_memmap(self):
+        """
+        Test building a census from memory-mapped rasters.
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'land_cover.dat')
+            land_cover = np.memmap(path, dtype=np.uint8, mode='w+',
+                                   shape=self.land_cover.shape)
+            land_cover[:] = self.land_cover
+            land_cover.flush()
+            land_cover = np.memmap(path, dtype=np.uint8, mode='r',
+                                   shape=self.land_cover.shape)
+            self.assertEqual(census_from_rasters(land_cover, self.soil),
+                             census_from_rasters(self.land_cover, self.soil))
+
+            path = os.path.join(directory, 'mask.dat')
+            mask = np.memmap(path, dtype=np.uint8, mode='w+',
+                             shape=self.mask.shape)
+            mask[:] = self.mask * 3
+            self.assertEqual(census_from_rasters(land_cover, self.soil, mask,
+                                                 chunk_size=333),
+                             self.expected(self.mask))
+            del land_cover, mask
+        finally:
+            shutil.rmtree(directory)
+
+    def test_cell_type_indices(self):
+        """
+        Test the cell types of single pixels.
+        """
+        indices = cell_type_indices([22, 82, 12, 5], [2, 6, 1, 1])
+        self.assertEqual([CELL_TYPES[index] for index in indices[:3]],
+                         ['b:developed_low', 'd:cultivated_crops',
+                          'a:perennial_ice'])
+        self.assertEqual(indices[3], -1)
+
+    def test_zone_censuses(self):
+        """
+        Test building the censuses of many zones at once.
+        """
+        expected = dict(
+            (zone, census_from_rasters(self.land_cover, self.soil,
+                                       self.mask & (self.zones == zone)))
+            for zone in [7, 1000, 123456789])
+        for chunk_size in [100000, 999, 10]:
+            actual = zone_censuses(self.zones, self.land_cover, self.soil,
+                                   self.mask, nodata=-1,
+                                   chunk_size=chunk_size)
+            self.assertEqual(actual, expected)
+
+        # Small zone IDs take a different path.
+        zones = np.where(self.zones == 123456789, 3, self.zones)
+        zones = np.where(zones == 1000, 5, zones)
+        expected[3] = expected.pop(123456789)
+        expected[5] = expected.pop(1000)
+        actual = zone_censuses(zones, self.land_cover, self.soil, self.mask,
+                               nodata=-1, chunk_size=999)
+        self.assertEqual(actual, expected)
+
+    @unittest.skipIf(tracemalloc is None, 'tracemalloc is not available')
+    def test_sparse_zone_ids(self):
+        """
+        Test that a few zones with large IDs do not take memory in
+        proportion to their IDs.
+        """
+        size = 1 << 18
+        zones = np.where(np.arange(size) % 3, 5, 200000).astype(np.int32)
+        land_cover = np.full(size, 22, dtype=np.uint8)
+        soil = np.full(size, 2, dtype=np.uint8)
+        tracemalloc.start()
+        try:
+            (zone_ids, matrix) = zone_matrix(zones, land_cover, soil,
+                                             chunk_size=size)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(zone_ids.tolist(), [5, 200000])
+        self.assertEqual(matrix.toarray().sum(axis=1).tolist(),
+                         [size - (size + 2) // 3, (size + 2) // 3])
+        # The dense counts of (200001 zones x cell types) would take
+        # about 100 MB.
+        self.assertLess(peak, 32 * 1024 * 1024)
+
+    def test_zone_matrix(self):
+        """
+        Test simulating the zones of a zone raster.
+        """
+        (zone_ids, matrix) = zone_matrix(self.zones, self.land_cover,
+                                         self.soil)
+        self.assertEqual(zone_ids.tolist(), [-1, 7, 1000, 123456789])
+        self.assertEqual(matrix.toarray().sum(),
+                         census_from_rasters(self.land_cover,
+                                             self.soil)['cell_count'])
+        censuses = zone_censuses(self.zones, self.land_cover, self.soil)
+        result = simulate_matrix(matrix, 1.5)
+        for (row, zone) in enumerate(zone_ids.tolist()):
+            expected = simulate_day(censuses[zone], 1.5)['unmodified']
+            self.assertAlmostEqual(result['runoff'][row], expected['runoff'])
+            self.assertAlmostEqual(result['tss'][row], expected['tss'])
+
+    def test_empty_zones(self):
+        """
+        Test zones of empty rasters.
+        """
+        empty = np.zeros((0, 3), dtype=np.int32)
+        self.assertEqual(zone_censuses(empty, empty, empty), {})
+
+    def expected_pixels(self, precip, precolumbian=False):
+        soils = {1: 'a', 2: 'b', 3: 'c', 4: 'd', 5: 'd', 6: 'd', 7: 'd'}
+        land_uses = dict((lookup_nlcd(cell.split(':')[1]),
+                          cell.split(':')[1]) for cell in CELL_TYPES)
+        expected = np.full((3,) + self.land_cover.shape, np.nan)
+        for index in np.ndindex(self.land_cover.shape):
+            land = self.land_cover[index]
+            soil = self.soil[index]
+            if self.mask[index] and land in land_uses and soil in soils:
+                land_use = land_uses[land]
+                if precolumbian:
+                    land_use = make_precolumbian(land_use)
+                cell = '%s:%s' % (soils[soil], land_use)
+                et = ET_MAX * lookup_ki(land_use)
+                result = simulate_cell_day(precip[index], et, cell, 1)
+                expected[(slice(None),) + index] = [
+                    result['runoff-vol'], result['et-vol'],
+                    result['inf-vol']]
+        return expected
+
+    def test_simulate_rasters(self):
+        """
+        Test per-pixel simulation with uniform precipitation.
+        """
+        precip = np.full(self.land_cover.shape, 1.8)
+        for precolumbian in [False, True]:
+            expected = self.expected_pixels(precip, precolumbian)
+            actual = simulate_rasters(self.land_cover, self.soil, 1.8,
+                                      precolumbian=precolumbian,
+                                      mask=self.mask, tile_size=500)
+            np.testing.assert_array_equal(np.array(actual), expected)
+
+    def test_simulate_rasters_precip(self):
+        """
+        Test per-pixel simulation with a precipitation raster, writing
+        into memory-mapped outputs.
+        """
+        rng = np.random.RandomState(0)
+        precip = rng.uniform(0, 5, self.land_cover.shape)
+        precip[0, :10] = 0.0
+        expected = self.expected_pixels(precip)
+        directory = tempfile.mkdtemp()
+        try:
+            out = tuple(np.memmap(os.path.join(directory, name),
+                                  dtype=np.float64, mode='w+',
+                                  shape=self.land_cover.shape)
+                        for name in ['runoff', 'et', 'inf'])
+            actual = simulate_rasters(self.land_cover, self.soil, precip,
+                                      mask=self.mask, out=out,
+                                      tile_size=700)
+            self.assertIs(actual, out)
+            np.testing.assert_array_equal(np.array(out), expected)
+            del actual, out
+        finally:
+            shutil.rmtree(directory)
+
+    def test_misaligned(self):
+        """
+        Test that misaligned rasters are rejected.
+        """
+        self.assertRaises(ValueError, census_from_rasters,
+                          self.land_cover, self.soil[:, 1:])
+        self.assertRaises(ValueError, simulate_rasters,
+                          self.land_cover, self.soil, self.soil[:, 1:])
+
+if __name__ == "__main__":
+    unittest.main()
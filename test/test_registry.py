@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Cell registry tests.
+"""
+
+import math
+import unittest
+
+from tr55.registry import CellRegistry, MAX_SPELLINGS, canonical_cell
+from tr55.tables import LAND_USE_VALUES, NON_NATURAL
+from tr55.tablelookup import lookup_cn, lookup_ki, lookup_nlcd, lookup_load
+
+
+class TestRegistry(unittest.TestCase):
+    """
+    Cell registry test set.
+    """
+    def test_canonical_cell(self):
+        """
+        Test the canonical form of cell type strings.
+        """
+        self.assertEqual(canonical_cell('a:pasture'), 'a:pasture:')
+        self.assertEqual(canonical_cell('B:Pasture:no_till'),
+                         'b:pasture:no_till')
+        self.assertRaises(ValueError, canonical_cell, 'pasture')
+
+    def test_interning(self):
+        """
+        Test that equivalent cell strings share a code.
+        """
+        registry = CellRegistry()
+        code = registry.code('c:developed_high')
+        self.assertEqual(registry.code('c:developed_high:'), code)
+        self.assertEqual(registry.code('C:developed_high'), code)
+        self.assertNotEqual(registry.code('c:developed_high:no_till'), code)
+        self.assertEqual(registry.codes(['c:developed_high']).tolist(),
+                         [code])
+
+    def test_unknown_cells(self):
+        """
+        Test that cell types that are not in the tables are not
+        registered.
+        """
+        registry = CellRegistry()
+        registry.code('a:mixed_forest')
+        for (cell, message) in [('a:parking_lot', 'parking_lot'),
+                                ('e:pasture', 'soil type: e'),
+                                ('a:pasture:pond', 'pond')]:
+            with self.assertRaises(KeyError) as context:
+                registry.code(cell)
+            self.assertIn(message, str(context.exception))
+        self.assertEqual(registry.cells, ['a:mixed_forest:'])
+
+    def test_spellings(self):
+        """
+        Test that the spellings of the cell types that are remembered
+        are bounded in number.
+        """
+        registry = CellRegistry()
+        code = registry.code('c:mixed_forest')
+        cell = 'c:mixed_forest:'
+        for i in range(MAX_SPELLINGS + 10):
+            spelling = ''.join(letter.upper() if (i >> bit) & 1 else letter
+                               for (bit, letter) in enumerate(cell))
+            self.assertEqual(registry.code(spelling), code)
+        self.assertEqual(len(registry), 1)
+        self.assertTrue(len(registry._spellings) <= MAX_SPELLINGS)
+
+    def test_incremental_columns(self):
+        """
+        Test that only the cell types registered since the columns
+        were last built are looked up.
+        """
+        registry = CellRegistry()
+        crops = registry.code('d:cultivated_crops')
+        self.assertEqual(len(registry.values().ki), 2)
+        self.assertEqual(registry.compilations, 2)
+
+        high = registry.code('c:developed_high')
+        columns = registry.columns()
+        self.assertEqual(registry.compilations, 4)
+        self.assertEqual(columns.ki[crops],
+                         lookup_ki('cultivated_crops'))
+        self.assertEqual(columns.curve_number[high],
+                         lookup_cn('c', 'developed_high'))
+        self.assertEqual(columns.precolumbian[high],
+                         registry.code('c:mixed_forest'))
+        self.assertEqual(registry.values().ki, columns.ki.tolist())
+        self.assertEqual(registry.compilations, 4)
+
+    def test_columns(self):
+        """
+        Spot-check the derived properties against the table lookups.
+        """
+        registry = CellRegistry()
+        high = registry.code('c:developed_high')
+        no_till = registry.code('d:developed_med:no_till')
+        roof = registry.code('b:developed_low:green_roof')
+        columns = registry.columns()
+
+        self.assertEqual(columns.curve_number[high],
+                         lookup_cn('c', 'developed_high'))
+        self.assertEqual(columns.curve_number[no_till],
+                         lookup_cn('d', 'no_till'))
+        self.assertEqual(columns.curve_number[roof],
+                         lookup_cn('b', 'developed_low'))
+        self.assertEqual(columns.ki[no_till], lookup_ki('no_till'))
+        self.assertEqual(columns.ki[roof], lookup_ki('green_roof'))
+        self.assertEqual(columns.nlcd[no_till], lookup_nlcd('developed_med'))
+        self.assertTrue(columns.built[high])
+        self.assertFalse(columns.built[no_till])
+        self.assertTrue(columns.bmp[roof])
+        self.assertFalse(columns.bmp[no_till])
+        tn = registry.pollutants.index('tn')
+        self.assertEqual(columns.loads[high, tn], lookup_load(24, 'tn'))
+
+    def test_precolumbian(self):
+        """
+        Test the Pre-Columbian projection of codes.
+        """
+        registry = CellRegistry()
+        crops = registry.code('d:cultivated_crops')
+        shrub = registry.code('b:shrub')
+        forest = registry.precolumbian[crops]
+        self.assertEqual(registry.cells[forest], 'd:mixed_forest:')
+        self.assertEqual(registry.precolumbian[shrub], shrub)
+        self.assertEqual(registry.columns().precolumbian[crops], forest)
+
+    def test_missing_properties(self):
+        """
+        Test that properties missing from the tables are NaN.
+        """
+        registry = CellRegistry()
+        roof = registry.code('a:green_roof')
+        columns = registry.columns()
+        self.assertTrue(math.isnan(columns.curve_number[roof]))
+        self.assertEqual(columns.nlcd[roof], -1)
+
+    def test_validate(self):
+        """
+        Test that validation raises the errors of the table lookups.
+        """
+        registry = CellRegistry()
+        roof = registry.code('a:green_roof')
+        forest = registry.code('a:deciduous_forest')
+        self.assertRaises(KeyError, registry.validate, roof, 'runoff')
+        self.assertRaises(KeyError, registry.validate, roof, 'loads')
+        registry.validate(roof, 'ki')
+        for properties in ['runoff', 'ki', 'loads']:
+            registry.validate(forest, properties)
+        values = registry.values()
+        self.assertEqual(values.curve_number[forest],
+                         lookup_cn('a', 'deciduous_forest'))
+        self.assertIsInstance(values.ki[forest], float)
+
+    def test_invalidate(self):
+        """
+        Test that invalidation rederives the properties of the cell
+        types from the tables, and keeps their codes.
+        """
+        registry = CellRegistry()
+        crops = registry.code('d:cultivated_crops')
+        registry.validate(crops, 'ki')
+        ki = LAND_USE_VALUES['cultivated_crops']['ki']
+        try:
+            LAND_USE_VALUES['cultivated_crops']['ki'] = 0.5
+            NON_NATURAL.remove('cultivated_crops')
+            registry.invalidate()
+            self.assertEqual(registry.code('d:cultivated_crops'), crops)
+            self.assertEqual(registry.values().ki[crops], 0.5)
+            self.assertEqual(registry.precolumbian[crops], crops)
+        finally:
+            LAND_USE_VALUES['cultivated_crops']['ki'] = ki
+            NON_NATURAL.add('cultivated_crops')
+        registry.invalidate()
+        self.assertEqual(registry.values().ki[crops], ki)
+        self.assertEqual(registry.cells[registry.precolumbian[crops]],
+                         'd:mixed_forest:')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,7 +9,10 @@ Table Lookup test set.
 
 import unittest
 
-from tr55.tablelookup import lookup_bmp_storage, lookup_bmp_drainage_ratio, lookup_cn
+from tr55 import tablelookup
+from tr55.tablelookup import lookup_bmp_storage, lookup_bmp_drainage_ratio, lookup_cn, \
+    lookup_pitt_runoff, lookup_pitt_index, lookup_pitt_table, \
+    invalidate_tables, on_invalidate_tables, table_generation
 
 
 class TestTablelookups(unittest.TestCase):
@@ -47,5 +50,44 @@ class TestTablelookups(unittest.TestCase):
         self.assertEqual(lookup_cn('c', 'evergreen_forest'), 70)
         self.assertEqual(lookup_cn('d', 'mixed_forest'), 77)
 
+    def test_lookup_pitt_table(self):
+        """
+        Check that the compiled Pitt table agrees with the nested one.
+        """
+        table = lookup_pitt_table()
+        for (soil_type, land_use) in [('a', 'developed_open'),
+                                      ('d', 'developed_high'),
+                                      ('c', 'cluster_housing')]:
+            (land_index, soil_index) = lookup_pitt_index(soil_type, land_use)
+            runoff_ratios = lookup_pitt_runoff(soil_type, land_use)
+            self.assertEqual(table.steps.tolist(), runoff_ratios['precip'])
+            self.assertEqual(table.ratios[land_index, soil_index].tolist(),
+                             runoff_ratios['Rv'])
+        self.assertRaises(KeyError, lookup_pitt_index, 'a', 'pasture')
+        self.assertRaises(KeyError, lookup_pitt_index, 'e', 'developed_low')
+
+    def test_invalidate_tables(self):
+        """
+        Check that invalidating the tables recompiles the Pitt table
+        and notifies the callbacks.
+        """
+        calls = []
+
+        def callback():
+            calls.append(table_generation())
+
+        on_invalidate_tables(callback)
+        table = lookup_pitt_table()
+        generation = table_generation()
+        try:
+            invalidate_tables()
+        finally:
+            tablelookup._invalidation_callbacks.remove(callback)
+        self.assertEqual(table_generation(), generation + 1)
+        self.assertEqual(calls, [generation + 1])
+        self.assertIsNot(lookup_pitt_table(), table)
+        self.assertEqual(lookup_pitt_table().ratios.tolist(),
+                         table.ratios.tolist())
+
 if __name__ == "__main__":
     unittest.main()
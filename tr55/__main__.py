@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Command-line interface.
+
+    python -m tr55 batch [input.jsonl] [-o output.jsonl] [-j PROCESSES]
+
+See `tr55.batch` for the input and output formats.
+"""
+
+import argparse
+import io
+import sys
+
+from tr55.batch import run_batch
+
+
+def _open(path, mode, default):
+    if path == '-':
+        return default
+    return io.open(path, mode, encoding='utf-8')
+
+
+def batch(args):
+    input_file = _open(args.input, 'r', sys.stdin)
+    output_file = _open(args.output, 'w', sys.stdout)
+    try:
+        run_batch(input_file, output_file, args.processes,
+                  args.max_in_flight, not args.unordered)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tr55')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    batch_parser = subparsers.add_parser(
+        'batch', help='simulate censuses from JSON lines')
+    batch_parser.add_argument(
+        'input', nargs='?', default='-',
+        help='JSON-lines file of records, or - for stdin (the default)')
+    batch_parser.add_argument(
+        '-o', '--output', default='-',
+        help='JSON-lines file for the results, or - for stdout (the default)')
+    batch_parser.add_argument(
+        '-j', '--processes', type=int, default=None,
+        help='number of worker processes (default: the number of CPUs; '
+             '0 runs in this process)')
+    batch_parser.add_argument(
+        '--max-in-flight', type=int, default=None,
+        help='maximum number of records being worked on at once '
+             '(default: four per process)')
+    batch_parser.add_argument(
+        '--unordered', action='store_true',
+        help='write each result as soon as it is ready instead of in '
+             'input order')
+    batch_parser.set_defaults(func=batch)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
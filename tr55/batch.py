@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Batch simulation of JSON-lines input.
+
+Each line of input is a JSON object with a `census` and the other
+arguments of `simulate_day` (`precip`, and optionally `cell_res` and
+`precolumbian`), plus an optional `id`.  Each line of output is a JSON
+object with the `index` of the input line among the records, its `id`
+(if any) and either the `result` of `simulate_day` or an `error`
+message.
+
+The work is spread over a pool of processes, with a bounded number of
+records in flight so that memory use stays flat however long the
+input is.
+"""
+
+import collections
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, \
+    as_completed, wait
+
+from tr55.model import simulate_day
+
+
+def simulate_record(record):
+    """
+    Simulate one parsed input record, returning its `simulate_day`
+    result.
+    """
+    if not isinstance(record, dict) or 'census' not in record \
+       or 'precip' not in record:
+        raise ValueError('A record needs a census and a precip')
+    return simulate_day(record['census'], record['precip'],
+                        record.get('cell_res', 10),
+                        record.get('precolumbian', False))
+
+
+def simulate_line(index, line):
+    """
+    Simulate the record on one line of input, returning the line of
+    output (without a line break).  Errors are reported in the output
+    instead of being raised.
+    """
+    output = collections.OrderedDict([('index', index)])
+    try:
+        record = json.loads(line)
+        if isinstance(record, dict) and 'id' in record:
+            output['id'] = record['id']
+        output['result'] = simulate_record(record)
+    except Exception as error:
+        output['error'] = '%s: %s' % (type(error).__name__, error)
+    return json.dumps(output)
+
+
+def _records(lines):
+    index = 0
+    for line in lines:
+        if line.strip():
+            yield (index, line)
+            index += 1
+
+
+def simulate_lines(lines, processes=None, max_in_flight=None, ordered=True):
+    """
+    Simulate the records on the given lines of input, yielding the
+    lines of output.  Blank lines are skipped.
+
+    `processes` is the number of worker processes (by default, the
+    number of CPUs); 0 simulates the records in this process.
+
+    `max_in_flight` bounds the number of records that have been read
+    but whose output has not been yielded yet (by default, four per
+    process).
+
+    If `ordered` is true the output is in the order of the input;
+    otherwise each line is yielded as soon as it is ready.
+    """
+    records = _records(lines)
+    if processes == 0:
+        for (index, line) in records:
+            yield simulate_line(index, line)
+        return
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if max_in_flight is None:
+        max_in_flight = 4 * processes
+    max_in_flight = max(1, max_in_flight)
+
+    with ProcessPoolExecutor(processes) as executor:
+        if ordered:
+            pending = collections.deque()
+            for (index, line) in records:
+                pending.append(executor.submit(simulate_line, index, line))
+                if len(pending) >= max_in_flight:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        else:
+            pending = set()
+            for (index, line) in records:
+                pending.add(executor.submit(simulate_line, index, line))
+                if len(pending) >= max_in_flight:
+                    (done, pending) = wait(pending,
+                                           return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in as_completed(pending):
+                yield future.result()
+
+
+def run_batch(input_file, output_file, processes=None, max_in_flight=None,
+              ordered=True):
+    """
+    Simulate the JSON-lines records of `input_file`, writing the
+    results to `output_file` as JSON lines.  The other arguments are
+    as for `simulate_lines`.
+    """
+    for line in simulate_lines(input_file, processes, max_in_flight,
+                               ordered):
+        output_file.write(line)
+        output_file.write('\n')
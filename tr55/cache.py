@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Persistent caching of `simulate_day` results.
+
+A `ResultCache` keeps the results of `simulate_day` in a store (a
+directory of files, `DirectoryStore`, or an SQLite database,
+`SQLiteStore`), keyed by a digest of the arguments (which does not
+depend on the order of the entries of the census) and of the version of
+the tables.  Repeated requests are then answered without simulating
+anything, even by other processes or after a restart:
+
+    from tr55.cache import ResultCache, SQLiteStore
+
+    cache = ResultCache(SQLiteStore('/var/cache/tr55.sqlite'))
+    result = cache.simulate_day(census, 2.0)
+
+The key only ignores the order of the entries of the census, because
+the results are exactly those of `simulate_day` for the given census.
+Censuses that only differ in the case or spelling of their cell types,
+in duplicate entries or in entries with no cells describe the same area
+of interest, but they have different results and so different entries.
+They have the same normal form (see `tr55.model.normalize_census`),
+though, so normalize censuses before passing them to share entries.
+`census_hash` gives the digest of the normal form of a census.
+
+A `Coalescer` makes concurrent identical calls (in different threads)
+wait for the first of them and take copies of its result, instead of
+computing it again:
+
+    coalescer = Coalescer(cache.simulate_day)
+    result = coalescer.simulate_day(census, 2.0)
+"""
+
+import copy
+import errno
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+from tr55.model import normalize_census, simulate_day
+from tr55.tablelookup import table_version
+
+# Part of every key, so that results cached by an incompatible version
+# of the model are not used.
+FORMAT_VERSION = 1
+
+
+def _digest(value):
+    text = json.dumps(value, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def census_hash(census):
+    """
+    Return a hexadecimal digest of the normal form of a census (see
+    `tr55.model.normalize_census`).  Censuses with the same normal
+    form have the same digest, whatever the order of their entries.
+    """
+    return _digest(normalize_census(census))
+
+
+def result_key(census, precip, cell_res=10, precolumbian=False):
+    """
+    Return a hexadecimal digest of the arguments of `simulate_day` and
+    of the version of the tables.  The digest does not depend on the
+    order of the entries of the dictionaries of the census, but it
+    does depend on everything else about the census (unlike
+    `census_hash`).
+    """
+    return _digest({
+        'format': FORMAT_VERSION,
+        'tables': table_version(),
+        'census': census,
+        'precip': float(precip),
+        'cell_res': float(cell_res),
+        'precolumbian': bool(precolumbian)
+    })
+
+
+class DirectoryStore(object):
+    """
+    Stores cached results as files in a directory (which is created if
+    need be).  Files are written atomically, so several processes can
+    share a directory.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def _filename(self, key):
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def get(self, key):
+        """
+        Return the text stored under the given key, or None.
+        """
+        try:
+            with open(self._filename(key), 'rb') as stored:
+                return stored.read().decode('utf-8')
+        except (IOError, OSError) as error:
+            if error.errno == errno.ENOENT:
+                return None
+            raise
+
+    def put(self, key, text):
+        """
+        Store text under the given key.
+        """
+        filename = self._filename(key)
+        directory = os.path.dirname(filename)
+        try:
+            os.makedirs(directory)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        (handle, temporary) = tempfile.mkstemp(dir=directory,
+                                               suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as stored:
+                stored.write(text.encode('utf-8'))
+            os.rename(temporary, filename)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+
+class SQLiteStore(object):
+    """
+    Stores cached results in an SQLite database file (which is
+    created if need be).  Each thread gets its own connection.
+    """
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS results '
+                               '(key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    def _connection(self):
+        try:
+            return self._local.connection
+        except AttributeError:
+            self._local.connection = sqlite3.connect(self.path,
+                                                     timeout=self.timeout)
+            return self._local.connection
+
+    def get(self, key):
+        """
+        Return the text stored under the given key, or None.
+        """
+        row = self._connection().execute(
+            'SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, key, text):
+        """
+        Store text under the given key.
+        """
+        with self._connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO results (key, value) '
+                               'VALUES (?, ?)', (key, text))
+
+
+class ResultCache(object):
+    """
+    A cache of `simulate_day` results in a store (see
+    `DirectoryStore` and `SQLiteStore`; any object with the same `get`
+    and `put` methods will do).
+
+    `hits` and `misses` count the lookups of this cache object.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, census, precip, cell_res=10, precolumbian=False):
+        """
+        Return the key of the result of `simulate_day` for the given
+        arguments (see `result_key`).
+        """
+        return result_key(census, precip, cell_res, precolumbian)
+
+    def simulate_day(self, census, precip, cell_res=10, precolumbian=False):
+        """
+        Return the result of `simulate_day` for the given arguments,
+        from the store if it is there.  Otherwise the census is
+        simulated and the result is stored.
+
+        Censuses that describe the same area in different ways (see
+        `tr55.model.normalize_census`) have different results, and so
+        different entries; normalize censuses before passing them to
+        share the entries.
+        """
+        key = result_key(census, precip, cell_res, precolumbian)
+        text = self.store.get(key)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if text is not None:
+            return json.loads(text)
+
+        result = simulate_day(census, precip, cell_res, precolumbian)
+        self.store.put(key, json.dumps(result, sort_keys=True))
+        return result
+
+
+class _Call(object):
+    """
+    A computation in progress, which other threads can wait for.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiting = 0
+        self.result = None
+        self.error = None
+
+
+class Coalescer(object):
+    """
+    Makes concurrent calls with the same key share a single
+    computation: while a computation is in progress, the other calls
+    with its key wait for it and return its result (or raise its
+    exception) instead of computing it again.  Calls that come after
+    the computation has finished compute it anew (combine with a
+    `ResultCache` to keep results).
+
+    The call that computes a result returns it, and the calls that
+    waited for it each get a deep copy of it, so callers can change
+    their results without affecting each other.
+
+    `simulate` is the function that `simulate_day` calls,
+    `tr55.model.simulate_day` by default.  `call` coalesces calls of
+    any function.
+
+    `calls` counts the calls, `computed` the ones that computed their
+    result and `coalesced` the ones that waited for another call
+    instead.
+    """
+    def __init__(self, simulate=simulate_day):
+        self.simulate = simulate
+        self.calls = 0
+        self.computed = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def call(self, key, function, *args, **kwargs):
+        """
+        Return `function(*args, **kwargs)`, or a copy of the result of
+        the call with the same key that is in progress in another
+        thread.  Calls with the same key must have the same result.
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._in_flight.get(key)
+            computing = call is None
+            if computing:
+                call = self._in_flight[key] = _Call()
+                self.computed += 1
+            else:
+                call.waiting += 1
+                self.coalesced += 1
+
+        if not computing:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        result = None
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            # No more calls can start waiting now.  The waiting ones
+            # copy a snapshot of the result that no caller has, so the
+            # caller that computed it may change it right away.
+            if call.waiting:
+                call.result = copy.deepcopy(result)
+            call.done.set()
+        return result
+
+    def simulate_day(self, census, precip, cell_res=10, precolumbian=False):
+        """
+        Return the result of `simulate` for the given arguments,
+        sharing its computation with the concurrent calls that have the
+        same arguments (see `result_key`).
+        """
+        key = result_key(census, precip, cell_res, precolumbian)
+        return self.call(key, self.simulate, census, precip, cell_res,
+                         precolumbian)
+
+    def stats(self):
+        """
+        Return a dictionary with the counters of the coalescer and the
+        number of computations in progress.
+        """
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'computed': self.computed,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._in_flight)
+            }
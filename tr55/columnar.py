@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Columnar results.
+
+The results of `simulate_day` are nested dictionaries, which are slow
+to walk and serialize and take a lot of memory.  A `ColumnarTree` holds
+the same result as one NumPy structured array per level of the tree,
+with the cell type code and the index of the parent (in the level
+above) of every node.  `to_dict` turns it back into the dictionary
+form.
+"""
+
+import copy
+
+import numpy as np
+
+from tr55.registry import get_registry
+
+
+def level_dtype(counts_dtype, pollutants, shape=()):
+    """
+    Return the dtype of the levels of a `ColumnarTree` with the given
+    cell count dtype and pollutants, whose values have the given shape
+    (one value per day, say).
+    """
+    fields = [('code', np.intp), ('parent', np.intp),
+              ('cell_count', counts_dtype), ('simulated', bool)]
+    fields.extend((name, np.float64, shape)
+                  for name in ['runoff', 'et', 'inf'] + list(pollutants))
+    return np.dtype(fields)
+
+
+def default_key(registry, code):
+    """
+    Return the key under which a node of the given cell type code is
+    put in its parent's distribution by default.
+    """
+    cell = registry.cells[code]
+    return cell[:-1] if cell.endswith(':') else cell
+
+
+class ColumnarTree(object):
+    """
+    A result tree (as returned by `simulate_day`) stored by level.
+
+    `levels[d]` is a structured array with a row for each node at
+    depth `d` (the root being the only node at depth 0), in the order
+    in which they appear in their parents' distributions.  Its fields
+    are:
+     * "code", the registry code (see `tr55.registry.get_registry`) of
+       the cell type under which the node is found in its parent's
+       distribution (-1 for the root)
+     * "parent", the row of the parent of the node in `levels[d - 1]`
+       (-1 for the root)
+     * "cell_count", the cell count of the node
+     * "simulated", whether the node was simulated (empty nodes, and
+       the nodes under them, are not)
+     * "runoff", "et" and "inf", as in the dictionary form (0 for the
+       nodes that were not simulated)
+     * one field per pollutant, NaN for the nodes that do not have
+       pollutant loads in the dictionary form
+
+    The rest of the dictionary form is kept sparsely: `extras` maps the
+    (depth, row) of a node to its other keys (for instance "BMPs"), and
+    `keys` maps the (depth, row) of a node whose key is not the default
+    spelling of its cell type to that key.
+    """
+    def __init__(self, levels, pollutants, extras=None, keys=None):
+        self.levels = levels
+        self.pollutants = list(pollutants)
+        self.extras = extras or {}
+        self.keys = keys or {}
+
+    def __len__(self):
+        return sum(len(level) for level in self.levels)
+
+    def to_dict(self):
+        """
+        Return the result in the dictionary form of `simulate_day`.
+        """
+        registry = get_registry()
+        above = []
+        for (depth, level) in enumerate(self.levels):
+            shape = level.dtype['runoff'].shape
+            if shape:
+                columns = dict((name, level[name]) for name in
+                               ['runoff', 'et', 'inf'] + self.pollutants)
+                # Each node gets arrays of its own.
+                empty = lambda: np.zeros(shape)
+                absent = dict((name, np.isnan(column).all(axis=-1))
+                              for (name, column) in columns.items())
+                columns = dict((name, [row.copy() for row in column])
+                               for (name, column) in columns.items())
+            else:
+                columns = dict((name, level[name].tolist()) for name in
+                               ['runoff', 'et', 'inf'] + self.pollutants)
+                empty = lambda: 0
+                absent = dict((name, np.isnan(level[name]))
+                              for name in self.pollutants)
+            absent = dict((name, column.tolist())
+                          for (name, column) in absent.items())
+            codes = level['code'].tolist()
+            parents = level['parent'].tolist()
+            counts = level['cell_count'].tolist()
+            simulated = level['simulated'].tolist()
+
+            nodes = []
+            for row in range(len(level)):
+                extras = self.extras.get((depth, row))
+                node = copy.deepcopy(extras) if extras else {}
+                node['cell_count'] = counts[row]
+                for name in ['runoff', 'et', 'inf']:
+                    node[name] = columns[name][row] if simulated[row] \
+                        else empty()
+                for name in self.pollutants:
+                    if not absent[name][row]:
+                        node[name] = columns[name][row]
+                nodes.append(node)
+                if depth > 0:
+                    key = self.keys.get((depth, row))
+                    if key is None:
+                        key = default_key(registry, codes[row])
+                    parent = above[parents[row]]
+                    parent.setdefault('distribution', {})[key] = node
+            above = nodes
+            if depth == 0:
+                root = nodes[0]
+        return root
+
+
+def to_dict(result):
+    """
+    Turn a columnar result back into the dictionary form.  `result` is
+    either a `ColumnarTree` or a dictionary of them (for instance, the
+    "unmodified" and "modified" trees of a simulated day), whose
+    values are converted.
+    """
+    if isinstance(result, ColumnarTree):
+        return result.to_dict()
+    return dict((key, to_dict(value)) for (key, value) in result.items())
@@ -1,89 +1,266 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
 """
 Compares the tables generated by makeMiniAppTable and the
- corresponding table from the original mini app.
+corresponding table from the original mini app (or any other golden
+table of the same form):
+
+    python -m tr55.compareMiniAppTables data/model-2012-05-09.csv table.csv
+
+Both tables are loaded as NumPy columns and joined on (P, land, soil)
+with a sorted merge.  Land uses may be given as names or NLCD classes
+and soil types as letters or indices; they are normalized to NLCD
+classes and indices before the join.  The report has the absolute and
+relative errors of the ET, I and R columns of the joined rows, and the
+number of mismatching rows by land use.
 """
 
-import csv
-import sys
+import argparse
+
+import numpy as np
 
 from tr55.tablelookup import lookup_nlcd
+from tr55.tables import SOIL_TYPES
+
+COLUMNS = ('ET', 'I', 'R')
+
+
+def normalize_land(land):
+    """
+    Normalize a land use (a name, or an NLCD class as a string) to
+    the string of its NLCD class.  Land uses with a BMP have no NLCD
+    class and are kept as they are.
+    """
+    if land.isdigit() or ':' in land:
+        return land
+    return str(lookup_nlcd(land))
+
+
+def normalize_soil(soil):
+    """
+    Normalize a soil type (a letter, or an index as a string) to its
+    index.
+    """
+    if soil.lower() in SOIL_TYPES:
+        return SOIL_TYPES.index(soil.lower())
+    return int(soil)
+
+
+def _factorize(values):
+    """
+    Return the distinct values of an array (in order of appearance)
+    and the index of each element among them.
+
+    Sorting strings is slow, and the string columns have few distinct
+    values that come in runs, so this looks up the value of each run
+    in a dictionary instead of using `np.unique`.
+    """
+    if not len(values):
+        return ([], np.zeros(0, dtype=np.intp))
+    changes = values[1:] != values[:-1]
+    starts = np.flatnonzero(np.concatenate([[True], changes]))
+    ids = {}
+    run_ids = [ids.setdefault(value, len(ids))
+               for value in values[starts].tolist()]
+    distinct = sorted(ids, key=ids.get)
+    inverse = np.repeat(np.array(run_ids, dtype=np.intp),
+                        np.diff(np.append(starts, len(values))))
+    return (distinct, inverse)
+
+
+def _normalize(values, normalize):
+    """
+    Normalize an array of strings, once per distinct string.
+    """
+    (distinct, inverse) = _factorize(values)
+    normalized = np.array([normalize(value) for value in distinct])
+    return normalized[inverse]
+
+
+def read_table(csv_file_name):
+    """
+    Read a table (with at least the P, land, soil, ET, I and R columns)
+    into a dictionary of columns, with the land uses and soil types
+    normalized (see `normalize_land` and `normalize_soil`).
+    """
+    with open(csv_file_name) as csv_file:
+        header = csv_file.readline().strip().split(',')
+        missing = [name for name in ('P', 'land', 'soil') + COLUMNS
+                   if name not in header]
+        if missing:
+            raise ValueError('%s has no %s column' %
+                             (csv_file_name, ', '.join(missing)))
+        dtype = [('P', np.float64), ('land', 'U64'), ('soil', 'U8')] + \
+            [(name, np.float64) for name in COLUMNS]
+        usecols = [header.index(name) for (name, _) in dtype]
+        rows = np.loadtxt(csv_file, delimiter=',', dtype=dtype,
+                          usecols=usecols, ndmin=1)
+
+    table = dict((name, rows[name]) for name in ('P',) + COLUMNS)
+    table['land'] = _normalize(rows['land'], normalize_land)
+    table['soil'] = _normalize(rows['soil'], normalize_soil)
+    return table
+
+
+def _keys(old, new):
+    """
+    Pack the (P, land, soil) of the rows of both tables into integer
+    keys, returning the keys of each table.
+    """
+    (precips, precip_ids) = np.unique(np.concatenate([old['P'], new['P']]),
+                                      return_inverse=True)
+    (lands, land_ids) = _factorize(np.concatenate([old['land'],
+                                                   new['land']]))
+    (soils, soil_ids) = np.unique(np.concatenate([old['soil'], new['soil']]),
+                                  return_inverse=True)
+    keys = (land_ids.astype(np.int64) * len(soils) + soil_ids.reshape(-1)) * \
+        len(precips) + precip_ids.reshape(-1)
+    size = len(old['P'])
+    return (keys[:size], keys[size:])
+
+
+def join_tables(old, new):
+    """
+    Join two tables (as read by `read_table`) on (P, land, soil) with
+    a sorted merge.  The return value is the pair of arrays of the
+    indices of the matching rows in each table, and the number of
+    rows of each table whose key is already on an earlier row (those
+    are not joined).
+    """
+    (old_keys, new_keys) = _keys(old, new)
+    (old_keys, old_rows) = np.unique(old_keys, return_index=True)
+    duplicates = (len(old['P']) - len(old_keys),
+                  len(new_keys) - len(np.unique(new_keys)))
+    (new_keys, new_rows) = np.unique(new_keys, return_index=True)
+
+    positions = np.searchsorted(old_keys, new_keys)
+    found = positions < len(old_keys)
+    found[found] = old_keys[positions[found]] == new_keys[found]
+    return (old_rows[positions[found]], new_rows[found], duplicates)
+
+
+def compare_tables(old, new, decimals=1):
+    """
+    Compare two tables (as read by `read_table`).  Values match when
+    they are the same after rounding to `decimals` decimal places.
+
+    The return value is a dictionary with:
+     * "old_rows" and "new_rows", the number of rows in each table
+     * "duplicates", the number of rows of each table that repeat the
+       key of an earlier row
+     * "matched", the number of rows whose inputs match
+     * "columns", the "max_abs", "mean_abs", "max_rel" and "mean_rel"
+       errors and number of "mismatches" of each output column over
+       the matched rows (the relative errors leave out the rows where
+       the old value is 0, and are None if there are none)
+     * "mismatches", the number of matched rows with any mismatching
+       output
+     * "mismatches_by_land", the number of those rows by land use
+     * "old_index" and "new_index", the indices of the matched rows in
+       each table, and "mismatched", a boolean array that is true for
+       the matched rows that mismatch
+    """
+    (old_index, new_index, duplicates) = join_tables(old, new)
+    report = {
+        'old_rows': len(old['P']),
+        'new_rows': len(new['P']),
+        'duplicates': duplicates,
+        'matched': len(old_index),
+        'columns': {},
+        'old_index': old_index,
+        'new_index': new_index
+    }
+
+    mismatched = np.zeros(len(old_index), dtype=bool)
+    for name in COLUMNS:
+        expected = old[name][old_index]
+        actual = new[name][new_index]
+        error = np.abs(actual - expected)
+        nonzero = expected != 0
+        relative = error[nonzero] / np.abs(expected[nonzero])
+        wrong = np.round(expected, decimals) != np.round(actual, decimals)
+        mismatched |= wrong
+        report['columns'][name] = {
+            'max_abs': float(error.max()) if len(error) else None,
+            'mean_abs': float(error.mean()) if len(error) else None,
+            'max_rel': float(relative.max()) if len(relative) else None,
+            'mean_rel': float(relative.mean()) if len(relative) else None,
+            'mismatches': int(wrong.sum())
+        }
+
+    (lands, counts) = np.unique(old['land'][old_index][mismatched],
+                                return_counts=True)
+    report['mismatched'] = mismatched
+    report['mismatches'] = int(mismatched.sum())
+    report['mismatches_by_land'] = dict(zip(lands.tolist(), counts.tolist()))
+    return report
+
+
+def _format(value):
+    return '-' if value is None else '%.6g' % value
+
+
+def print_report(report, old, new, show=0):
+    """
+    Print a comparison report (see `compare_tables`), with up to
+    `show` of the mismatching rows.
+    """
+    print('# rows in old table: ', report['old_rows'])
+    print('# rows in new table: ', report['new_rows'])
+    for (name, count) in zip(['old', 'new'], report['duplicates']):
+        if count:
+            print('# duplicate rows in %s table: ' % name, count)
+    print('# rows where input matches: ', report['matched'])
+    print('# rows where input and output match: ',
+          report['matched'] - report['mismatches'])
+    print()
+    print('%-6s %12s %12s %12s %12s %12s' % (
+        'column', 'max abs', 'mean abs', 'max rel', 'mean rel', 'mismatches'))
+    for name in COLUMNS:
+        stats = report['columns'][name]
+        print('%-6s %12s %12s %12s %12s %12d' % (
+            name, _format(stats['max_abs']), _format(stats['mean_abs']),
+            _format(stats['max_rel']), _format(stats['mean_rel']),
+            stats['mismatches']))
+
+    if report['mismatches_by_land']:
+        print()
+        print('mismatches by land use:')
+        for (land, count) in sorted(report['mismatches_by_land'].items()):
+            print('  %-24s %d' % (land, count))
+
+    mismatched = np.flatnonzero(report['mismatched'])[:show]
+    for (i, j) in zip(report['old_index'][mismatched].tolist(),
+                      report['new_index'][mismatched].tolist()):
+        print()
+        print('output does not match')
+        for (label, table, row) in (('old row: ', old, i),
+                                    ('new row: ', new, j)):
+            print(label, dict((name, table[name][row].item())
+                              for name in ('P', 'land', 'soil') + COLUMNS))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m tr55.compareMiniAppTables',
+        description='Compare a mini-app table with a golden table.')
+    parser.add_argument('old_csv_file_name', help='the golden table')
+    parser.add_argument('new_csv_file_name', help='the table to check')
+    parser.add_argument('--decimals', type=int, default=1,
+                        help='number of decimal places that must match '
+                        '(default: 1)')
+    parser.add_argument('--show', type=int, default=0, metavar='N',
+                        help='print the first N mismatching rows')
+    args = parser.parse_args(argv)
+
+    old = read_table(args.old_csv_file_name)
+    new = read_table(args.new_csv_file_name)
+    report = compare_tables(old, new, args.decimals)
+    print_report(report, old, new, args.show)
 
 
-# Generate keys from rows that will be used to match rows in the
-# old and new table.
-# If transform == True, convert values of row so that
-# land and soil_types are in the format of the data table
-# from the old mini-app
-def get_key(row, transform=False):
-    P = row['P']
-    land = row['land']
-    soil = row['soil']
-    if transform:
-        land = str(lookup_nlcd(row['land']))
-        new_soil_types = ['a', 'b', 'c', 'd']
-        old_soil_types = ['0', '1', '2', '3']
-        soil_types_map = dict(zip(new_soil_types, old_soil_types))
-        soil = soil_types_map[row['soil']]
-
-    return (P, land, soil)
-
-
-def isClose(val1, val2):
-    val1 = round(float(val1), 1)
-    val2 = round(float(val2), 1)
-    return val1 == val2
-
-
-def rowsMatch(old_row, new_row):
-    return isClose(old_row['ET'], new_row['ET']) and \
-        isClose(old_row['I'], new_row['I']) and \
-        isClose(old_row['R'], new_row['R'])
-
-
-def test_get_key():
-    old_row = {'land': '71', 'I': '1.6', 'soil': '2',
-               'P': '2.0', 'R': '0.2', 'ET': '0.1'}
-    new_row = {'land': 'grassland', 'I': '1.6100773216841155',
-               'soil': 'c', 'P': '2.0', 'R': '0.2657226783158845',
-               'ET': '0.12419999999999999'}
-    assert get_key(old_row) == get_key(new_row, transform=True) \
-                            == ('2.0', '71', '2')
-
-
-test_get_key()
-
-if len(sys.argv) != 3:
-    print ('Usage: python -m tr55.compareMiniAppTable ' +
-           'old_csv_file_name new_csv_file_name')
-    sys.exit()
-else:
-    old_csv_fn = sys.argv[1]
-    new_csv_fn = sys.argv[2]
-
-with open(old_csv_fn, 'rb') as old_csv_file:
-    with open(new_csv_fn, 'rb') as new_csv_file:
-        old_reader = csv.DictReader(old_csv_file)
-        new_reader = csv.DictReader(new_csv_file)
-
-        old_row_dict = dict([(get_key(old_row), old_row)
-                             for old_row in old_reader])
-        new_row_dict = dict([(get_key(new_row, transform=True), new_row)
-                             for new_row in new_reader])
-
-        num_in_match_rows = 0
-        num_in_out_match_rows = 0
-        for key, new_row in new_row_dict.iteritems():
-            if key in old_row_dict:
-                old_row = old_row_dict[key]
-                if rowsMatch(old_row, new_row):
-                    num_in_out_match_rows += 1
-                else:
-                    print 'output does not match'
-                    print 'old row: ', old_row
-                    print 'new row: ', new_row
-                    print
-                num_in_match_rows += 1
-
-        print '# rows in new table: ', len(new_row_dict)
-        print '# rows where input matches: ', num_in_match_rows
-        print '# rows where input and output match: ', num_in_out_match_rows
+if __name__ == '__main__':
+    main()
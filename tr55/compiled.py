@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Compiled censuses.
+
+`simulate_day` builds and walks nested dictionaries on every call.  A
+compiled census does that work once: the unmodified and modified trees
+are flattened into arrays of cell counts, parent indices and cell type
+codes, so that simulating the same area of interest again only costs
+some array arithmetic.
+"""
+
+import copy
+
+import numpy as np
+
+from tr55.columnar import ColumnarTree, default_key, level_dtype
+from tr55.model import ET_MAX, simulate_cells_day, create_modified_census, \
+    compute_bmp_effect_array, verify_census
+from tr55.registry import get_registry
+
+
+# The scenarios known to `simulate_scenarios`, as the tree of the
+# compiled census to simulate and whether to apply the Pre-Columbian
+# projection to it.
+SCENARIOS = {
+    'current': ('unmodified', False),
+    'modified': ('modified', False),
+    'precolumbian': ('unmodified', True),
+}
+
+DEFAULT_SCENARIOS = ('current', 'modified', 'precolumbian')
+
+
+def _readonly(array):
+    array.setflags(write=False)
+    return array
+
+
+class CompiledTree(object):
+    """
+    A census tree (as taken by `simulate_water_quality`) flattened into
+    arrays.  The nodes are numbered in pre-order, so the children of
+    each node appear in the same order as in its distribution.
+
+     * `keys[i]` is the key of node `i` in its parent's distribution
+       (None for the root)
+     * `parents[i]` is the index of the parent of node `i` (-1 for the
+       root)
+     * `counts[i]` is the cell count of node `i` as it will be reported
+       (for internal nodes, the sum of the counts of their children)
+     * `codes[i]` is the cell type code of node `i` if it is a leaf and
+       -1 otherwise
+    """
+    def __init__(self, tree, registry):
+        keys = []
+        parents = []
+        depths = []
+        counts = []
+        internal = []
+        extras = []
+
+        stack = [(None, -1, 0, tree)]
+        while stack:
+            (key, parent, depth, node) = stack.pop()
+            if 'cell_count' not in node:
+                raise ValueError('Census node %s has no cell_count' % key)
+            index = len(keys)
+            keys.append(key)
+            parents.append(parent)
+            depths.append(depth)
+            counts.append(node['cell_count'])
+            internal.append('distribution' in node)
+            extras.append(dict((k, v) for (k, v) in node.items()
+                               if k not in ('cell_count', 'distribution')))
+            if 'distribution' in node:
+                children = list(node['distribution'].items())
+                for (child_key, child) in reversed(children):
+                    stack.append((child_key, index, depth + 1, child))
+
+        size = len(keys)
+        children = [[] for _ in range(size)]
+        for index in range(1, size):
+            children[parents[index]].append(index)
+
+        # An internal node with a cell count of zero is not simulated,
+        # and neither is anything underneath it.  Other internal nodes
+        # are "tallied": their values are the sums of their children's.
+        live = [True] * size
+        tallied = [False] * size
+        for index in range(size):
+            if not live[index]:
+                for child in children[index]:
+                    live[child] = False
+            elif internal[index]:
+                tallied[index] = (counts[index] != 0)
+                for child in children[index]:
+                    live[child] = tallied[index]
+
+        # Work out the tallied cell counts and which nodes end up with
+        # pollutant loads, from the bottom up.
+        loaded = [False] * size
+        for index in reversed(range(size)):
+            if not live[index]:
+                continue
+            elif tallied[index]:
+                total = 0
+                for child in children[index]:
+                    total = total + counts[child]
+                    loaded[index] = loaded[index] or loaded[child]
+                counts[index] = total
+            elif internal[index]:
+                loaded[index] = True
+            else:
+                loaded[index] = (counts[index] != 0)
+
+        leaf = [live[i] and not internal[i] for i in range(size)]
+        codes = [registry.code(keys[i]) if leaf[i] else -1
+                 for i in range(size)]
+
+        self.keys = keys
+        self.extras = extras
+        self.internal = internal
+        self.children = children
+        self.parents = _readonly(np.array(parents, dtype=np.intp))
+        self.counts = _readonly(np.array(counts))
+        self.codes = _readonly(np.array(codes, dtype=np.intp))
+        self.live = _readonly(np.array(live, dtype=bool))
+        self.tallied = _readonly(np.array(tallied, dtype=bool))
+        self.loaded = _readonly(np.array(loaded, dtype=bool))
+        self.leaves = _readonly(np.flatnonzero(leaf))
+        self.key_codes = _readonly(np.array(
+            [-1] + [registry.code(key) for key in keys[1:]], dtype=np.intp))
+
+        # The nodes that are added to their parents, grouped by depth
+        # from the deepest level up.
+        depths = self.depths = _readonly(np.array(depths, dtype=np.intp))
+        summed = self.live & (self.parents >= 0)
+        self.levels = [_readonly(np.flatnonzero(summed & (depths == depth)))
+                       for depth in range(depths.max(), 0, -1)]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def sum_levels(self, values):
+        """
+        Sum the values of the nodes (the first axis of `values`) into
+        their parents in place, in the same order in which
+        `simulate_water_quality` adds up subtrees.
+        """
+        for level in self.levels:
+            np.add.at(values, self.parents[level], values[level])
+        return values
+
+    def leaf_volumes(self, responses, positions):
+        """
+        Compute the runoff, evapotranspiration and infiltration volumes
+        of the leaves from the per-cell responses (see
+        `simulate_cells_day`) of the cell types at the given positions.
+        """
+        counts = self.counts[self.leaves].astype(np.float64)
+        counts = counts.reshape((-1,) + (1,) * (responses[0].ndim - 1))
+        return [counts * response[positions] for response in responses]
+
+    def evaluate(self, volumes, loads, cell_res, pct=1.0):
+        """
+        Compute the volumes and pollutant loads of all nodes from the
+        leaf volumes and the event mean concentrations of the leaves.
+
+        The result has one row per node, with columns of runoff,
+        evapotranspiration and infiltration volumes followed by the
+        pollutant loads.
+        """
+        (runoff, evaptrans, inf) = volumes
+        runoff_adjustment = runoff - (runoff * pct)
+        runoff = runoff - runoff_adjustment
+        inf = inf + runoff_adjustment
+
+        # See `get_volume_of_runoff` and `get_pollutant_load`.
+        counts = self.counts[self.leaves].astype(np.float64)
+        counts = counts.reshape(runoff.shape[:1] + (1,) * (runoff.ndim - 1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            runoff_per_cell = runoff / counts
+        liters = runoff_per_cell * 0.0254 * counts * cell_res * 1000
+        liters = liters.reshape(liters.shape + (1,))
+        pollutants = (loads * liters / 1000000) * 2.205
+        pollutants = np.where(counts[..., np.newaxis] != 0, pollutants, 0.0)
+
+        columns = np.concatenate([runoff[..., np.newaxis],
+                                  evaptrans[..., np.newaxis],
+                                  inf[..., np.newaxis],
+                                  pollutants], axis=-1)
+        values = np.zeros((len(self),) + columns.shape[1:])
+        values[self.leaves] = columns
+        return self.sum_levels(values)
+
+    def to_dict(self, values, pollutants):
+        """
+        Turn the values computed by `evaluate` into a tree like the ones
+        returned by `simulate_day`.  If `values` has more than one row
+        per node (one per day, say), the values in the tree are arrays.
+        """
+        if values.ndim == 2:
+            rows = values.tolist()
+            (zero, empty) = (lambda: 0.0, lambda: 0)
+        else:
+            rows = [np.moveaxis(row, -1, 0) for row in values]
+            shape = values.shape[1:-1]
+            # Each node gets arrays of its own.
+            zero = empty = lambda: np.zeros(shape)
+        counts = self.counts.tolist()
+        nodes = []
+        for index in range(len(self)):
+            node = copy.deepcopy(self.extras[index])
+            n = counts[index]
+            node['cell_count'] = n
+            if self.live[index] and n > 0:
+                row = rows[index]
+                node['runoff'] = row[0] / n
+                node['et'] = row[1] / n
+                node['inf'] = row[2] / n
+            else:
+                node['runoff'] = empty()
+                node['et'] = empty()
+                node['inf'] = empty()
+            if self.loaded[index]:
+                if self.tallied[index] or self.codes[index] >= 0:
+                    node.update(zip(pollutants, rows[index][3:]))
+                else:
+                    node.update((pollutant, zero())
+                                for pollutant in pollutants)
+            if self.internal[index]:
+                node['distribution'] = {}
+            nodes.append(node)
+            if index > 0:
+                parent = nodes[self.parents[index]]
+                parent['distribution'][self.keys[index]] = node
+        return nodes[0]
+
+    def to_columnar(self, values, pollutants):
+        """
+        Turn the values computed by `evaluate` into a
+        `tr55.columnar.ColumnarTree` holding the same result as
+        `to_dict` gives.
+        """
+        counts = self.counts.reshape((-1,) + (1,) * (values.ndim - 2))
+        simulated = self.live.reshape(counts.shape) & (counts > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            volumes = [np.where(simulated, values[..., i] / counts, 0.0)
+                       for i in range(3)]
+        loaded = self.loaded.reshape(counts.shape)
+        computed = (self.tallied | (self.codes >= 0)).reshape(counts.shape)
+        loads = [np.where(loaded, np.where(computed, values[..., 3 + i], 0.0),
+                          np.nan)
+                 for i in range(len(pollutants))]
+
+        registry = get_registry()
+        dtype = level_dtype(self.counts.dtype, pollutants,
+                            values.shape[1:-1])
+        rows = np.empty(len(self), dtype=np.intp)
+        levels = []
+        for depth in range(self.depths.max() + 1):
+            nodes = np.flatnonzero(self.depths == depth)
+            rows[nodes] = np.arange(len(nodes))
+            level = np.empty(len(nodes), dtype=dtype)
+            level['code'] = self.key_codes[nodes]
+            level['parent'] = rows[self.parents[nodes]] if depth else -1
+            level['cell_count'] = self.counts[nodes]
+            level['simulated'] = simulated.reshape(-1)[nodes]
+            for (name, column) in zip(['runoff', 'et', 'inf'] + pollutants,
+                                      volumes + loads):
+                level[name] = column[nodes]
+            levels.append(level)
+
+        extras = {}
+        keys = {}
+        rows = rows.tolist()
+        depths = self.depths.tolist()
+        codes = self.key_codes.tolist()
+        for index in range(len(self)):
+            where = (depths[index], rows[index])
+            node = self.extras[index]
+            if self.internal[index] and not self.children[index]:
+                node = dict(node, distribution={})
+            if node:
+                extras[where] = copy.deepcopy(node)
+            if index > 0 and \
+               self.keys[index] != default_key(registry, codes[index]):
+                keys[where] = self.keys[index]
+        return ColumnarTree(levels, pollutants, extras, keys)
+
+
+class CompiledCensus(object):
+    """
+    A census that has been compiled for repeated simulation.  It
+    should be treated as immutable; use `compile_census` to make one.
+    """
+    def __init__(self, census):
+        self.registry = get_registry()
+
+        if 'modifications' in census:
+            verify_census(census)
+        unmodified = dict((key, value) for (key, value) in census.items()
+                          if key != 'modifications')
+        self.unmodified = CompiledTree(unmodified, self.registry)
+        self.modified = CompiledTree(create_modified_census(census),
+                                     self.registry)
+        self.bmps = copy.deepcopy(self.modified.extras[0].get('BMPs', {}))
+
+        # All of the cell types that are simulated, with and without
+        # the Pre-Columbian projection, and where each leaf's type is
+        # found among them.
+        precolumbian = np.array(self.registry.precolumbian, dtype=np.intp)
+        leaf_codes = [tree.codes[tree.leaves]
+                      for tree in (self.unmodified, self.modified)]
+        self.codes = _readonly(np.unique(np.concatenate(
+            leaf_codes + [precolumbian[codes] for codes in leaf_codes])))
+        self._positions = {}
+        for (tree, codes) in zip((self.unmodified, self.modified), leaf_codes):
+            for pc in (False, True):
+                if pc:
+                    codes = precolumbian[codes]
+                self._positions[(tree, pc)] = \
+                    _readonly(np.searchsorted(self.codes, codes))
+        self._checked = set()
+
+    def _check(self, pc):
+        """
+        Make sure that the tables have everything that is needed to
+        simulate the cell types of this census, raising the same
+        errors as the table lookups otherwise.
+        """
+        if pc in self._checked:
+            return
+        for tree in (self.unmodified, self.modified):
+            codes = self.codes[self._positions[(tree, pc)]]
+            loaded = tree.counts[tree.leaves] != 0
+            self.registry.check(codes, codes[loaded])
+        self._checked.add(pc)
+
+    def _evaluate(self, tree, responses, loads, cell_res, precip, pc,
+                  bmps=False):
+        positions = self._positions[(tree, pc)]
+        volumes = tree.leaf_volumes(responses, positions)
+        pct = 1.0
+        if bmps:
+            runoff = np.zeros((len(tree),) + volumes[0].shape[1:])
+            runoff[tree.leaves] = volumes[0]
+            runoff_vol = tree.sum_levels(runoff)[0]
+            pct = compute_bmp_effect_array({'runoff-vol': runoff_vol,
+                                            'BMPs': self.bmps},
+                                           cell_res, precip)
+        leaf_loads = loads[positions]
+        leaf_loads = leaf_loads.reshape(
+            leaf_loads.shape[:1] + (1,) * (volumes[0].ndim - 1) +
+            leaf_loads.shape[1:])
+        return tree.evaluate(volumes, leaf_loads, cell_res, pct)
+
+    def simulate(self, precip, cell_res=10, precolumbian=False,
+                 columnar=False):
+        """
+        Simulate a day.  The arguments and the result are as for
+        `simulate_day`, which this gives identical results to.
+
+        If `columnar` is true, the trees of the result are
+        `tr55.columnar.ColumnarTree`s instead of dictionaries.
+        """
+        return self._simulate(precip, ET_MAX, self.codes, cell_res,
+                              precolumbian, columnar)
+
+    def simulate_days(self, precip_series, et_series=None, cell_res=10,
+                      precolumbian=False, columnar=False):
+        """
+        Simulate a series of days.  See `simulate_days`.
+        """
+        precip = np.asarray(precip_series, dtype=np.float64)
+        if precip.ndim != 1:
+            raise ValueError('The precipitation series must be 1-dimensional')
+        et_max = ET_MAX if et_series is None else \
+            np.asarray(et_series, dtype=np.float64)
+        et_max = np.broadcast_to(et_max, precip.shape)
+        return self._simulate(precip[np.newaxis, :], et_max[np.newaxis, :],
+                              self.codes[:, np.newaxis], cell_res,
+                              precolumbian, columnar)
+
+    def simulate_scenarios(self, precip, scenarios=DEFAULT_SCENARIOS,
+                           cell_res=10, columnar=False):
+        """
+        Simulate a day under several scenarios.  See
+        `simulate_scenarios`.
+        """
+        for scenario in scenarios:
+            if scenario not in SCENARIOS:
+                raise ValueError('Unknown scenario: %s' % scenario)
+        runs = [SCENARIOS[scenario] for scenario in scenarios]
+        results = self._simulate_trees(precip, ET_MAX, self.codes, cell_res,
+                                       runs, columnar)
+        return dict(zip(scenarios, results))
+
+    def _simulate(self, precip, et_max, codes, cell_res, precolumbian,
+                  columnar=False):
+        (unmodified, modified) = self._simulate_trees(
+            precip, et_max, codes, cell_res,
+            [('unmodified', precolumbian), ('modified', precolumbian)],
+            columnar)
+        return {
+            'unmodified': unmodified,
+            'modified': modified
+        }
+
+    def _simulate_trees(self, precip, et_max, codes, cell_res, runs,
+                        columnar=False):
+        """
+        Simulate the given (tree name, precolumbian) pairs, sharing the
+        responses of the cell types between them.
+        """
+        for pc in sorted(set(pc for (_, pc) in runs)):
+            self._check(pc)
+        responses = simulate_cells_day(precip, et_max, codes)
+        precip = np.asarray(precip)[0] if np.ndim(precip) else precip
+        loads = self.registry.columns().loads[self.codes]
+        pollutants = self.registry.pollutants
+
+        results = []
+        for (name, pc) in runs:
+            tree = getattr(self, name)
+            values = self._evaluate(tree, responses, loads, cell_res, precip,
+                                    pc, bmps=(name == 'modified'))
+            if columnar:
+                results.append(tree.to_columnar(values, pollutants))
+            else:
+                results.append(tree.to_dict(values, pollutants))
+        return results
+
+
+def compile_census(census):
+    """
+    Compile a census (as taken by `simulate_day`) for repeated
+    simulation.  The returned `CompiledCensus` has a `simulate` method
+    that takes the remaining arguments of `simulate_day`.
+    """
+    return CompiledCensus(census)
+
+
+def simulate_days(census, precip_series, et_series=None, cell_res=10,
+                  precolumbian=False, columnar=False):
+    """
+    Simulate a series of days, including water quality effects of
+    modifications.
+
+    `census`, `cell_res` and `precolumbian` are as for `simulate_day`.
+
+    `precip_series` is an array with the amount of precipitation in
+    inches on each day.
+
+    `et_series` is an optional array with the maximum
+    evapotranspiration in inches on each day (before taking the
+    crop/landscape factor into account).  The default is the constant
+    used by `simulate_day`.
+
+    The result has the same shape as that of `simulate_day`, except
+    that the runoff, evapotranspiration, infiltration and pollutant
+    values are arrays with one element per day.  Each day's values are
+    identical to what `simulate_day` gives for that day.
+
+    If `columnar` is true, the trees of the result are
+    `tr55.columnar.ColumnarTree`s whose values have one element per
+    day.
+    """
+    return compile_census(census).simulate_days(precip_series, et_series,
+                                                cell_res, precolumbian,
+                                                columnar)
+
+
+def simulate_scenarios(census, precip, scenarios=DEFAULT_SCENARIOS,
+                       cell_res=10, columnar=False):
+    """
+    Simulate a day under several scenarios at once, sharing the census
+    bookkeeping and the responses of the cell types between them.
+
+    `census`, `precip` and `cell_res` are as for `simulate_day`.
+
+    `scenarios` is a sequence of scenario names:
+     * "current" is the unmodified result of `simulate_day`
+     * "modified" is the modified result of `simulate_day`
+     * "precolumbian" is the unmodified result of `simulate_day` with
+       `precolumbian=True`
+
+    The return value is a dictionary from scenario name to result
+    (a `tr55.columnar.ColumnarTree` if `columnar` is true).
+    """
+    return compile_census(census).simulate_scenarios(precip, scenarios,
+                                                     cell_res, columnar)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Optional instrumentation of the model.
+
+While a collector is active, the phases of `simulate_day` (and of
+`simulate_modifications`) record their wall time, the number of leaves
+that they simulate and the number of cell types that the registry
+compiles (looks up in the tables) during them:
+
+    from tr55.instrumentation import collect
+
+    with collect() as collector:
+        simulate_day(census, precip)
+    collector.phases['create_modified_census']['seconds']
+
+Collectors are per thread.  When none is active, the instrumentation
+points do next to nothing.
+"""
+
+import threading
+import timeit
+
+from tr55.registry import set_compile_hook
+
+_local = threading.local()
+_lock = threading.Lock()
+_active = [0]
+
+
+def _collectors():
+    try:
+        return _local.collectors
+    except AttributeError:
+        _local.collectors = []
+        return _local.collectors
+
+
+def _current_phase():
+    collectors = _collectors()
+    if collectors and collectors[-1]._running:
+        return collectors[-1]._running[-1]
+    return None
+
+
+def _count_compilations(n):
+    phase = _current_phase()
+    if phase is not None:
+        phase.compilations += n
+
+
+class Collector(object):
+    """
+    Collects measurements of the phases of the model.
+
+    `phases` maps the name of each phase to a dictionary with the
+    number of times that it ran ("calls"), the total wall time in
+    seconds ("seconds"), the number of leaves simulated, that is,
+    passed to the leaf function of `simulate_water_quality`
+    ("leaves"), and the number of cell types that the registry
+    compiled ("compilations").  Phases that walk the leaves without
+    simulating them, such as `apply_bmp_effect`, simulate no leaves.
+
+    If given, `callback` is called with the name of a phase and the
+    measurements of that single run (in the same form) every time that
+    a phase finishes.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.phases = {}
+        self._running = []
+
+    def _finish(self, phase):
+        totals = self.phases.get(phase.name)
+        if totals is None:
+            totals = self.phases[phase.name] = {
+                'calls': 0,
+                'seconds': 0.0,
+                'leaves': 0,
+                'compilations': 0
+            }
+        totals['calls'] += 1
+        totals['seconds'] += phase.seconds
+        totals['leaves'] += phase.leaves
+        totals['compilations'] += phase.compilations
+        if self.callback is not None:
+            self.callback(phase.name, {
+                'calls': 1,
+                'seconds': phase.seconds,
+                'leaves': phase.leaves,
+                'compilations': phase.compilations
+            })
+
+
+class _Phase(object):
+    def __init__(self, collector, name):
+        self.collector = collector
+        self.name = name
+        self.seconds = 0.0
+        self.leaves = 0
+        self.compilations = 0
+
+    def __enter__(self):
+        self.collector._running.append(self)
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = timeit.default_timer() - self.start
+        self.collector._running.pop()
+        self.collector._finish(self)
+        return False
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class collect(object):
+    """
+    A context manager that collects measurements of the model on the
+    current thread while it is active.  It gives a `Collector`; see
+    that for `callback`.
+    """
+    def __init__(self, callback=None):
+        self.collector = Collector(callback)
+
+    def __enter__(self):
+        _collectors().append(self.collector)
+        with _lock:
+            _active[0] += 1
+            set_compile_hook(_count_compilations)
+        return self.collector
+
+    def __exit__(self, *exc_info):
+        _collectors().remove(self.collector)
+        with _lock:
+            _active[0] -= 1
+            if _active[0] == 0:
+                set_compile_hook(None)
+        return False
+
+
+def phase(name):
+    """
+    Return a context manager that measures the named phase if a
+    collector is active on this thread.
+    """
+    collectors = _collectors()
+    if not collectors:
+        return _NULL_PHASE
+    return _Phase(collectors[-1], name)
+
+
+def count_leaves(fn):
+    """
+    Wrap a leaf function (as taken by `simulate_water_quality`) so
+    that its calls are counted as simulated leaves, if a collector is
+    active on this thread.  Otherwise `fn` is returned as is.
+    """
+    if not _collectors():
+        return fn
+
+    def counted(cell, cell_count):
+        phase = _current_phase()
+        if phase is not None:
+            phase.leaves += 1
+        return fn(cell, cell_count)
+    return counted
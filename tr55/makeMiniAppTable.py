@@ -1,13 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
 """
 Generates a table with the model output for different input values.
 This table is used in the mini-app.
+
+The table has a row for every combination of precipitation, land use
+and soil type, with the evapotranspiration, infiltration and runoff of
+a single cell on a single day (all in centimeters):
+
+    python -m tr55.makeMiniAppTable table.csv
+    python -m tr55.makeMiniAppTable table.csv --precip-range 0 30 0.01 \\
+        --land developed_low developed_low:green_roof
+
+The whole grid is computed with the vectorized kernels and written out
+in chunks, so tables with millions of rows only take seconds.
 """
 
-from itertools import product
+import argparse
 import csv
-import sys
+import io
+
+import numpy as np
+
+from tr55.model import ET_MAX, simulate_cells_day
+from tr55.registry import get_registry
+from tr55.tables import SOIL_TYPES
+
+# values of inputs to the model
+PRECIP_CM = [1, 3, 5, 8, 21]
+
+# The land uses in the original mini-app used non NLCD types
+# (residential, high intensity residential, commercial, etc.) These were
+# converted to the best matches from the NLCD types based on the NLCD
+# number being used for the calculations in tables.py.
+LAND_USES = [
+    'open_water',
+    'developed_open',
+    'developed_low',
+    'developed_med',
+    'developed_high',
+    'barren_land',
+    'deciduous_forest',
+    'shrub',
+    'grassland',
+    'pasture',
+    'cultivated_crops',
+    'woody_wetlands'
+]
+
+HEADER = ('P', 'land', 'soil', 'ET', 'I', 'R')
 
-from tr55.model import simulate_day
+DEFAULT_CHUNK_SIZE = 1 << 16
 
 
 def cm_to_inches(cm):
@@ -18,64 +64,129 @@ def inches_to_cm(inches):
     return inches * 2.54
 
 
-if len(sys.argv) != 2:
-    print 'Usage: python -m tr55.makeMiniAppTable csv_file_name'
-    sys.exit()
-else:
-    csv_file_name = sys.argv[1]
-
-with open(csv_file_name, 'wb') as csv_file:
-    writer = csv.writer(csv_file)
-    writer.writerow(('P', 'land', 'soil', 'ET', 'I', 'R'))
-
-    # values of inputs to the model
-    precip_cm = [1, 3, 5, 8, 21]
-
-    # The land uses in the original mini-app used non NLCD types
-    # (residential, high intensity residential, commercial, etc.) These were
-    # converted to the best matches from the NLCD types based on the NLCD
-    # number being used for the calculations in tables.py.
-    land_uses = [
-        'open_water',
-        'developed_open',
-        'developed_low',
-        'developed_med',
-        'developed_high',
-        'barren_land',
-        'deciduous_forest',
-        'shrub',
-        'grassland',
-        'pasture',
-        'cultivated_crops',
-        'woody_wetlands'
-    ]
-
-    soil_types = ['a', 'b', 'c', 'd']
-
-    soil_type_map = {
-        'a': 0,
-        'b': 1,
-        'c': 2,
-        'd': 3
-    }
-
-    # For each input value, compute the model outputs for a
-    # single day and tile.
-    for precip, land_use, soil_type in product(precip_cm,
-                                               land_uses,
-                                               soil_types):
-        cells = {
-            'cell_count': 1,
-            'distribution': {
-                '%s:%s' % (soil_type, land_use): {'cell_count': 1}
-            }
-        }
-
-        model_out = simulate_day(cells, cm_to_inches(precip))['unmodified']
-
-        writer.writerow((precip,
-                         land_use,
-                         soil_type_map[soil_type],
-                         inches_to_cm(model_out['et']),
-                         inches_to_cm(model_out['inf']),
-                         inches_to_cm(model_out['runoff'])))
+def _csv_text(row):
+    """
+    Return the given row as a line of CSV, without the line break.
+    """
+    text = io.StringIO()
+    csv.writer(text, lineterminator='').writerow(row)
+    return text.getvalue()
+
+
+def _table_columns(precip_cm, land_uses, soil_types, chunk_size):
+    """
+    Compute the table for the given axes in chunks, yielding the cells
+    (land use, soil index) of the table, and then for each chunk the
+    precipitation and cell indices of its rows and their ET,
+    infiltration and runoff in centimeters.
+    """
+    registry = get_registry()
+    cells = [(land_use, SOIL_TYPES.index(soil_type))
+             for land_use in land_uses for soil_type in soil_types]
+    codes = registry.codes(['%s:%s' % (SOIL_TYPES[soil], land_use)
+                            for (land_use, soil) in cells])
+    registry.check(codes)
+    precip_in = cm_to_inches(np.asarray(precip_cm, dtype=np.float64))
+    yield cells
+
+    rows = len(precip_cm) * len(cells)
+    for start in range(0, rows, chunk_size):
+        index = np.arange(start, min(start + chunk_size, rows))
+        (precip, cell) = (index // len(cells), index % len(cells))
+        (runoff, et, inf) = simulate_cells_day(precip_in[precip], ET_MAX,
+                                               codes[cell])
+        yield (precip, cell, inches_to_cm(et), inches_to_cm(inf),
+               inches_to_cm(runoff))
+
+
+def table_chunks(precip_cm=PRECIP_CM, land_uses=LAND_USES,
+                 soil_types=SOIL_TYPES, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Compute the table for the given axes, yielding lists of rows (as
+    in `HEADER`) of at most `chunk_size` rows each.
+
+    The rows are in the order of `itertools.product(precip_cm,
+    land_uses, soil_types)`, and each of them has what `simulate_day`
+    gives for a census of a single cell of that type.  A land use may
+    have a BMP (e.g. "developed_low:green_roof").
+    """
+    columns = _table_columns(precip_cm, land_uses, soil_types, chunk_size)
+    cells = next(columns)
+    for (precip, cell, et, inf, runoff) in columns:
+        cell = [cells[i] for i in cell.tolist()]
+        yield [(precip_cm[p], land_use, soil, e, i, r)
+               for (p, (land_use, soil), e, i, r)
+               in zip(precip.tolist(), cell, et.tolist(), inf.tolist(),
+                      runoff.tolist())]
+
+
+def write_table(csv_file, precip_cm=PRECIP_CM, land_uses=LAND_USES,
+                soil_types=SOIL_TYPES, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write the table for the given axes (see `table_chunks`) to an open
+    file as CSV, returning the number of rows written.
+    """
+    # Formatting the numbers takes longer than computing them, so the
+    # precipitation, land use and soil columns are formatted once per
+    # value, and so is the ET column (which has few distinct values).
+    columns = _table_columns(precip_cm, land_uses, soil_types, chunk_size)
+    cells = [_csv_text(cell) + ',' for cell in next(columns)]
+    precips = [_csv_text([precip]) + ',' for precip in precip_cm]
+    csv_file.write(_csv_text(HEADER) + '\r\n')
+    count = 0
+    for (precip, cell, et, inf, runoff) in columns:
+        (et_values, et) = np.unique(et, return_inverse=True)
+        ets = [repr(value) for value in et_values.tolist()]
+        csv_file.write(''.join([
+            '%s%s%s,%r,%r\r\n' % (precips[p], cells[c], ets[e], i, r)
+            for (p, c, e, i, r) in zip(precip.tolist(), cell.tolist(),
+                                       et.reshape(-1).tolist(),
+                                       inf.tolist(), runoff.tolist())]))
+        count += len(precip)
+    return count
+
+
+def _number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m tr55.makeMiniAppTable',
+        description='Generate the mini-app table of model outputs.')
+    parser.add_argument('csv_file_name', help='the CSV file to write')
+    precip = parser.add_mutually_exclusive_group()
+    precip.add_argument('-p', '--precip', nargs='+', type=_number,
+                        default=PRECIP_CM, metavar='CM',
+                        help='precipitation values in cm (default: %s)'
+                        % ' '.join(str(value) for value in PRECIP_CM))
+    precip.add_argument('--precip-range', nargs=3, type=float,
+                        metavar=('START', 'STOP', 'STEP'),
+                        help='precipitation values in cm from START up to '
+                        '(not including) STOP')
+    parser.add_argument('-l', '--land', nargs='+', default=LAND_USES,
+                        metavar='LAND_USE', help='land uses, optionally with '
+                        'a BMP as land_use:bmp (default: the mini-app land '
+                        'uses)')
+    parser.add_argument('-s', '--soil', nargs='+', default=SOIL_TYPES,
+                        choices=SOIL_TYPES, help='soil types (default: all)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='number of rows to compute at a time')
+    args = parser.parse_args(argv)
+
+    precip_cm = args.precip
+    if args.precip_range:
+        # Rounded so that 0.1 steps give 0.3 rather than
+        # 0.30000000000000004.
+        precip_cm = np.round(np.arange(*args.precip_range), 10).tolist()
+
+    with open(args.csv_file_name, 'w', newline='') as csv_file:
+        write_table(csv_file, precip_cm, args.land, args.soil,
+                    max(1, args.chunk_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Batch simulation of many areas of interest.
+
+For a fixed precipitation and cell resolution, the runoff,
+evapotranspiration, infiltration and pollutant loads of a cell type
+are linear in the number of cells of that type.  So the unmodified
+results of many areas of interest can be computed at once from a
+sparse (area of interest x cell type) matrix of cell counts and the
+responses of the distinct cell types.
+"""
+
+import numpy as np
+
+from tr55.model import ET_MAX, simulate_cells_day
+from tr55.registry import get_registry
+
+
+class CensusMatrix(object):
+    """
+    A sparse (area of interest x cell type) matrix of cell counts, in
+    coordinate form: `counts[k]` cells of type `codes[cols[k]]` are in
+    area of interest `rows[k]`.  The entries of each row are in the
+    order of that census's distribution.
+
+    `cell_counts` holds the overall cell count of each area of
+    interest.
+    """
+    def __init__(self, rows, cols, counts, codes, cell_counts):
+        self.rows = np.asarray(rows, dtype=np.intp)
+        self.cols = np.asarray(cols, dtype=np.intp)
+        self.counts = np.asarray(counts)
+        self.codes = np.asarray(codes, dtype=np.intp)
+        self.cell_counts = np.asarray(cell_counts)
+
+    @property
+    def shape(self):
+        return (len(self.cell_counts), len(self.codes))
+
+    def toarray(self):
+        """
+        Return the matrix as a dense array.
+        """
+        dense = np.zeros(self.shape, dtype=self.counts.dtype)
+        np.add.at(dense, (self.rows, self.cols), self.counts)
+        return dense
+
+
+def census_matrix(censuses):
+    """
+    Build a `CensusMatrix` from an iterable of censuses (as taken by
+    `simulate_day`; modifications are ignored).
+    """
+    registry = get_registry()
+    rows = []
+    codes = []
+    counts = []
+    cell_counts = []
+    for (row, census) in enumerate(censuses):
+        cell_counts.append(census['cell_count'])
+        for (cell, subcensus) in census['distribution'].items():
+            if 'distribution' in subcensus:
+                raise ValueError('Census entry %s is not a leaf' % cell)
+            rows.append(row)
+            codes.append(registry.code(cell))
+            counts.append(subcensus['cell_count'])
+    (codes, cols) = np.unique(np.array(codes, dtype=np.intp),
+                              return_inverse=True)
+    return CensusMatrix(rows, cols.reshape(-1), counts, codes, cell_counts)
+
+
+def simulate_matrix(matrix, precip, cell_res=10, precolumbian=False):
+    """
+    Simulate a day for every area of interest in a `CensusMatrix`.
+
+    `precip`, `cell_res` and `precolumbian` are as for `simulate_day`.
+
+    The return value is a dictionary of arrays, with one element per
+    area of interest, of the overall cell count, runoff,
+    evapotranspiration, infiltration and pollutant loads.  These are
+    the same as the top-level values of the unmodified result of
+    `simulate_day`.
+    """
+    registry = get_registry()
+    codes = matrix.codes
+    if precolumbian:
+        codes = registry.columns().precolumbian[codes]
+    loaded = matrix.counts != 0
+    registry.check(codes, codes[matrix.cols[loaded]])
+
+    (runoff, evaptrans, inf) = simulate_cells_day(precip, ET_MAX, codes)
+    counts = matrix.counts.astype(np.float64)
+    cols = matrix.cols
+
+    # The volumes are the products of the counts and the responses,
+    # while the pollutant loads follow `get_volume_of_runoff` and
+    # `get_pollutant_load` exactly.
+    runoff_vol = counts * runoff[cols]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        runoff_per_cell = runoff_vol / counts
+    liters = runoff_per_cell * 0.0254 * counts * cell_res * 1000
+    loads = registry.columns().loads[codes][cols]
+    pollutants = (loads * liters[:, np.newaxis] / 1000000) * 2.205
+    pollutants = np.where(loaded[:, np.newaxis], pollutants, 0.0)
+
+    entries = np.concatenate([runoff_vol[:, np.newaxis],
+                              (counts * evaptrans[cols])[:, np.newaxis],
+                              (counts * inf[cols])[:, np.newaxis],
+                              pollutants], axis=1)
+
+    # Only areas of interest with cells get simulated, and their cell
+    # counts become the sums of those of their cell types.
+    rows = matrix.rows
+    simulated = (matrix.cell_counts != 0)[rows]
+    totals = np.zeros((matrix.shape[0], entries.shape[1]))
+    np.add.at(totals, rows[simulated], entries[simulated])
+    cell_counts = np.array(matrix.cell_counts)
+    summed = np.zeros_like(cell_counts)
+    np.add.at(summed, rows[simulated], matrix.counts[simulated])
+    cell_counts = np.where(matrix.cell_counts != 0, summed, cell_counts)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        depths = totals[:, :3] / cell_counts[:, np.newaxis]
+    depths = np.where(cell_counts[:, np.newaxis] > 0, depths, 0.0)
+
+    result = {
+        'cell_count': cell_counts,
+        'runoff': depths[:, 0],
+        'et': depths[:, 1],
+        'inf': depths[:, 2],
+    }
+    for (i, pollutant) in enumerate(registry.pollutants):
+        result[pollutant] = totals[:, 3 + i]
+    return result
+
+
+def simulate_censuses(censuses, precip, cell_res=10, precolumbian=False):
+    """
+    Simulate a day for each of a list of censuses, ignoring
+    modifications.
+
+    `precip`, `cell_res` and `precolumbian` are as for `simulate_day`.
+
+    The return value is a list with a dictionary for each census that
+    has the same top-level values (cell count, runoff,
+    evapotranspiration, infiltration and pollutant loads) as the
+    unmodified result of `simulate_day`.
+    """
+    matrix = census_matrix(censuses)
+    result = simulate_matrix(matrix, precip, cell_res, precolumbian)
+    columns = dict((key, value.tolist()) for (key, value) in result.items())
+    return [dict((key, value[row]) for (key, value) in columns.items())
+            for row in range(matrix.shape[0])]
@@ -16,13 +16,26 @@ and variables used in this program are as follows:
 """
 
 import copy
+import threading
+from collections import OrderedDict
+
 import numpy as np
 
 from tr55.tablelookup import lookup_cn, lookup_bmp_storage, \
-    lookup_ki, is_bmp, is_built_type, make_precolumbian, \
-    get_pollutants, get_bmps, lookup_pitt_runoff, lookup_bmp_drainage_ratio
-from tr55.water_quality import get_volume_of_runoff, get_pollutant_load
-from tr55.operations import dict_plus
+    get_pollutants, get_bmps, lookup_pitt_runoff, \
+    lookup_bmp_drainage_ratio, lookup_pitt_table, table_generation
+from tr55.water_quality import get_volume_of_runoff, pollutant_load
+from tr55.operations import dict_iadd
+from tr55.registry import get_registry, canonical_cell
+from tr55.instrumentation import phase, count_leaves
+
+
+ET_MAX = 0.207
+    # From the EPA WaterSense data finder for the Philadelphia airport (19153)
+    # Converted to daily number in inches per day.
+    # http://www3.epa.gov/watersense/new_homes/wb_data_finder.html
+    # TODO: include Potential Max ET as a data layer from CGIAR
+    # http://csi.cgiar.org/aridity/Global_Aridity_PET_Methodolgy.asp
 
 
 def runoff_pitt(precip, evaptrans, soil_type, land_use):
@@ -36,13 +49,55 @@ def runoff_pitt(precip, evaptrans, soil_type, land_use):
     """
 
     runoff_ratios = lookup_pitt_runoff(soil_type, land_use)
+    return pitt_runoff(precip, evaptrans, runoff_ratios['precip'],
+                       runoff_ratios['Rv'])
+
 
-    runoff_ratio = np.interp(precip, runoff_ratios['precip'], runoff_ratios['Rv'])
+def pitt_runoff(precip, evaptrans, steps, runoff_ratios):
+    """
+    `runoff_pitt` for the given rainfall steps and runoff ratios,
+    without any table lookups.
+    """
+    runoff_ratio = np.interp(precip, steps, runoff_ratios)
     runoff = precip*runoff_ratio
 
     return min(runoff, precip - evaptrans)
 
 
+def runoff_pitt_array(precip, evaptrans, land_use, soil_type):
+    """
+    A vectorized version of `runoff_pitt`.  The output is an array of
+    runoff values in inches.
+
+    `precip` and `evaptrans` are arrays (or scalars) of precipitation
+    and evapotranspiration in inches.  `land_use` and `soil_type` are
+    integer indices into the compiled Pitt table (see
+    `tr55.tablelookup.lookup_pitt_index`).  All four are broadcast
+    against each other, so many precipitation values can be
+    interpolated for many built types in one call.
+    """
+    table = lookup_pitt_table()
+    (precip, evaptrans, land_use, soil_type) = np.broadcast_arrays(
+        np.asarray(precip, dtype=np.float64),
+        np.asarray(evaptrans, dtype=np.float64),
+        np.asarray(land_use, dtype=np.intp),
+        np.asarray(soil_type, dtype=np.intp))
+
+    # Interpolate each table with `np.interp` (for identical results),
+    # for all of the elements that use it at once.
+    soil_types = table.ratios.shape[1]
+    tables = land_use * soil_types + soil_type
+    runoff_ratio = np.empty(precip.shape)
+    for index in np.unique(tables).tolist():
+        selected = (tables == index)
+        ratios = table.ratios[index // soil_types, index % soil_types]
+        runoff_ratio[selected] = np.interp(precip[selected], table.steps,
+                                           ratios)
+    runoff = precip*runoff_ratio
+
+    return np.minimum(runoff, precip - evaptrans)
+
+
 def nrcs_cutoff(precip, curve_number):
     """
     A function to find the cutoff between precipitation/curve number
@@ -63,6 +118,14 @@ def runoff_nrcs(precip, evaptrans, soil_type, land_use):
     """
 
     curve_number = lookup_cn(soil_type, land_use)
+    return nrcs_runoff(precip, evaptrans, curve_number)
+
+
+def nrcs_runoff(precip, evaptrans, curve_number):
+    """
+    `runoff_nrcs` for the given curve number, without any table
+    lookups.
+    """
     if nrcs_cutoff(precip, curve_number):
         return 0.0
     potential_retention = (1000.0 / curve_number) - 10
@@ -74,6 +137,56 @@ def runoff_nrcs(precip, evaptrans, soil_type, land_use):
     return min(runoff, precip - evaptrans)
 
 
+def _square(values):
+    """
+    Square the elements of an array exactly as the built-in `pow`
+    does.
+
+    `values * values` is correctly rounded, but the C library's `pow`
+    is not quite, so the squares that are close to halfway between
+    two floats are recomputed with `pow` (the error of each square is
+    computed exactly with Dekker's product).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    flat = values.reshape(-1)
+    square = flat * flat
+    split = 134217729.0 * flat
+    high = split - (split - flat)
+    low = flat - high
+    error = ((high * high - square) + 2 * high * low) + low * low
+    close = np.abs(error) > 0.45 * np.spacing(np.abs(square))
+    if close.any():
+        square[close] = [pow(value, 2) for value in flat[close].tolist()]
+    return square.reshape(values.shape)
+
+
+def runoff_nrcs_array(precip, evaptrans, curve_number):
+    """
+    A vectorized version of `runoff_nrcs`.  The output is an array of
+    runoff values in inches.
+
+    `precip`, `evaptrans` and `curve_number` are arrays (or scalars)
+    of precipitation in inches, evapotranspiration in inches and
+    runoff curve numbers.  They are broadcast against each other, and
+    each element of the result is identical to what `runoff_nrcs`
+    returns for the corresponding inputs.
+    """
+    precip = np.asarray(precip, dtype=np.float64)
+    evaptrans = np.asarray(evaptrans, dtype=np.float64)
+    curve_number = np.asarray(curve_number, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cutoff = precip <= -1 * (2 * (curve_number - 100.0) / curve_number)
+        potential_retention = (1000.0 / curve_number) - 10
+        initial_abs = 0.2 * potential_retention
+        precip_minus_initial_abs = precip - initial_abs
+        numerator = _square(precip_minus_initial_abs)
+        denominator = (precip_minus_initial_abs + potential_retention)
+        runoff = numerator / denominator
+    runoff = np.minimum(runoff, precip - evaptrans)
+    return np.where(cutoff, 0.0, runoff)
+
+
 def simulate_cell_day(precip, evaptrans, cell, cell_count):
     """
     Simulate a bunch of cells of the same type during a one-day event.
@@ -111,7 +224,8 @@ def simulate_cell_day(precip, evaptrans, cell, cell_count):
         return (runoff, et, inf)
 
     precip = max(0.0, precip)
-    soil_type, land_use, bmp = cell.lower().split(':')
+    registry = get_registry()
+    code = registry.code(cell)
 
     # If  there  is no  precipitation,  then  there  is no  runoff  or
     # infiltration;  however,  there  is evapotranspiration.   (It  is
@@ -126,19 +240,25 @@ def simulate_cell_day(precip, evaptrans, cell, cell_count):
 
     # If  the BMP  is cluster_housing  or  no_till, then  make it  the
     # land-use.  This is  done because those two types  of BMPs behave
-    # more like land-uses than they do BMPs.
-    if bmp and not is_bmp(bmp):
-        land_use = bmp or land_use
+    # more like land-uses than they do BMPs.  (The registry has already
+    # worked this out, and looked up the curve number and runoff
+    # ratios of the resulting soil type and land use.)
+    registry.validate(code, 'runoff')
+    values = registry.values()
+    curve_number = values.curve_number[code]
 
     # When the land-use is a built-type use the Pitt Small Storm Hydrology
     # Model until the runoff predicted by the NRCS model is greater than that
     # predicted by the NRCS model.
-    if is_built_type(land_use):
-        pitt_runoff = runoff_pitt(precip, evaptrans, soil_type, land_use)
-        nrcs_runoff = runoff_nrcs(precip, evaptrans, soil_type, land_use)
-        runoff = max(pitt_runoff, nrcs_runoff)
+    if values.built[code]:
+        table = lookup_pitt_table()
+        runoff_ratios = table.ratios[values.pitt_land_use[code],
+                                     values.pitt_soil_type[code]]
+        runoff = max(pitt_runoff(precip, evaptrans, table.steps,
+                                 runoff_ratios),
+                     nrcs_runoff(precip, evaptrans, curve_number))
     else:
-        runoff = runoff_nrcs(precip, evaptrans, soil_type, land_use)
+        runoff = nrcs_runoff(precip, evaptrans, curve_number)
     inf = max(0.0, precip - (evaptrans + runoff))
 
     # (runoff, evaptrans, inf) = clamp(runoff, evaptrans, inf, precip)
@@ -149,6 +269,261 @@ def simulate_cell_day(precip, evaptrans, cell, cell_count):
     }
 
 
+def simulate_cells_day(precip, et_max, codes):
+    """
+    A vectorized version of `simulate_cell_day` for a single cell of
+    each of the given types.
+
+    `precip` is the amount of precipitation in inches, and `et_max` is
+    the maximum evapotranspiration in inches per day (it is scaled by
+    the landscape coefficient of each cell type).  These may be arrays
+    that broadcast against `codes`.
+
+    `codes` is an array of cell type codes from the registry (see
+    `tr55.registry`).
+
+    The return value is a tuple of runoff, evapotranspiration and
+    infiltration arrays in inches.  Each element is identical to the
+    corresponding volume that `simulate_cell_day` returns for one cell.
+    """
+    columns = get_registry().columns()
+    codes = np.asarray(codes, dtype=np.intp)
+    precip = np.maximum(0.0, np.asarray(precip, dtype=np.float64))
+    evaptrans = et_max * columns.ki[codes]
+
+    runoff = runoff_nrcs_array(precip, evaptrans, columns.curve_number[codes])
+    built = columns.built[codes]
+    if built.any():
+        pitt_runoff = runoff_pitt_array(precip, evaptrans,
+                                        columns.pitt_land_use[codes],
+                                        columns.pitt_soil_type[codes])
+        runoff = np.where(built, np.maximum(pitt_runoff, runoff), runoff)
+    inf = np.maximum(0.0, precip - (evaptrans + runoff))
+
+    # No precipitation means no runoff, infiltration or
+    # evapotranspiration (see `simulate_cell_day`).
+    dry = (precip == 0.0)
+    return (np.where(dry, 0.0, runoff),
+            np.where(dry, 0.0, evaptrans),
+            np.where(dry, 0.0, inf))
+
+
+class ResponseCache(object):
+    """
+    A size-bounded cache of the responses of single cells (see
+    `simulate_cell_day`) that evicts the least recently used ones.  The
+    keys are (cell type code, precipitation, evapotranspiration)
+    tuples.
+
+    `simulate_day` only uses a cache once it has been installed with
+    `set_response_cache`.  `hits`, `misses` and `evictions` count what
+    has happened to the lookups and entries since the cache was made
+    (or `clear`ed).  The cache forgets its entries when the tables are
+    invalidated (see `tr55.tablelookup.invalidate_tables`).
+    """
+    def __init__(self, maxsize=1024):
+        if maxsize < 1:
+            raise ValueError('The size of a response cache must be at '
+                             'least 1')
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._generation = table_generation()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _check_generation(self):
+        generation = table_generation()
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def get(self, key):
+        """
+        Return the response cached under the given key, or None.  The
+        response must not be changed.
+        """
+        with self._lock:
+            self._check_generation()
+            response = self._entries.pop(key, None)
+            if response is None:
+                self.misses += 1
+            else:
+                self._entries[key] = response
+                self.hits += 1
+            return response
+
+    def put(self, key, response):
+        """
+        Cache a response under the given key, evicting the least
+        recently used responses if the cache is full.
+        """
+        with self._lock:
+            self._check_generation()
+            self._entries.pop(key, None)
+            self._entries[key] = response
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Remove all of the responses from the cache, and reset its
+        counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """
+        Return a dictionary with the counters of the cache, its
+        current "size" and its "maxsize".
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize
+            }
+
+
+_response_cache = None
+
+
+def set_response_cache(cache):
+    """
+    Make `simulate_day` use the given `ResponseCache`, or no cache if
+    it is None.  Returns the cache that was in use before.
+    """
+    global _response_cache
+    previous = _response_cache
+    _response_cache = cache
+    return previous
+
+
+def get_response_cache():
+    """
+    Return the `ResponseCache` that `simulate_day` uses, if any.
+    """
+    return _response_cache
+
+
+def normalize_cell(cell):
+    """
+    Return the normal form of a cell type string: lower case, and
+    without an empty BMP part ("a:developed_low" rather than
+    "A:Developed_Low:").
+    """
+    cell = canonical_cell(cell)
+    return cell[:-1] if cell.endswith(':') else cell
+
+
+def _merge_census(node, other):
+    """
+    Add the census node `other` into `node`.
+    """
+    node['cell_count'] = node.get('cell_count', 0) + other['cell_count']
+    for (key, value) in other.items():
+        if key == 'distribution':
+            distribution = node.setdefault('distribution', {})
+            for (cell, subnode) in value.items():
+                if cell in distribution:
+                    _merge_census(distribution[cell], subnode)
+                else:
+                    distribution[cell] = subnode
+        elif key != 'cell_count':
+            node[key] = value
+
+
+def _normalize_distribution(distribution, keep=()):
+    """
+    Return the normal form of a distribution: with normal keys,
+    duplicates merged, entries without cells (other than those in
+    `keep`) removed, and sorted keys.
+    """
+    merged = {}
+    for cell in sorted(distribution):
+        node = _normalize_node(distribution[cell])
+        key = normalize_cell(cell)
+        if key in merged:
+            _merge_census(merged[key], node)
+        else:
+            merged[key] = node
+    return dict((cell, merged[cell]) for cell in sorted(merged)
+                if merged[cell]['cell_count'] != 0 or cell in keep)
+
+
+def _normalize_node(node):
+    normal = dict((key, copy.deepcopy(value))
+                  for (key, value) in node.items()
+                  if key != 'distribution')
+    if 'distribution' in node:
+        normal['distribution'] = \
+            _normalize_distribution(node['distribution'])
+    return normal
+
+
+def normalize_census(census):
+    """
+    Return the normal form of a census (as taken by `simulate_day`),
+    which describes the same area with a tree that is as small as
+    possible.  Censuses that only differ in the order of their
+    entries, the spelling of their cell types, duplicate entries or
+    entries without cells have the same normal form.
+
+    Cell types are put in normal form (see `normalize_cell`),
+    duplicate cell types are merged, entries without cells (and the
+    subtrees under them) are removed, modifications with the same
+    change are merged, and keys are sorted.  The census itself is left
+    as it is.
+
+    `simulate_day` gives the same result for the normal form (up to
+    the spelling of the cell types, the entries without cells and the
+    last bits of the sums, which are taken in another order).
+    """
+    modifications = {}
+    for modification in (census.get('modifications') or []):
+        change = modification['change'].lower()
+        distribution = _normalize_distribution(modification['distribution'])
+        if not distribution:
+            continue
+        node = {'change': change,
+                'cell_count': modification.get('cell_count', 0),
+                'distribution': distribution}
+        if change in modifications:
+            _merge_census(modifications[change], node)
+        else:
+            modifications[change] = node
+
+    # Cell types that are modified stay in the census, even if they
+    # are empty, so that the modifications can be verified.
+    modified = set(cell for modification in modifications.values()
+                   for cell in modification['distribution'])
+    normal = dict((key, copy.deepcopy(value))
+                  for (key, value) in census.items()
+                  if key not in ('distribution', 'modifications', 'BMPs'))
+    normal['distribution'] = _normalize_distribution(
+        census['distribution'], modified)
+    if modifications:
+        normal['modifications'] = [modifications[change]
+                                   for change in sorted(modifications)]
+    bmps = dict((bmp.lower(), count)
+                for (bmp, count) in (census.get('BMPs') or {}).items()
+                if count != 0)
+    if bmps:
+        normal['BMPs'] = bmps
+    return normal
+
+
 def create_unmodified_census(census):
     """
     This creates a cell census, ignoring any modifications.  The
@@ -168,23 +543,26 @@ def create_modified_census(census):
     modifications are indicated with a sub-distribution under that
     cell type.
     """
-    mod = copy.deepcopy(census)
-    mod.pop('modifications', None)
-
-    for (cell, subcensus) in mod['distribution'].items():
-        n = subcensus['cell_count']
+    def add_cells(distribution, cell, n):
+        """
+        Add `n` cells of type `cell` to the given distribution.
+        """
+        subcensus = distribution.get(cell)
+        if subcensus is None:
+            distribution[cell] = {'cell_count': n}
+        else:
+            subcensus['cell_count'] = subcensus.get('cell_count', 0) + n
 
-        changes = {
-            'distribution': {
-                cell: {
-                    'distribution': {
-                        cell: {'cell_count': n}
-                    }
-                }
-            }
-        }
+    mod = dict((key, copy.deepcopy(value)) for (key, value) in census.items()
+               if key not in ('modifications', 'distribution'))
+    mod_distribution = mod['distribution'] = {}
 
-        mod = dict_plus(mod, changes)
+    for (cell, subcensus) in census['distribution'].items():
+        n = subcensus['cell_count']
+        node = copy.deepcopy(subcensus)
+        node['distribution'] = node.get('distribution') or {}
+        add_cells(node['distribution'], cell, n)
+        mod_distribution[cell] = node
 
     for modification in (census.get('modifications') or []):
         for (orig_cell, subcensus) in modification['distribution'].items():
@@ -193,18 +571,10 @@ def create_modified_census(census):
             soil2, land2, bmp = modification['change'].split(':')
             changed_cell = '%s:%s:%s' % (soil2 or soil1, land2 or land1, bmp)
 
-            changes = {
-                'distribution': {
-                    orig_cell: {
-                        'distribution': {
-                            orig_cell: {'cell_count': -n},
-                            changed_cell: {'cell_count': n}
-                        }
-                    }
-                }
-            }
-
-            mod = dict_plus(mod, changes)
+            node = mod_distribution.setdefault(orig_cell, {})
+            distribution = node.setdefault('distribution', {})
+            add_cells(distribution, orig_cell, -n)
+            add_cells(distribution, changed_cell, n)
 
     return mod
 
@@ -236,14 +606,10 @@ def simulate_water_quality(tree, cell_res, fn,
 
         # simulate subtrees
         if n != 0:
-            tally = {}
             for cell, subtree in tree['distribution'].items():
                 simulate_water_quality(subtree, cell_res, fn,
                                        pct, cell, precolumbian)
-                subtree_ex_dist = subtree.copy()
-                subtree_ex_dist.pop('distribution', None)
-                tally = dict_plus(tally, subtree_ex_dist)
-            tree.update(tally)  # update this node
+            tally_subtrees(tree)  # update this node
 
         # effectively a leaf
         elif n == 0:
@@ -256,12 +622,11 @@ def simulate_water_quality(tree, cell_res, fn,
         n = tree['cell_count']
 
         # canonicalize the current_cell string
-        split = current_cell.split(':')
-        if (len(split) == 2):
-            split.append('')
+        registry = get_registry()
+        code = registry.code(current_cell)
         if precolumbian:
-            split[1] = make_precolumbian(split[1])
-        current_cell = '%s:%s:%s' % tuple(split)
+            code = registry.precolumbian[code]
+        current_cell = registry.cells[code]
 
         # run the runoff model on this leaf
         result = fn(current_cell, n)  # runoff, et, inf
@@ -272,11 +637,66 @@ def simulate_water_quality(tree, cell_res, fn,
 
         # perform water quality calculation
         if n != 0:
-            soil_type, land_use, bmp = split
-            runoff_per_cell = result['runoff-vol'] / n
-            liters = get_volume_of_runoff(runoff_per_cell, n, cell_res)
-            for pol in get_pollutants():
-                tree[pol] = get_pollutant_load(land_use, pol, liters)
+            load_pollutants(tree, code, cell_res)
+
+
+def tally_subtrees(tree):
+    """
+    Store the sums of the values of a node's subtrees at that node.
+    """
+    tally = {}
+    for subtree in tree['distribution'].values():
+        subtree_ex_dist = subtree.copy()
+        subtree_ex_dist.pop('distribution', None)
+        dict_iadd(tally, subtree_ex_dist)
+    tree.update(tally)
+
+
+def load_pollutants(tree, code, cell_res):
+    """
+    Compute the pollutant loads of a simulated leaf of the cell type
+    with the given code from its runoff volume.
+    """
+    registry = get_registry()
+    registry.validate(code, 'loads')
+    loads = registry.values().loads[code]
+    n = tree['cell_count']
+    runoff_per_cell = tree['runoff-vol'] / n
+    liters = get_volume_of_runoff(runoff_per_cell, n, cell_res)
+    for (pol, emc) in zip(registry.pollutants, loads):
+        tree[pol] = pollutant_load(emc, liters)
+
+
+def apply_bmp_effect(tree, cell_res, pct,
+                     current_cell=None, precolumbian=False):
+    """
+    Retain only `pct` of the runoff of a tree that has already been
+    through `simulate_water_quality` (with a `pct` of 1.0), moving the
+    rest into infiltration and recomputing the pollutant loads.
+
+    The result is the same as that of simulating the tree again with
+    `pct`, but `fn` is not run on the leaves a second time.  The other
+    arguments are as for `simulate_water_quality`.
+    """
+    # Internal node.
+    if 'cell_count' in tree and 'distribution' in tree:
+        if tree['cell_count'] != 0:
+            for cell, subtree in tree['distribution'].items():
+                apply_bmp_effect(subtree, cell_res, pct, cell, precolumbian)
+            tally_subtrees(tree)
+
+    # Leaf node.
+    elif 'cell_count' in tree:
+        runoff_adjustment = tree['runoff-vol'] - (tree['runoff-vol'] * pct)
+        tree['runoff-vol'] -= runoff_adjustment
+        tree['inf-vol'] += runoff_adjustment
+
+        if tree['cell_count'] != 0:
+            registry = get_registry()
+            code = registry.code(current_cell)
+            if precolumbian:
+                code = registry.precolumbian[code]
+            load_pollutants(tree, code, cell_res)
 
 
 def postpass(tree):
@@ -329,7 +749,35 @@ def compute_bmp_effect(census, m2_per_pixel, precip):
         max(0.0, cubic_meters - reduction) / cubic_meters
 
 
-def simulate_modifications(census, fn, cell_res, precip, pc=False):
+def compute_bmp_effect_array(census, m2_per_pixel, precip):
+    """
+    A vectorized version of `compute_bmp_effect`, for which
+    `census['runoff-vol']` and `precip` may be arrays (for instance
+    with one element per day).  The result is an array of percents of
+    runoff remaining.
+    """
+    meters_per_inch = 0.0254
+    runoff_vol = np.asarray(census['runoff-vol'], dtype=np.float64)
+    precip = np.asarray(precip, dtype=np.float64)
+    cubic_meters = runoff_vol * meters_per_inch * m2_per_pixel
+    bmp_dict = census.get('BMPs', {})
+    bmp_keys = set(bmp_dict.keys())
+
+    reduction = np.zeros(np.broadcast(cubic_meters, precip).shape)
+    for bmp in set.intersection(set(get_bmps()), bmp_keys):
+        bmp_area = bmp_dict[bmp]
+        storage_space = (lookup_bmp_storage(bmp) * bmp_area)
+        max_reduction = lookup_bmp_drainage_ratio(bmp) * bmp_area * precip * meters_per_inch
+        bmp_reduction = np.minimum(max_reduction, storage_space)
+        reduction = reduction + bmp_reduction
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = np.maximum(0.0, cubic_meters - reduction) / cubic_meters
+    return np.where(cubic_meters == 0, 0.0, pct)
+
+
+def simulate_modifications(census, fn, cell_res, precip, pc=False,
+                           single_pass=False):
     """
     Simulate effects of modifications.
 
@@ -338,16 +786,39 @@ def simulate_modifications(census, fn, cell_res, precip, pc=False):
     `fn` is as described in `simulate_water_quality`.
 
     `cell_res` is as described in `simulate_water_quality`.
-    """
-    mod = create_modified_census(census)
-    simulate_water_quality(mod, cell_res, fn, precolumbian=pc)
-    pct = compute_bmp_effect(mod, cell_res, precip)
-    simulate_water_quality(mod, cell_res, fn, pct=pct, precolumbian=pc)
-    postpass(mod)
 
-    unmod = create_unmodified_census(census)
-    simulate_water_quality(unmod, cell_res, fn, precolumbian=pc)
-    postpass(unmod)
+    `single_pass` indicates that `fn` should be run only once on each
+    leaf of the modified tree, with the effect of BMPs applied to its
+    results afterwards (see `apply_bmp_effect`).  This gives the same
+    results as long as `fn` always returns the same result for the
+    same arguments.
+
+    Each step is a phase that `tr55.instrumentation` can measure.
+    """
+    fn = count_leaves(fn)
+
+    with phase('create_modified_census'):
+        mod = create_modified_census(census)
+    with phase('simulate_water_quality.modified'):
+        simulate_water_quality(mod, cell_res, fn, precolumbian=pc)
+    with phase('compute_bmp_effect'):
+        pct = compute_bmp_effect(mod, cell_res, precip)
+    if single_pass:
+        with phase('apply_bmp_effect'):
+            apply_bmp_effect(mod, cell_res, pct, precolumbian=pc)
+    else:
+        with phase('simulate_water_quality.bmp'):
+            simulate_water_quality(mod, cell_res, fn, pct=pct,
+                                   precolumbian=pc)
+    with phase('postpass.modified'):
+        postpass(mod)
+
+    with phase('create_unmodified_census'):
+        unmod = create_unmodified_census(census)
+    with phase('simulate_water_quality.unmodified'):
+        simulate_water_quality(unmod, cell_res, fn, precolumbian=pc)
+    with phase('postpass.unmodified'):
+        postpass(unmod)
 
     return {
         'unmodified': unmod,
@@ -365,30 +836,83 @@ def simulate_day(census, precip, cell_res=10, precolumbian=False):
 
     `precolumbian` indicates that artificial types should be turned
     into forest.
+
+    The responses of the cell types are taken from the response cache,
+    if one has been installed (see `set_response_cache`).
     """
-    et_max = 0.207
-        # From the EPA WaterSense data finder for the Philadelphia airport (19153)
-        # Converted to daily number in inches per day.
-        # http://www3.epa.gov/watersense/new_homes/wb_data_finder.html
-        # TODO: include Potential Max ET as a data layer from CGIAR
-        # http://csi.cgiar.org/aridity/Global_Aridity_PET_Methodolgy.asp
+    et_max = ET_MAX
+
+    with phase('verify_census'):
+        if 'modifications' in census:
+            verify_census(census)
+        validate_census(census, precolumbian)
 
-    if 'modifications' in census:
-        verify_census(census)
+    registry = get_registry()
+    cache = _response_cache
+
+    # The response of a cell type only depends on the cell type, so
+    # each distinct type is simulated once and its response is scaled
+    # by the number of cells wherever it appears in the trees.
+    responses = {}
 
     def fn(cell, cell_count):
-        # Compute et for cell type
-        split = cell.split(':')
-        if (len(split) == 2):
-            (land_use, bmp) = split
-        else:
-            (_, land_use, bmp) = split
-        et = et_max * lookup_ki(bmp or land_use)
+        code = registry.code(cell)
+        response = responses.get(code)
+        if response is None:
+            # Compute et for cell type
+            registry.validate(code, 'ki')
+            et = et_max * registry.values().ki[code]
+
+            # Simulate a single cell for one day
+            if cache is not None:
+                key = (code, precip, et)
+                response = cache.get(key)
+            if response is None:
+                response = simulate_cell_day(precip, et, cell, 1)
+                if cache is not None:
+                    cache.put(key, response)
+            responses[code] = response
+        return dict((key, cell_count * value)
+                    for (key, value) in response.items())
+
+    return simulate_modifications(census, fn, cell_res, precip, precolumbian,
+                                  single_pass=True)
+
+
+def validate_census(census, precolumbian=False):
+    """
+    Make sure that the tables have everything that is needed to
+    simulate the cell types in the given census (including the ones in
+    nested distributions and the ones that its modifications produce),
+    raising a `KeyError` that names the unknown land use, soil type or
+    pollutant otherwise.
+
+    `precolumbian` is as for `simulate_day`.
+    """
+    registry = get_registry()
 
-        # Simulate the cell for one day
-        return simulate_cell_day(precip, et, cell, cell_count)
+    def validate(cell, cell_count):
+        code = registry.code(cell)
+        if precolumbian:
+            code = registry.precolumbian[code]
+        registry.validate(code, 'runoff')
+        registry.validate(code, 'ki')
+        if cell_count != 0:
+            registry.validate(code, 'loads')
+
+    distributions = [census['distribution']]
+    while distributions:
+        for (cell, subcensus) in distributions.pop().items():
+            validate(cell, subcensus['cell_count'])
+            if 'distribution' in subcensus:
+                distributions.append(subcensus['distribution'])
 
-    return simulate_modifications(census, fn, cell_res, precip, precolumbian)
+    for modification in (census.get('modifications') or []):
+        soil2, land2, bmp = modification['change'].split(':')
+        for (orig_cell, subcensus) in modification['distribution'].items():
+            soil1, land1 = orig_cell.split(':')
+            changed_cell = '%s:%s:%s' % (soil2 or soil1, land2 or land1, bmp)
+            validate(changed_cell, subcensus['cell_count'])
 
 
 def verify_census(census):
@@ -3,13 +3,26 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import division
 
+import copy
 import sys
 
 
-def tandem_walk(op, neutral, pred, left, right):
+if sys.version_info.major == 3:
+    NUMBER_TYPES = (int, float)
+else:
+    NUMBER_TYPES = (int, long, float)  # noqa
+
+
+# Returned by `_tandem_step` when both halves are dictionaries that
+# must be walked key-by-key.
+_BOTH_DICTS = object()
+
+
+def _tandem_step(op, neutral, pred, left, right):
     """
-    Walk two similarly-structured dictionaries in tandem, performing
-    the given operation when both halves satisfy the given predicate.
+    Combine one pair of values as `tandem_walk` does, except that
+    `_BOTH_DICTS` is returned instead of descending into a pair of
+    dictionaries.
     """
     if pred(left) and pred(right):
         return op(left, right)
@@ -22,30 +35,88 @@ def tandem_walk(op, neutral, pred, left, right):
     elif left is None and isinstance(right, dict):
         return right.copy()
     elif isinstance(left, dict) and isinstance(right, dict):
-        retval = {}
-        union = set(left.keys()) | set(right.keys())
-        for key in union:
-            left_val = left.get(key)
-            right_val = right.get(key)
-            retval[key] = tandem_walk(op, neutral, pred, left_val, right_val)
+        return _BOTH_DICTS
+
+
+def tandem_walk(op, neutral, pred, left, right):
+    """
+    Walk two similarly-structured dictionaries in tandem, performing
+    the given operation when both halves satisfy the given predicate.
+    """
+    retval = _tandem_step(op, neutral, pred, left, right)
+    if retval is not _BOTH_DICTS:
         return retval
 
+    retval = {}
+    stack = [(retval, left, right)]
+    while stack:
+        (target, left, right) = stack.pop()
+        for (key, left_val) in left.items():
+            right_val = right.get(key)
+            value = _tandem_step(op, neutral, pred, left_val, right_val)
+            if value is _BOTH_DICTS:
+                value = {}
+                stack.append((value, left_val, right_val))
+            target[key] = value
+        for (key, right_val) in right.items():
+            if key not in left:
+                value = _tandem_step(op, neutral, pred, None, right_val)
+                target[key] = value
+    return retval
+
+
+def tandem_walk_inplace(op, neutral, pred, left, right):
+    """
+    Walk two similarly-structured dictionaries in tandem like
+    `tandem_walk`, but store the results in `left` instead of in a
+    new dictionary.  `left` is returned.
+
+    Values of `left` whose keys do not appear in `right` are left
+    alone.  Sub-dictionaries of `right` that have no counterpart in
+    `left` are deep-copied into it, so that `left` never shares
+    structure with `right`.
+    """
+    stack = [(left, right)]
+    while stack:
+        (target, right) = stack.pop()
+        for (key, right_val) in right.items():
+            left_val = target.get(key)
+            if isinstance(left_val, dict) and isinstance(right_val, dict) \
+               and not (pred(left_val) and pred(right_val)):
+                stack.append((left_val, right_val))
+            elif isinstance(left_val, dict) and right_val is None:
+                pass
+            elif left_val is None and isinstance(right_val, dict) \
+                    and not pred(right_val):
+                target[key] = copy.deepcopy(right_val)
+            else:
+                target[key] = _tandem_step(op, neutral, pred,
+                                           left_val, right_val)
+    return left
+
 
 def is_number(obj):
     """
     Is obj a number?
     """
-    if sys.version_info.major == 3:
-        types = (int, float)
-    else:
-        types = (int, long, float)
-    return isinstance(obj, types)
+    return isinstance(obj, NUMBER_TYPES)
+
+
+def _plus(x, y):
+    return x + y
 
 
 def dict_plus(left, right):
     """
     Sum of two similarly-structured dictionaries.
     """
-    def plus(x, y):
-        return x + y
-    return tandem_walk(plus, 0, is_number, left, right)
+    return tandem_walk(_plus, 0, is_number, left, right)
+
+
+def dict_iadd(left, right):
+    """
+    Add a similarly-structured dictionary to `left` in place, so that
+    `left` becomes `dict_plus(left, right)` (except that values found
+    only in `left` are not touched).  `left` is returned.
+    """
+    return tandem_walk_inplace(_plus, 0, is_number, left, right)
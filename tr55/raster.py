@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+Censuses and results from rasters.
+
+A census counts the cells of each "soil:land_use" type in an area of
+interest.  Given aligned rasters of NLCD land cover classes and of
+hydrologic soil groups, each pixel is turned into the index of its
+cell type, and the cell types are counted with `np.bincount`.  The
+same indices give per-pixel runoff, evapotranspiration and
+infiltration rasters (see `simulate_rasters`).
+"""
+
+import numpy as np
+
+from tr55.matrix import CensusMatrix
+from tr55.model import ET_MAX, simulate_cells_day
+from tr55.registry import get_registry
+from tr55.tables import LAND_USE_VALUES, SOIL_TYPES
+
+# The hydrologic soil groups of the soil raster values.  The dual
+# groups (A/D, B/D and C/D) are treated as D, their undrained group.
+SOIL_RASTER_VALUES = {
+    1: 'a',
+    2: 'b',
+    3: 'c',
+    4: 'd',
+    5: 'd',
+    6: 'd',
+    7: 'd',
+}
+
+# The land uses with an NLCD class, ordered by class.
+LAND_USES = sorted((land_use for land_use in LAND_USE_VALUES
+                    if 'nlcd' in LAND_USE_VALUES[land_use]),
+                   key=lambda land_use: LAND_USE_VALUES[land_use]['nlcd'])
+
+# The cell types, in the order of their indices.
+CELL_TYPES = ['%s:%s' % (soil_type, land_use)
+              for land_use in LAND_USES for soil_type in SOIL_TYPES]
+
+DEFAULT_CHUNK_SIZE = 1 << 22
+
+# `zone_matrix` counts the (zone, cell type) pairs of a chunk in a dense
+# array if it has at most this many elements per pixel of the chunk.
+DENSE_COUNTS = 4
+
+
+def _lookup_table(mapping):
+    """
+    Turn a mapping from small non-negative integers to indices into a
+    lookup array, with -1 for the integers that are not mapped.
+    """
+    table = np.full(max(mapping) + 1, -1, dtype=np.intp)
+    for (value, index) in mapping.items():
+        table[value] = index
+    return table
+
+
+_land_table = _lookup_table(dict(
+    (LAND_USE_VALUES[land_use]['nlcd'], index)
+    for (index, land_use) in enumerate(LAND_USES)))
+
+_soil_table = _lookup_table(dict(
+    (value, SOIL_TYPES.index(soil_type))
+    for (value, soil_type) in SOIL_RASTER_VALUES.items()))
+
+
+def _lookup(table, values):
+    values = np.asarray(values)
+    known = (values >= 0) & (values < len(table))
+    return np.where(known, table[np.where(known, values, 0)], -1)
+
+
+def cell_type_indices(land_cover, soil):
+    """
+    Return the index (into `CELL_TYPES`) of the cell type of each
+    pixel of the given aligned land cover and soil arrays, or -1 for
+    pixels with an unknown land cover class or soil group.
+    """
+    land = _lookup(_land_table, land_cover)
+    soil = _lookup(_soil_table, soil)
+    return np.where((land >= 0) & (soil >= 0),
+                    land * len(SOIL_TYPES) + soil, -1)
+
+
+def _flatten(arrays, names):
+    """
+    Flatten the given aligned arrays (None stays None).
+    """
+    flat = [None if array is None else np.asarray(array).reshape(-1)
+            for array in arrays]
+    size = flat[0].shape
+    for (array, name) in zip(flat[1:], names[1:]):
+        if array is not None and array.shape != size:
+            raise ValueError('The %s is not aligned with the %s'
+                             % (name, names[0]))
+    return flat
+
+
+def _cell_type_chunks(land_cover, soil, mask, chunk_size, zones=None):
+    """
+    Yield the cell type indices of the counted pixels of each chunk of
+    the given rasters, along with their zones if there are any.
+    """
+    (land_cover, soil, mask, zones) = _flatten(
+        [land_cover, soil, mask, zones],
+        ['land cover raster', 'soil raster', 'mask', 'zone raster'])
+    for start in range(0, max(len(land_cover), 1), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        indices = cell_type_indices(land_cover[chunk], soil[chunk])
+        counted = indices >= 0
+        if mask is not None:
+            counted &= np.asarray(mask[chunk], dtype=bool)
+        if zones is None:
+            yield (indices[counted], None)
+        else:
+            yield (indices[counted], zones[chunk][counted])
+
+
+def census_from_rasters(land_cover, soil, mask=None,
+                        chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Build a census (as taken by `simulate_day`) from rasters.
+
+    `land_cover` and `soil` are aligned integer arrays (which may be
+    `np.memmap`s) of NLCD land cover classes and hydrologic soil
+    groups (see `SOIL_RASTER_VALUES`).
+
+    `mask` is an optional boolean (or integer) array that is true (non
+    zero) for the pixels in the area of interest.
+
+    Pixels with a land cover class or soil group that the tables do not
+    know are not counted.  The arrays are processed `chunk_size` pixels
+    at a time, so that large rasters do not have to fit in memory.
+    """
+    counts = np.zeros(len(CELL_TYPES), dtype=np.int64)
+    for (indices, _) in _cell_type_chunks(land_cover, soil, mask,
+                                          chunk_size):
+        counts += np.bincount(indices, minlength=len(CELL_TYPES))
+
+    return {
+        'cell_count': int(counts.sum()),
+        'distribution': dict(
+            (CELL_TYPES[index], {'cell_count': int(counts[index])})
+            for index in np.flatnonzero(counts).tolist())
+    }
+
+
+def zone_matrix(zones, land_cover, soil, mask=None, nodata=None,
+                chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Count the cell types of every zone of a zone raster at once.
+
+    `zones` is an integer array of zone IDs (catchments, say) that is
+    aligned with the `land_cover` and `soil` rasters; pixels whose
+    zone is `nodata` are not counted.  The other arguments are as for
+    `census_from_rasters`.
+
+    The return value is a pair of the sorted array of the IDs of the
+    zones with counted pixels and a `tr55.matrix.CensusMatrix` with a
+    row for each of those zones, which can be passed to
+    `tr55.matrix.simulate_matrix`.
+    """
+    types = len(CELL_TYPES)
+    (pair_zones, pair_types, pair_counts) = ([], [], [])
+    for (indices, zone_ids) in _cell_type_chunks(land_cover, soil, mask,
+                                                 chunk_size, zones):
+        if nodata is not None:
+            counted = zone_ids != nodata
+            (indices, zone_ids) = (indices[counted], zone_ids[counted])
+
+        # Count the (zone, cell type) pairs of this chunk, densely if
+        # that takes no more than a few times the memory of the chunk
+        # (small non-negative zone IDs can be used as rows directly,
+        # which saves sorting them), and by sorting the pairs otherwise.
+        dense = DENSE_COUNTS * chunk_size
+        if len(zone_ids) and zone_ids.min() >= 0 and \
+           (int(zone_ids.max()) + 1) * types <= dense:
+            chunk_zones = np.arange(zone_ids.max() + 1,
+                                    dtype=zone_ids.dtype)
+            rows = zone_ids.astype(np.intp)
+        else:
+            (chunk_zones, rows) = np.unique(zone_ids, return_inverse=True)
+        keys = rows.reshape(-1).astype(np.intp) * types + indices
+        if len(chunk_zones) * types <= dense:
+            counts = np.bincount(keys, minlength=len(chunk_zones) * types)
+            pairs = np.flatnonzero(counts)
+            counts = counts[pairs]
+        else:
+            (pairs, counts) = np.unique(keys, return_counts=True)
+        pair_zones.append(chunk_zones[pairs // types])
+        pair_types.append(pairs % types)
+        pair_counts.append(counts)
+
+    # Add up the counts of the pairs that are in more than one chunk.
+    (zone_ids, rows) = np.unique(np.concatenate(pair_zones),
+                                 return_inverse=True)
+    keys = rows.reshape(-1) * types + np.concatenate(pair_types)
+    (pairs, inverse) = np.unique(keys, return_inverse=True)
+    counts = np.zeros(len(pairs), dtype=np.int64)
+    np.add.at(counts, inverse.reshape(-1), np.concatenate(pair_counts))
+    (rows, indices) = (pairs // types, pairs % types)
+
+    (used, cols) = np.unique(indices, return_inverse=True)
+    codes = get_registry().codes([CELL_TYPES[index]
+                                  for index in used.tolist()])
+    cell_counts = np.zeros(len(zone_ids), dtype=np.int64)
+    np.add.at(cell_counts, rows, counts)
+    return (zone_ids, CensusMatrix(rows, cols.reshape(-1), counts, codes,
+                                   cell_counts))
+
+
+def zone_censuses(zones, land_cover, soil, mask=None, nodata=None,
+                  chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Build a census for every zone of a zone raster at once.  The
+    arguments are as for `zone_matrix`.
+
+    The return value is a dictionary from zone ID to census.
+    """
+    (zone_ids, matrix) = zone_matrix(zones, land_cover, soil, mask, nodata,
+                                     chunk_size)
+    registry = get_registry()
+    cells = ['%s:%s' % (registry.soil_types[code], registry.land_uses[code])
+             for code in matrix.codes.tolist()]
+    censuses = dict((zone_id, {'cell_count': cell_count, 'distribution': {}})
+                    for (zone_id, cell_count)
+                    in zip(zone_ids.tolist(), matrix.cell_counts.tolist()))
+    zone_ids = zone_ids.tolist()
+    for (row, col, count) in zip(matrix.rows.tolist(), matrix.cols.tolist(),
+                                 matrix.counts.tolist()):
+        census = censuses[zone_ids[row]]
+        census['distribution'][cells[col]] = {'cell_count': count}
+    return censuses
+
+
+def simulate_rasters(land_cover, soil, precip, et_max=ET_MAX,
+                     precolumbian=False, mask=None, out=None, nodata=np.nan,
+                     tile_size=DEFAULT_CHUNK_SIZE):
+    """
+    Simulate a day for every pixel of the given rasters.
+
+    `land_cover`, `soil` and `mask` are as for `census_from_rasters`.
+
+    `precip` is the amount of precipitation in inches and `et_max` is
+    the maximum evapotranspiration in inches (before taking the
+    crop/landscape factor into account).  Each of them is either a
+    single value or a raster aligned with `land_cover`.
+
+    `precolumbian` is as for `simulate_day`.
+
+    `out` is an optional tuple of three arrays shaped like
+    `land_cover` (for instance `np.memmap`s) to write the results
+    into; by default new arrays are allocated.
+
+    The return value is the tuple of runoff, evapotranspiration and
+    infiltration rasters, in inches.  Pixels outside of the mask, or
+    with an unknown land cover class or soil group, are `nodata`.  The
+    rasters are processed in tiles of about `tile_size` pixels, so
+    that large rasters do not have to fit in memory.
+    """
+    land_cover = np.asarray(land_cover)
+    shape = land_cover.shape
+    if land_cover.ndim == 0:
+        raise ValueError('The land cover raster must have at least 1 axis')
+    rasters = [(soil, 'soil raster'), (mask, 'mask'),
+               (precip, 'precipitation'), (et_max, 'maximum ET')]
+    for (raster, name) in rasters:
+        if raster is not None and np.ndim(raster) != 0 and \
+           np.shape(raster) != shape:
+            raise ValueError('The %s is not aligned with the land cover '
+                             'raster' % name)
+    if out is None:
+        out = tuple(np.empty(shape) for _ in range(3))
+    elif len(out) != 3 or any(np.shape(array) != shape for array in out):
+        raise ValueError('The outputs must be three arrays shaped like the '
+                         'land cover raster')
+
+    registry = get_registry()
+    codes = registry.codes(CELL_TYPES)
+    if precolumbian:
+        codes = registry.columns().precolumbian[codes]
+    registry.check(codes)
+
+    # With the same precipitation and ET everywhere, the response of
+    # each cell type only has to be computed once.
+    uniform = np.ndim(precip) == 0 and np.ndim(et_max) == 0
+    if uniform:
+        responses = simulate_cells_day(precip, et_max, codes)
+
+    row_size = int(np.prod(shape[1:]))
+    rows_per_tile = max(1, tile_size // max(row_size, 1))
+    for start in range(0, shape[0], rows_per_tile):
+        tile = slice(start, start + rows_per_tile)
+        indices = cell_type_indices(land_cover[tile], soil[tile])
+        known = indices >= 0
+        if mask is not None:
+            known &= np.asarray(mask[tile], dtype=bool)
+        if uniform:
+            values = [response[indices] for response in responses]
+        else:
+            values = simulate_cells_day(
+                precip[tile] if np.ndim(precip) else precip,
+                et_max[tile] if np.ndim(et_max) else et_max,
+                codes[indices])
+        for (raster, value) in zip(out, values):
+            raster[tile] = np.where(known, value, nodata)
+
+    return out
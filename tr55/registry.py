@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+"""
+A registry of cell types.
+
+Cell types are given as strings of the form "soil:land_use" or
+"soil:land_use:bmp".  The registry interns each such string as a small
+integer code the first time that it is seen, and it keeps all of the
+properties that the model derives from a cell type (curve number,
+landscape coefficient, NLCD class, and so on) in flat arrays indexed
+by that code, so that the strings only have to be parsed once.
+
+Only cell types whose soil type, land use and BMP are in the tables
+are registered, so the registry stays as small as the tables.  The
+other spellings of registered cell types ("A:Pasture", "a:pasture:")
+are remembered in a cache of bounded size.
+"""
+
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from tr55.tables import LAND_USE_VALUES, SOIL_TYPES
+from tr55.tablelookup import lookup_cn, lookup_ki, lookup_nlcd, \
+    lookup_load, lookup_pitt_index, lookup_pitt_runoff, is_bmp, \
+    is_built_type, make_precolumbian, get_pollutants, on_invalidate_tables
+
+
+CellColumns = namedtuple('CellColumns', [
+    'soil_type', 'curve_number', 'ki', 'nlcd', 'built', 'bmp',
+    'pitt_land_use', 'pitt_soil_type', 'precolumbian', 'loads'])
+
+# The number of spellings of cell types that a registry remembers.
+MAX_SPELLINGS = 4096
+
+# Called with the number of cell types whose properties are looked up
+# every time that a registry compiles them, while instrumentation is
+# enabled (see `tr55.instrumentation`).
+_compile_hook = None
+
+
+def set_compile_hook(hook):
+    """
+    Set the function to be called with the number of cell types that
+    a registry compiles, or None to stop calling one.
+    """
+    global _compile_hook
+    _compile_hook = hook
+
+
+def canonical_cell(cell):
+    """
+    Return the canonical "soil:land_use:bmp" form of the given cell
+    type string.
+    """
+    split = cell.lower().split(':')
+    if len(split) == 2:
+        split.append('')
+    if len(split) != 3:
+        raise ValueError('Invalid cell type: %s' % cell)
+    return '%s:%s:%s' % tuple(split)
+
+
+def _or_none(lookup, *args):
+    """
+    Return the result of the given table lookup, or None if the table
+    has no such entry.
+    """
+    try:
+        return lookup(*args)
+    except KeyError:
+        return None
+
+
+class CellRegistry(object):
+    """
+    An interning table of cell types.
+
+    For the cell type with code `i`:
+     * `cells[i]` is its canonical "soil:land_use:bmp" string
+     * `soil_types[i]`, `land_uses[i]` and `bmps[i]` are its parts
+     * `runoff_land_uses[i]` is the land use that produces its runoff
+       (the BMP if that behaves like a land use, e.g. no_till)
+     * `et_land_uses[i]` is the land use that determines its
+       landscape coefficient (the BMP if there is one)
+     * `precolumbian[i]` is the code of its Pre-Columbian projection
+
+    The derived numerical properties are available as NumPy arrays
+    from `columns` (or as lists from `values`).  Properties that the
+    tables do not define for a cell type are NaN (or -1 for integers);
+    `validate` makes sure that the properties of a cell type that are
+    needed are there before they are used.
+
+    `compilations` counts the cell types whose properties have been
+    looked up in the tables to build `columns`.
+    """
+    def __init__(self):
+        self._codes = {}
+        self._spellings = {}
+        self._lock = threading.RLock()
+        self._columns = None
+        self._values = None
+        self._valid = {'runoff': set(), 'ki': set(), 'loads': set()}
+        self.pollutants = sorted(get_pollutants())
+        self.cells = []
+        self.soil_types = []
+        self.land_uses = []
+        self.bmps = []
+        self.runoff_land_uses = []
+        self.et_land_uses = []
+        self.precolumbian = []
+        self.compilations = 0
+
+    def __len__(self):
+        return len(self.cells)
+
+    def code(self, cell):
+        """
+        Return the code of the given cell type string, registering it
+        if it has not been seen before.  A `KeyError` is raised if the
+        tables do not have its soil type, land use or BMP.
+        """
+        try:
+            return self._spellings[cell]
+        except KeyError:
+            with self._lock:
+                canonical = canonical_cell(cell)
+                code = self._codes.get(canonical)
+                if code is None:
+                    code = self._register(canonical)
+                if len(self._spellings) >= MAX_SPELLINGS:
+                    self._spellings.clear()
+                # Only now, once its properties are all there, can
+                # other threads find the code without the lock.
+                self._spellings[cell] = code
+                return code
+
+    def codes(self, cells):
+        """
+        Return an array of the codes of the given cell type strings.
+        """
+        return np.array([self.code(cell) for cell in cells], dtype=np.intp)
+
+    def _register(self, canonical):
+        soil_type, land_use, bmp = canonical.split(':')
+        # In the order in which the table lookups would fail.
+        if bmp and bmp not in LAND_USE_VALUES:
+            raise KeyError('Unknown land use: %s' % bmp)
+        if land_use not in LAND_USE_VALUES:
+            raise KeyError('Unknown land use: %s' % land_use)
+        if soil_type not in SOIL_TYPES:
+            raise KeyError('Unknown soil type: %s' % soil_type)
+
+        code = len(self.cells)
+        self.cells.append(canonical)
+        self.soil_types.append(soil_type)
+        self.land_uses.append(land_use)
+        self.bmps.append(bmp)
+        self.runoff_land_uses.append(None)
+        self.et_land_uses.append(None)
+        self.precolumbian.append(code)
+        self._derive(code)
+        self._codes[canonical] = code
+        return code
+
+    def _derive(self, code):
+        """
+        Work out the land uses and the Pre-Columbian projection of the
+        cell type with the given code, which depend on the tables.
+        """
+        (soil_type, land_use, bmp) = (self.soil_types[code],
+                                      self.land_uses[code], self.bmps[code])
+        if bmp and not is_bmp(bmp):
+            self.runoff_land_uses[code] = bmp
+        else:
+            self.runoff_land_uses[code] = land_use
+        self.et_land_uses[code] = bmp or land_use
+        projected = '%s:%s:%s' % (soil_type, make_precolumbian(land_use), bmp)
+        if projected != self.cells[code]:
+            self.precolumbian[code] = self.code(projected)
+        else:
+            self.precolumbian[code] = code
+
+    def invalidate(self):
+        """
+        Forget everything that has been derived from the tables about
+        the registered cell types (see
+        `tr55.tablelookup.invalidate_tables`).  The codes stay the
+        same.
+        """
+        with self._lock:
+            self._columns = None
+            self._values = None
+            self._valid = {'runoff': set(), 'ki': set(), 'loads': set()}
+            self.pollutants = sorted(get_pollutants())
+            code = 0
+            while code < len(self.cells):
+                self._derive(code)
+                code += 1
+
+    def check(self, codes, loaded_codes=()):
+        """
+        Make sure that the tables have everything that is needed to
+        simulate the given cell types, raising the same errors as the
+        table lookups otherwise.  `loaded_codes` are the cell types
+        whose pollutant loads are needed as well.
+        """
+        for code in np.unique(codes).tolist():
+            self.validate(code, 'runoff')
+            self.validate(code, 'ki')
+        for code in np.unique(loaded_codes).tolist():
+            self.validate(code, 'loads')
+
+    def validate(self, code, properties):
+        """
+        Make sure that the tables define the given properties of the
+        cell type with the given code, raising the same errors as the
+        table lookups otherwise.  `properties` is "runoff" (the curve
+        number and, for built types, the Pitt runoff ratios), "ki" (the
+        landscape coefficient) or "loads" (the event mean
+        concentrations of the pollutants).
+
+        Each cell type is only checked once, so this is cheap enough
+        to do before every use of `values`.
+        """
+        valid = self._valid[properties]
+        if code in valid:
+            return
+        columns = self.columns()
+        soil_type = self.soil_types[code]
+        if properties == 'runoff':
+            land_use = self.runoff_land_uses[code]
+            if np.isnan(columns.curve_number[code]):
+                lookup_cn(soil_type, land_use)
+            if is_built_type(land_use) and not columns.built[code]:
+                lookup_pitt_runoff(soil_type, land_use)
+                lookup_pitt_index(soil_type, land_use)
+        elif properties == 'ki':
+            if np.isnan(columns.ki[code]):
+                lookup_ki(self.et_land_uses[code])
+        elif properties == 'loads':
+            if np.isnan(columns.loads[code]).any():
+                nlcd = lookup_nlcd(self.land_uses[code])
+                for pollutant in self.pollutants:
+                    lookup_load(nlcd, pollutant)
+        valid.add(code)
+
+    def columns(self):
+        """
+        Return the derived properties of all registered cell types as
+        a `CellColumns` tuple of arrays indexed by code.  Only the cell
+        types registered since the last call are looked up.
+        """
+        columns = self._columns
+        if columns is None or len(columns.ki) != len(self.cells):
+            with self._lock:
+                columns = self._columns
+                n = len(self.cells)
+                if columns is None:
+                    columns = self._compile(0, n)
+                elif len(columns.ki) != n:
+                    added = self._compile(len(columns.ki), n)
+                    columns = CellColumns(*[
+                        np.concatenate([column, new])
+                        for (column, new) in zip(columns, added)])
+                self._columns = columns
+        return columns
+
+    def values(self):
+        """
+        Return the derived properties of all registered cell types as
+        a `CellColumns` tuple of lists indexed by code (see
+        `columns`).
+        """
+        values = self._values
+        if values is None or len(values.ki) != len(self.cells):
+            with self._lock:
+                columns = self.columns()
+                values = self._values
+                start = 0 if values is None else len(values.ki)
+                if start == 0:
+                    values = CellColumns(
+                        *[column.tolist() for column in columns])
+                elif start != len(columns.ki):
+                    values = CellColumns(*[
+                        old + column[start:].tolist()
+                        for (old, column) in zip(values, columns)])
+                self._values = values
+        return values
+
+    def _compile(self, start, stop):
+        """
+        Look up the properties of the cell types with codes from
+        `start` to `stop` in the tables.
+        """
+        n = stop - start
+        soil_type = np.full(n, -1, dtype=np.intp)
+        curve_number = np.full(n, np.nan)
+        ki = np.full(n, np.nan)
+        nlcd = np.full(n, -1, dtype=np.intp)
+        built = np.zeros(n, dtype=bool)
+        bmp = np.zeros(n, dtype=bool)
+        pitt_land_use = np.zeros(n, dtype=np.intp)
+        pitt_soil_type = np.zeros(n, dtype=np.intp)
+        loads = np.full((n, len(self.pollutants)), np.nan)
+        precolumbian = np.array(self.precolumbian[start:stop],
+                                dtype=np.intp)
+        self.compilations += n
+        if _compile_hook is not None:
+            _compile_hook(n)
+
+        for (row, code) in enumerate(range(start, stop)):
+            soil = self.soil_types[code]
+            runoff_land_use = self.runoff_land_uses[code]
+            if soil in SOIL_TYPES:
+                soil_type[row] = SOIL_TYPES.index(soil)
+            value = _or_none(lookup_cn, soil, runoff_land_use)
+            if value is not None:
+                curve_number[row] = value
+            value = _or_none(lookup_ki, self.et_land_uses[code])
+            if value is not None:
+                ki[row] = value
+            if is_built_type(runoff_land_use):
+                index = _or_none(lookup_pitt_index, soil, runoff_land_use)
+                if index is not None:
+                    built[row] = True
+                    (pitt_land_use[row], pitt_soil_type[row]) = index
+            bmp[row] = is_bmp(self.bmps[code])
+            value = _or_none(lookup_nlcd, self.land_uses[code])
+            if value is not None:
+                nlcd[row] = value
+                for (i, pollutant) in enumerate(self.pollutants):
+                    load = _or_none(lookup_load, value, pollutant)
+                    if load is not None:
+                        loads[row, i] = load
+
+        return CellColumns(soil_type, curve_number, ki, nlcd, built, bmp,
+                           pitt_land_use, pitt_soil_type, precolumbian, loads)
+
+
+_registry = CellRegistry()
+on_invalidate_tables(_registry.invalidate)
+
+
+def get_registry():
+    """
+    Return the registry shared by the model functions.
+    """
+    return _registry
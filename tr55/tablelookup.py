@@ -7,10 +7,80 @@ from __future__ import division
 Various routines to do table lookups.
 """
 
+import hashlib
+import json
+from collections import namedtuple
+
+import numpy as np
+
+from tr55 import tables
 from tr55.tables import BMPS, BUILT_TYPES, LAND_USE_VALUES, \
     SSH_RAINFALL_STEPS, SSH_RUNOFF_RATIOS, NON_NATURAL, POLLUTANTS, POLLUTION_LOADS
 
 
+# Incremented every time that the tables are changed (see
+# `invalidate_tables`).
+_generation = 0
+
+_invalidation_callbacks = []
+
+
+def table_generation():
+    """
+    Return a number that changes every time that `invalidate_tables`
+    is called, so that anything derived from the tables can tell
+    whether it is out of date.
+    """
+    return _generation
+
+
+_version = (None, None)
+
+
+def table_version():
+    """
+    Return a digest of the contents of the tables in `tr55.tables`,
+    which changes when they do (once `invalidate_tables` has been
+    called).  Unlike `table_generation`, it is the same in every
+    process that has the same tables.
+    """
+    global _version
+    (generation, version) = _version
+    if generation != _generation:
+        contents = dict((name, value) for (name, value) in vars(tables).items()
+                        if name.isupper())
+        text = json.dumps(contents, sort_keys=True, default=sorted)
+        version = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        _version = (_generation, version)
+    return version
+
+
+def on_invalidate_tables(callback):
+    """
+    Register a function to be called (with no arguments) every time
+    that `invalidate_tables` is called.
+    """
+    _invalidation_callbacks.append(callback)
+
+
+def invalidate_tables():
+    """
+    Forget everything that has been derived from the tables in
+    `tr55.tables`.  This must be called after changing (overriding)
+    any of those tables, so that the compiled Pitt table, the cell
+    type registry and any response cache (see
+    `tr55.model.ResponseCache`) are brought up to date.
+
+    Censuses that were compiled before (see `tr55.compiled`) are not
+    updated, and should be compiled again.
+    """
+    global _generation, _pitt_table
+    _pitt_table = None
+    _generation += 1
+    for callback in list(_invalidation_callbacks):
+        callback()
+
+
 def lookup_ki(land_use):
     """
     Lookup the landuse coefficient.
@@ -72,6 +142,57 @@ def lookup_pitt_runoff(soil_type, land_use):
         return {'precip': SSH_RAINFALL_STEPS, 'Rv': SSH_RUNOFF_RATIOS[land_use]['runoff_ratio'][soil_type]}
 
 
+PittTable = namedtuple('PittTable', ['land_uses', 'soil_types', 'steps',
+                                     'ratios'])
+
+
+_pitt_table = None
+
+
+def compile_pitt_table():
+    """
+    Compile the Pitt Small Storm Hydrology tables into dense arrays.
+
+    The result has the built-type land uses and the soil types that
+    index the first two axes of `ratios`, which is a (land use, soil
+    type, rainfall step) array of runoff ratios, and `steps` holds the
+    rainfall steps.
+    """
+    land_uses = sorted(SSH_RUNOFF_RATIOS.keys())
+    soil_types = sorted(SSH_RUNOFF_RATIOS[land_uses[0]]['runoff_ratio'].keys())
+    steps = np.array(SSH_RAINFALL_STEPS, dtype=np.float64)
+    ratios = np.array([[SSH_RUNOFF_RATIOS[land_use]['runoff_ratio'][soil_type]
+                        for soil_type in soil_types]
+                       for land_use in land_uses], dtype=np.float64)
+    return PittTable(land_uses, soil_types, steps, ratios)
+
+
+def lookup_pitt_table():
+    """
+    Returns the compiled Pitt Small Storm Hydrology table (see
+    `compile_pitt_table`), compiling it on first use.
+    """
+    global _pitt_table
+    if _pitt_table is None:
+        _pitt_table = compile_pitt_table()
+    return _pitt_table
+
+
+def lookup_pitt_index(soil_type, land_use):
+    """
+    Returns the (land use, soil type) indices of the given pair in the
+    compiled Pitt Small Storm Hydrology table.
+    """
+    table = lookup_pitt_table()
+    if land_use not in table.land_uses:
+        raise KeyError('Land use %s not a built-type.' % land_use)
+    elif soil_type not in table.soil_types:
+        raise KeyError('Unknown soil type: %s' % soil_type)
+    else:
+        return (table.land_uses.index(land_use),
+                table.soil_types.index(soil_type))
+
+
 def is_bmp(land_use):
     """
     Test to see if the land use is a BMP.
@@ -101,7 +222,7 @@ def lookup_load(nlcd_class, pollutant):
     Get the Event Mean Concentration of `pollutant` for land use
     class `nlcd_class`
     """
-    if pollutant not in ['tn', 'tp', 'bod', 'tss']:
+    if pollutant not in POLLUTANTS:
         raise KeyError('Unknown pollutant type: %s' % pollutant)
     elif nlcd_class not in POLLUTION_LOADS:
         raise KeyError('Unknown NLCD class: %s' % nlcd_class)
@@ -116,8 +237,8 @@ def lookup_nlcd(land_use):
     if land_use not in LAND_USE_VALUES:
         raise KeyError('Unknown land use type: %s' % land_use)
     elif 'nlcd' not in LAND_USE_VALUES[land_use]:
-        raise KeyError('Land use type %s does not have an NLCD class defined',
-                        land_use)
+        raise KeyError('Land use type %s does not have an NLCD class defined'
+                       % land_use)
     else:
         return LAND_USE_VALUES[land_use]['nlcd']
 
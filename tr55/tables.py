@@ -217,6 +217,9 @@ BUILT_TYPES = set(['developed_open', 'developed_low', 'developed_med',
 
 NON_NATURAL = set(['pasture', 'cultivated_crops', 'green_roof']) | set(['no_till']) | BMPS | BUILT_TYPES
 
+# The hydrologic soil groups, in the order of their indices.
+SOIL_TYPES = ['a', 'b', 'c', 'd']
+
 # The set of pollutants that we are concerned with.
 POLLUTANTS = set(['tn', 'tp', 'bod', 'tss'])
 
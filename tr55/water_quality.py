@@ -43,12 +43,20 @@ def get_pollutant_load(use_type, pollutant, runoff_liters):
     amount of runoff generated on that area and an event mean concentration
     of the pollutant.  Returns the pollutant load in lbs.
     """
-    mg_per_kg = 1000000
-    lbs_per_kg = 2.205
-
     nlcd = lookup_nlcd(use_type)
     emc = lookup_load(nlcd, pollutant)
 
+    return pollutant_load(emc, runoff_liters)
+
+
+def pollutant_load(emc, runoff_liters):
+    """
+    Calculate the pollutant load, in lbs, of an amount of runoff with
+    the given event mean concentration of the pollutant.
+    """
+    mg_per_kg = 1000000
+    lbs_per_kg = 2.205
+
     load_mg_l = emc * runoff_liters
 
     return (load_mg_l / mg_per_kg) * lbs_per_kg